@@ -0,0 +1,268 @@
+"""In-memory stand-ins for Kafka and Trino, for running the pipeline benchmarks offline
+
+``FakeKafka`` keeps topics as per-partition message lists and hands out
+producers with the confluent-kafka ``Producer`` surface used by
+``EventProducer`` (like ``MockProducer``, but the messages are kept).
+``FakeTrino`` answers the statements ``kafka_to_iceberg.py`` issues against
+the Kafka connector and the Iceberg target table, and sleeps according to a
+simple cost model (a fixed per-query overhead plus a scan rate) so that batch
+size, parallelism and interval trade-offs look roughly like they do on Trino.
+"""
+
+import json
+import re
+import threading
+import time
+import zlib
+
+
+class FakeMessage:
+    def __init__(self, topic, partition, offset, key, value):
+        self._topic = topic
+        self._partition = partition
+        self._offset = offset
+        self._key = key
+        self._value = value
+
+    def topic(self):
+        return self._topic
+
+    def partition(self):
+        return self._partition
+
+    def offset(self):
+        return self._offset
+
+    def key(self):
+        return self._key
+
+    def value(self):
+        return self._value
+
+    def error(self):
+        return None
+
+
+class FakeKafka:
+    """Topics with a fixed number of partitions; keys are hashed to partitions like librdkafka's default"""
+
+    def __init__(self, partitions=4):
+        self.partitions = partitions
+        self._lock = threading.Lock()
+        self._topics = {}
+
+    def append(self, topic, key, value):
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        key_bytes = key.encode('utf-8') if isinstance(key, str) else key
+        with self._lock:
+            partitions = self._topics.setdefault(topic, [[] for _ in range(self.partitions)])
+            partition = zlib.crc32(key_bytes or b'') % self.partitions
+            offset = len(partitions[partition])
+            partitions[partition].append(value)
+        return FakeMessage(topic, partition, offset, key_bytes, value)
+
+    def read(self, topic, partition, start, end=None):
+        """Messages of a partition with start <= offset < end, as (offset, value)"""
+        with self._lock:
+            partitions = self._topics.get(topic)
+            if partitions is None or partition >= len(partitions):
+                return []
+            values = partitions[partition][start:end]
+        return list(enumerate(values, start))
+
+    def partition_ids(self, topic):
+        with self._lock:
+            return list(range(len(self._topics.get(topic, []))))
+
+    def producer(self):
+        return FakeKafkaProducer(self)
+
+
+class FakeKafkaProducer:
+    """Appends on ``produce`` and reports deliveries from ``poll``/``flush``, as librdkafka does"""
+
+    def __init__(self, kafka):
+        self.kafka = kafka
+        self._lock = threading.Lock()
+        self._reports = []
+
+    def produce(self, topic, key=None, value=None, on_delivery=None):
+        message = self.kafka.append(topic, key, value)
+        with self._lock:
+            self._reports.append((on_delivery, message))
+
+    def poll(self, timeout=None):
+        with self._lock:
+            reports, self._reports = self._reports, []
+        for on_delivery, message in reports:
+            if on_delivery:
+                on_delivery(None, message)
+        if not reports and timeout:
+            time.sleep(min(timeout, 0.01))
+        return len(reports)
+
+    def flush(self, timeout=None):
+        self.poll(0)
+        return 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._reports)
+
+
+_PARTITION_RANGE = re.compile(
+    r'_partition_id = (\d+) AND _partition_offset > (-?\d+)(?: AND _partition_offset <= (\d+))?'
+)
+_ROW_RANGE = re.compile(r'partition_id = (\d+) AND offset > (-?\d+) AND offset <= (\d+)')
+_UNKNOWN_PARTITIONS = re.compile(r'_partition_id NOT IN \(([^)]*)\)')
+_KAFKA_TABLE = re.compile(r'FROM kafka\.\w+\.(\w+)')
+
+
+class FakeTrino:
+    """Just enough of Trino to run the ingestion statements against ``FakeKafka``
+
+    Every statement costs ``query_ms`` plus its scanned rows at ``rows_per_second``.
+    """
+
+    def __init__(self, kafka, query_ms=50.0, rows_per_second=500000.0):
+        self.kafka = kafka
+        self.query_ms = query_ms
+        self.rows_per_second = rows_per_second
+        self._lock = threading.Lock()
+        self.tables = {}
+
+    def connect(self):
+        return FakeTrinoConnection(self)
+
+    def rows(self, table):
+        with self._lock:
+            return list(self.tables.get(table, []))
+
+    def select_messages(self, topic, predicate):
+        """Kafka messages matching a partition/offset predicate, as (partition, offset, value)"""
+        ranges = {int(p): (int(lo), int(hi) if hi else None) for p, lo, hi in _PARTITION_RANGE.findall(predicate)}
+        unknown = _UNKNOWN_PARTITIONS.search(predicate)
+        selected = []
+        for partition in self.kafka.partition_ids(topic):
+            if partition in ranges:
+                lo, hi = ranges[partition]
+                messages = self.kafka.read(topic, partition, lo + 1, hi + 1 if hi is not None else None)
+            elif predicate.strip() == 'TRUE' or unknown:
+                messages = self.kafka.read(topic, partition, 0)
+            else:
+                continue
+            selected.extend((partition, offset, value) for offset, value in messages)
+        return selected
+
+    def insert(self, table, rows):
+        with self._lock:
+            self.tables.setdefault(table, []).extend(rows)
+
+
+class FakeTrinoConnection:
+    def __init__(self, trino):
+        self.trino = trino
+
+    def cursor(self):
+        return FakeTrinoCursor(self.trino)
+
+    def close(self):
+        pass
+
+
+class FakeTrinoCursor:
+    def __init__(self, trino):
+        self.trino = trino
+        self.rowcount = -1
+        self.description = None
+        self.stats = {}
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql):
+        start = time.monotonic()
+        statement = ' '.join(sql.split())
+        self.rowcount = -1
+        scanned, self._rows = self._run(statement)
+        time.sleep(self.trino.query_ms / 1000 + scanned / self.trino.rows_per_second)
+        elapsed_ms = (time.monotonic() - start) * 1000
+        self.stats = {
+            'state': 'FINISHED', 'elapsedTimeMillis': elapsed_ms, 'queuedTimeMillis': 0,
+            'cpuTimeMillis': elapsed_ms, 'processedRows': scanned, 'processedBytes': 0,
+        }
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchmany(self, size):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def cancel(self):
+        pass
+
+    def _run(self, statement):
+        """Execute a statement; returns (rows scanned, result rows)"""
+        upper = statement.upper()
+        if upper.startswith(('CREATE ', 'ALTER ')):
+            return 0, []
+
+        kafka_table = _KAFKA_TABLE.search(statement)
+        if upper.startswith('INSERT INTO') and kafka_table:
+            table = statement.split()[2]
+            predicate = statement[statement.rindex(' WHERE ') + 7:].rstrip(') ')
+            messages = self.trino.select_messages(kafka_table.group(1), predicate)
+            now = time.time()
+            rows = []
+            for partition, offset, value in messages:
+                try:
+                    event = json.loads(value)
+                except ValueError:
+                    event = {}
+                rows.append({
+                    'id': event.get('id'), 'name': event.get('name'), 'timestamp': event.get('timestamp'),
+                    'offset': offset, 'partition_id': partition, 'ingest_time': now,
+                })
+            self.trino.insert(table, rows)
+            self.rowcount = len(rows)
+            return len(messages), [[len(rows)]]
+
+        if kafka_table and 'GROUP BY _partition_id' in statement:
+            predicate = statement[statement.index(' WHERE ') + 7:statement.index(' GROUP BY ')]
+            partitions = {}
+            for partition, offset, _ in self.trino.select_messages(kafka_table.group(1), predicate):
+                first, last, count = partitions.get(partition, (offset, offset, 0))
+                partitions[partition] = (min(first, offset), max(last, offset), count + 1)
+            return sum(count for _, _, count in partitions.values()), [
+                (partition, first, last, count) for partition, (first, last, count) in sorted(partitions.items())
+            ]
+
+        match = re.match(r'SELECT partition_id, MAX\(offset\) FROM (\S+)(?: WHERE (.*))? GROUP BY partition_id', statement)
+        if match:
+            rows = self.trino.rows(match.group(1))
+            if match.group(2):
+                # Recovery probe over (start, end] offset ranges of the row's partition_id/offset columns
+                ranges = {int(p): (int(lo), int(hi)) for p, lo, hi in _ROW_RANGE.findall(match.group(2))}
+                rows = [row for row in rows if row['partition_id'] in ranges
+                        and ranges[row['partition_id']][0] < row['offset'] <= ranges[row['partition_id']][1]]
+            latest = {}
+            for row in rows:
+                latest[row['partition_id']] = max(row['offset'], latest.get(row['partition_id'], -1))
+            return len(rows), list(latest.items())
+
+        match = re.match(r"SELECT id FROM (\S+) WHERE name = '([^']*)'", statement)
+        if match:
+            rows = self.trino.rows(match.group(1))
+            return len(rows), [(row['id'],) for row in rows if row['name'] == match.group(2)]
+
+        raise NotImplementedError(f"FakeTrino does not support: {statement[:200]}")
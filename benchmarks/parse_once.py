@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Compare Trino CPU time of per-column json_parse against parsing each message once
+
+Both queries run over the same synthetic JSON messages generated inside Trino,
+so the numbers isolate the extraction cost. Run against the docker-compose
+stack, e.g. ``python benchmarks/parse_once.py --messages 1000000``.
+"""
+
+import argparse
+import os
+import sys
+
+import trino
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'webapp'))
+from message_columns import EVENT_COLUMNS, message_fields_sql, parsed_message_sql  # noqa: E402
+
+
+def messages_sql(count):
+    """Synthetic `_message` rows shaped like the events produced by the web app"""
+    side = max(1, int(round(count ** 0.5)))
+    return f"""
+    SELECT '{{"id":"' || CAST(a.x * {side} + b.y AS VARCHAR) || '","name":"event-' || CAST(b.y AS VARCHAR)
+           || '","timestamp":"2024-01-01 12:00:00.000000","type":"click","amount":12.5}}' AS _message
+    FROM UNNEST(sequence(0, {side - 1})) AS a(x)
+    CROSS JOIN UNNEST(sequence(1, {side})) AS b(y)
+    """
+
+
+def per_column_query(count):
+    """The extraction used before: one json_parse per column"""
+    return f"""
+    SELECT count(*), max(id), max(name), max(timestamp) FROM (
+        SELECT
+            CAST(json_extract_scalar(json_parse(_message), '$.id') AS INTEGER) AS id,
+            CAST(json_extract_scalar(json_parse(_message), '$.name') AS VARCHAR) AS name,
+            CAST(json_extract_scalar(json_parse(_message), '$.timestamp') AS TIMESTAMP(6)) AS timestamp
+        FROM ({messages_sql(count)})
+    )
+    """
+
+
+def parse_once_query(count):
+    """The extraction built from the column mapping: one parse per message"""
+    return f"""
+    SELECT count(*), max("id"), max("name"), max("timestamp") FROM (
+        SELECT {message_fields_sql(EVENT_COLUMNS)}
+        FROM (SELECT {parsed_message_sql('_message', EVENT_COLUMNS)} AS event FROM ({messages_sql(count)}))
+    )
+    """
+
+
+def baseline_query(count):
+    """Generating the messages alone, subtracted from both measurements"""
+    return f"SELECT count(*), max(length(_message)) FROM ({messages_sql(count)})"
+
+
+def cpu_millis(cursor, query, runs):
+    """Median CPU time reported by Trino over ``runs`` executions, and the rows counted"""
+    samples = []
+    rows = 0
+    for _ in range(runs):
+        cursor.execute(query)
+        rows = cursor.fetchall()[0][0]
+        samples.append(cursor.stats['cpuTimeMillis'])
+    samples.sort()
+    return samples[len(samples) // 2], rows
+
+
+def main(args):
+    conn = trino.dbapi.connect(host=args.host, port=args.port, user=args.user, catalog='system', schema='runtime')
+    cursor = conn.cursor()
+    # Warm up the workers' compiled expressions before measuring
+    cursor.execute(parse_once_query(1000))
+    cursor.fetchall()
+
+    baseline, rows = cpu_millis(cursor, baseline_query(args.messages), args.runs)
+    per_column, _ = cpu_millis(cursor, per_column_query(args.messages), args.runs)
+    parse_once, _ = cpu_millis(cursor, parse_once_query(args.messages), args.runs)
+
+    scale = 1_000_000 / rows
+    per_column_cost = (per_column - baseline) * scale
+    parse_once_cost = (parse_once - baseline) * scale
+    print(f"messages:                     {rows}")
+    print(f"generation baseline:          {baseline * scale:10.0f} CPU ms per million")
+    print(f"json_parse per column:        {per_column_cost:10.0f} CPU ms per million")
+    print(f"parse once:                   {parse_once_cost:10.0f} CPU ms per million")
+    print(f"CPU saved:                    {per_column_cost - parse_once_cost:10.0f} CPU ms per million "
+          f"({(1 - parse_once_cost / per_column_cost) * 100 if per_column_cost > 0 else 0:.0f}%)")
+    conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark JSON extraction in the Kafka ingestion SQL")
+    parser.add_argument("--host", default=os.environ.get("TRINO_HOST", "localhost"), help="Trino host")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("TRINO_PORT", "8080")), help="Trino port")
+    parser.add_argument("--user", default=os.environ.get("TRINO_USER", "trino"), help="Trino user")
+    parser.add_argument("--messages", type=int, default=1000000, help="Number of synthetic messages per query")
+    parser.add_argument("--runs", type=int, default=5, help="Runs per query; the median is reported")
+    exit(main(parser.parse_args()))
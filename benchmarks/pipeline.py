@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""Load-test the Kafka -> Iceberg pipeline and report throughput, latency and stage timings as JSON
+
+Synthetic events are posted to /send_events at ``--rate`` events/s while the
+ingestion loop (``ingest_from_kafka``, or a dbt model/macro) runs every
+``--interval`` seconds. After each cycle the target table is checked for the
+run's events, so end-to-end latency is send -> visible to a reader.
+
+``--backend fake`` (default) runs in-process against benchmarks/fakes.py and
+needs neither Kafka nor Trino. ``--backend docker`` uses the docker-compose
+stack (see benchmarks/docker-compose.yml). Save a run and compare a later one:
+
+    python benchmarks/pipeline.py --events 50000 --rate 5000 --output before.json
+    python benchmarks/pipeline.py --events 50000 --rate 5000 --compare before.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+# webapp first: its modules share names with some benchmark scripts
+sys.path.insert(0, os.path.join(REPO, 'webapp'))
+import kafka_to_iceberg  # noqa: E402
+from app import create_app  # noqa: E402
+from fakes import FakeKafka, FakeTrino  # noqa: E402
+from offset_store import FileOffsetStore  # noqa: E402
+from trino_pool import TrinoConnectionPool  # noqa: E402
+
+# Metrics shown by --compare: (path in the report, True if higher is better)
+COMPARED = [
+    (('events_per_second',), True),
+    (('end_to_end_latency', 'p50_ms'), False),
+    (('end_to_end_latency', 'p99_ms'), False),
+    (('produce', 'request_latency', 'p50_ms'), False),
+    (('produce', 'request_latency', 'p99_ms'), False),
+    (('ingest', 'cycle', 'p50_ms'), False),
+    (('ingest', 'stages', 'plan', 'p50_ms'), False),
+    (('ingest', 'stages', 'insert', 'p50_ms'), False),
+    (('ingest', 'stages', 'offsets', 'p50_ms'), False),
+    (('ingest', 'stages', 'dbt', 'p50_ms'), False),
+]
+
+
+def percentiles(seconds):
+    """count/mean/p50/p99/max in milliseconds (nearest rank)"""
+    if not seconds:
+        return {'count': 0}
+    ordered = sorted(seconds)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))] * 1000
+
+    return {
+        'count': len(ordered),
+        'mean_ms': round(sum(ordered) * 1000 / len(ordered), 3),
+        'p50_ms': round(rank(50), 3),
+        'p99_ms': round(rank(99), 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+
+class StageTimer:
+    """Durations per pipeline stage, recorded from any thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.stages.setdefault(stage, []).append(seconds)
+
+    def summary(self, *exclude):
+        with self._lock:
+            return {stage: percentiles(values) for stage, values in self.stages.items() if stage not in exclude}
+
+
+class TimedCursor:
+    """DB-API cursor wrapper timing each statement by ingestion stage"""
+
+    def __init__(self, cursor, timer):
+        self._cursor = cursor
+        self._timer = timer
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql):
+        if sql.lstrip().upper().startswith('INSERT'):
+            stage = 'insert'
+        elif 'GROUP BY _partition_id' in sql:
+            stage = 'plan'
+        else:
+            stage = 'other'
+        start = time.monotonic()
+        try:
+            return self._cursor.execute(sql)
+        finally:
+            self._timer.record(stage, time.monotonic() - start)
+
+
+class TimedConnection:
+    def __init__(self, conn, timer):
+        self._conn = conn
+        self._timer = timer
+
+    def cursor(self):
+        return TimedCursor(self._conn.cursor(), self._timer)
+
+    def close(self):
+        self._conn.close()
+
+
+class TimedOffsetStore:
+    def __init__(self, store, timer):
+        self._store = store
+        self._timer = timer
+
+    def load(self, topic):
+        return self._store.load(topic)
+
+    def commit(self, topic, offsets):
+        start = time.monotonic()
+        self._store.commit(topic, offsets)
+        self._timer.record('offsets', time.monotonic() - start)
+
+
+class LoadGenerator(threading.Thread):
+    """Posts ``count`` events in requests of ``request_size`` at ``rate`` events/s (0: as fast as possible)"""
+
+    def __init__(self, post, count, rate, request_size, marker, id_base):
+        super().__init__(name='load-generator', daemon=True)
+        self.post = post
+        self.count = count
+        self.rate = rate
+        self.request_size = request_size
+        self.marker = marker
+        self.id_base = id_base
+        self.sent_at = {}
+        self.request_latency = []
+        self.errors = 0
+        self.started = self.finished = None
+
+    def run(self):
+        self.started = time.monotonic()
+        sent = 0
+        while sent < self.count:
+            if self.rate:
+                delay = self.started + sent / self.rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            events = []
+            now = time.time()
+            for event_id in range(self.id_base + sent, self.id_base + min(self.count, sent + self.request_size)):
+                events.append({'id': event_id, 'name': self.marker, 'timestamp': datetime.now().isoformat()})
+                self.sent_at[event_id] = now
+            start = time.monotonic()
+            if not self.post(events):
+                self.errors += 1
+            self.request_latency.append(time.monotonic() - start)
+            sent += len(events)
+        self.finished = time.monotonic()
+
+
+def in_process_poster(app):
+    client = app.test_client()
+
+    def post(events):
+        return client.post('/send_events', json=events).status_code == 200
+    return post
+
+
+def http_poster(url):
+    import requests
+    session = requests.Session()
+
+    def post(events):
+        return session.post(url.rstrip('/') + '/send_events', json=events, timeout=60).ok
+    return post
+
+
+def visible_ids(cursor, table, marker):
+    cursor.execute(f"SELECT id FROM {table} WHERE name = '{marker}'")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def dbt_command(args):
+    """dbt invocation for one ingestion cycle (docker backend)"""
+    common = ['--project-dir', args.dbt_project_dir, '--profiles-dir', args.dbt_profiles_dir]
+    if args.ingest == 'dbt-model':
+        return ['dbt', 'run', '--models', 'kafka_to_iceberg.events_streaming'] + common
+    operation_args = {
+        'kafka_topic': f'kafka.default.{args.topic}', 'target_table': args.target_table, 'batch_size': args.batch_size,
+    }
+    return ['dbt', 'run-operation', 'kafka_to_iceberg_sync', '--args', json.dumps(operation_args)] + common
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def run(args):
+    timer = StageTimer()
+    marker = f"bench-{uuid.uuid4().hex[:12]}"
+    # Ids must fit the INTEGER id column and not collide with earlier runs on a real table
+    id_base = 0 if args.backend == 'fake' else random.randrange(0, 2 ** 31 - args.events)
+
+    if args.backend == 'fake':
+        kafka = FakeKafka(partitions=args.partitions)
+        trino = FakeTrino(kafka, query_ms=args.fake_query_ms, rows_per_second=args.fake_rows_per_second)
+        connect = trino.connect
+        app = create_app({'KAFKA_TOPIC': args.topic})
+        # librdkafka stand-in: messages go to the fake topic instead of a broker
+        app.extensions['webapp'].event_producer._create_producer = kafka.producer
+    else:
+        def connect():
+            return kafka_to_iceberg.get_trino_connection(
+                host=args.trino_host, port=args.trino_port, user=args.trino_user,
+                catalog=args.trino_catalog, schema=args.trino_schema,
+            )
+        app = None if args.webapp_url else create_app(
+            {'KAFKA_BOOTSTRAP_SERVERS': args.kafka_bootstrap_servers, 'KAFKA_TOPIC': args.topic}
+        )
+
+    conn = TimedConnection(connect(), timer)
+    cursor = conn.cursor()
+    check_cursor = conn.cursor()
+    pool = None
+    offset_store = None
+    if args.ingest == 'python':
+        kafka_to_iceberg.create_target_table_if_not_exists(cursor, args.target_table)
+        offset_file = os.path.join(tempfile.mkdtemp(prefix='pipeline-bench-'), 'offsets.json')
+        offset_store = TimedOffsetStore(FileOffsetStore(offset_file, consumer=args.target_table), timer)
+        # Start from the end of the topic so earlier messages aren't part of the measurement
+        start = kafka_to_iceberg.plan_partitions(cursor, args.topic, {})
+        offset_store.commit(args.topic, {partition: last for partition, (_, last, _) in start.items()})
+        if args.parallelism > 1:
+            pool = TrinoConnectionPool(lambda: TimedConnection(connect(), timer), max_size=args.parallelism)
+
+    post = in_process_poster(app) if app else http_poster(args.webapp_url)
+    generator = LoadGenerator(post, args.events, args.rate, args.request_size, marker, id_base)
+    generator.start()
+
+    visible_at = {}
+    cycle_times = []
+    rows_inserted = 0
+    deadline = time.monotonic() + args.timeout
+    while len(visible_at) < args.events and time.monotonic() < deadline:
+        cycle_start = time.monotonic()
+        if args.ingest == 'python':
+            result = kafka_to_iceberg.ingest_from_kafka(
+                cursor, args.topic, args.target_table, offset_store, args.batch_size, pool, args.parallelism
+            )
+            rows_inserted += result.rows_inserted
+        else:
+            subprocess.run(dbt_command(args), cwd=args.dbt_project_dir, check=True, capture_output=not args.verbose)
+            timer.record('dbt', time.monotonic() - cycle_start)
+        cycle_times.append(time.monotonic() - cycle_start)
+
+        check_start = time.monotonic()
+        now = time.time()
+        for event_id in visible_ids(check_cursor, args.target_table, marker) - visible_at.keys():
+            visible_at[event_id] = now
+        timer.record('visibility_check', time.monotonic() - check_start)
+
+        remaining = args.interval - (time.monotonic() - cycle_start)
+        if remaining > 0:
+            time.sleep(remaining)
+
+    generator.join(timeout=max(0.0, deadline - time.monotonic()))
+    finished = time.monotonic()
+    if pool:
+        pool.close()
+
+    latencies = [visible_at[event_id] - generator.sent_at[event_id]
+                 for event_id in visible_at if event_id in generator.sent_at]
+    duration = finished - generator.started
+    produce_duration = (generator.finished or finished) - generator.started
+    if app:
+        with app.test_client() as client:
+            producer_stats = client.get('/producer_stats').get_json()
+    else:
+        producer_stats = None
+    stages = timer.summary('other', 'visibility_check')
+
+    return {
+        'label': args.label,
+        'git_commit': git_commit(),
+        'backend': args.backend,
+        'ingest_mode': args.ingest,
+        'config': {
+            'events': args.events, 'rate': args.rate, 'request_size': args.request_size,
+            'partitions': args.partitions if args.backend == 'fake' else None,
+            'batch_size': args.batch_size, 'parallelism': args.parallelism, 'interval': args.interval,
+            'fake_query_ms': args.fake_query_ms if args.backend == 'fake' else None,
+            'fake_rows_per_second': args.fake_rows_per_second if args.backend == 'fake' else None,
+        },
+        'events_sent': len(generator.sent_at),
+        'events_visible': len(visible_at),
+        'timed_out': len(visible_at) < args.events,
+        'duration_seconds': round(duration, 3),
+        'events_per_second': round(len(visible_at) / duration, 1) if duration > 0 else None,
+        'end_to_end_latency': percentiles(latencies),
+        'produce': {
+            'requests': len(generator.request_latency),
+            'failed_requests': generator.errors,
+            'events_per_second': round(len(generator.sent_at) / produce_duration, 1) if produce_duration > 0 else None,
+            'request_latency': percentiles(generator.request_latency),
+            'producer_stats': producer_stats,
+        },
+        'ingest': {
+            'cycles': len(cycle_times),
+            'rows_inserted': rows_inserted if args.ingest == 'python' else None,
+            'cycle': percentiles(cycle_times),
+            'stages': stages,
+        },
+        'visibility_check': timer.summary().get('visibility_check'),
+    }
+
+
+def lookup(report, path):
+    for key in path:
+        if not isinstance(report, dict) or key not in report:
+            return None
+        report = report[key]
+    return report
+
+
+def compare(baseline, report):
+    """Print the key metrics of two reports side by side"""
+    for key in ('backend', 'ingest_mode'):
+        if baseline.get(key) != report.get(key):
+            print(f"note: {key} differs: {baseline.get(key)} vs {report.get(key)}", file=sys.stderr)
+    print(f"{'metric':<36} {'baseline':>12} {'current':>12} {'change':>9}", file=sys.stderr)
+    for path, higher_is_better in COMPARED:
+        old, new = lookup(baseline, path), lookup(report, path)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old * 100 if old else 0.0
+        better = (change > 0) == higher_is_better
+        verdict = '' if abs(change) < 5 else (' better' if better else ' worse')
+        print(f"{'.'.join(path):<36} {old:>12} {new:>12} {change:>+8.1f}%{verdict}", file=sys.stderr)
+
+
+def main(args):
+    if args.ingest != 'python' and args.backend == 'fake':
+        print("dbt ingestion needs --backend docker", file=sys.stderr)
+        return 2
+    if not args.target_table:
+        args.target_table = {
+            'python': 'iceberg.default.events_streaming_bench',
+            'dbt-model': 'iceberg.default.events_streaming',
+            'dbt-sync': 'iceberg.default.raw_events_streaming',
+        }[args.ingest]
+    logging.getLogger('kafka_to_iceberg').setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    report = run(args)
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+    return 1 if report['timed_out'] else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the Kafka -> Iceberg pipeline end to end")
+    parser.add_argument("--backend", choices=["fake", "docker"], default="fake", help="In-memory fakes or the docker-compose stack")
+    parser.add_argument("--ingest", choices=["python", "dbt-model", "dbt-sync"], default="python", help="kafka_to_iceberg.py loop, the events_streaming model or the kafka_to_iceberg_sync macro (docker only)")
+    parser.add_argument("--events", type=int, default=20000, help="Events to send")
+    parser.add_argument("--rate", type=float, default=2000, help="Events per second (0 sends as fast as possible)")
+    parser.add_argument("--request-size", type=int, default=100, help="Events per /send_events request")
+    parser.add_argument("--topic", default="events_topic", help="Kafka topic")
+    parser.add_argument("--target-table", help="Iceberg table to ingest into (default depends on --ingest)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Records per partition per ingestion cycle")
+    parser.add_argument("--parallelism", type=int, default=4, help="Partition groups inserted concurrently")
+    parser.add_argument("--interval", type=float, default=1.0, help="Seconds between ingestion cycle starts")
+    parser.add_argument("--timeout", type=float, default=600, help="Give up after this many seconds")
+    parser.add_argument("--partitions", type=int, default=4, help="Topic partitions (fake backend)")
+    parser.add_argument("--fake-query-ms", type=float, default=50.0, help="Fixed cost of each fake Trino statement")
+    parser.add_argument("--fake-rows-per-second", type=float, default=500000.0, help="Fake Trino scan rate")
+    parser.add_argument("--webapp-url", help="Post to a running webapp instead of an in-process app (docker backend)")
+    parser.add_argument("--kafka-bootstrap-servers", default=os.environ.get("KAFKA_BOOTSTRAP_SERVERS", "localhost:9092"), help="Kafka brokers (docker backend)")
+    parser.add_argument("--trino-host", default=os.environ.get("TRINO_HOST", "localhost"), help="Trino host (docker backend)")
+    parser.add_argument("--trino-port", type=int, default=int(os.environ.get("TRINO_PORT", "8080")), help="Trino port (docker backend)")
+    parser.add_argument("--trino-user", default=os.environ.get("TRINO_USER", "trino"), help="Trino user (docker backend)")
+    parser.add_argument("--trino-catalog", default=os.environ.get("TRINO_CATALOG", "iceberg"), help="Trino catalog (docker backend)")
+    parser.add_argument("--trino-schema", default=os.environ.get("TRINO_SCHEMA", "default"), help="Trino schema (docker backend)")
+    parser.add_argument("--dbt-project-dir", default=os.path.join(REPO, 'dbt', 'iceberg_project'), help="dbt project (dbt ingestion)")
+    parser.add_argument("--dbt-profiles-dir", default=os.path.join(REPO, 'dbt'), help="dbt profiles directory (dbt ingestion)")
+    parser.add_argument("--label", default="", help="Free-form label stored in the report")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    parser.add_argument("--compare", help="Baseline JSON report to compare against (printed to stderr)")
+    parser.add_argument("--verbose", action="store_true", help="Show ingestion and dbt logs")
+    exit(main(parser.parse_args()))
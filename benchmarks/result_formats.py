@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""Compare encode latency, client decode latency and payload size of the result formats
+
+Uses an in-memory cursor, so it measures the webapp's encoding only (no Trino
+time): JSON rows as returned by /execute_query today, columnar JSON (plain,
+gzip, zstd) and Arrow IPC (plain, lz4, zstd). Run with the webapp's
+requirements plus pyarrow (and optionally zstandard/orjson) installed:
+
+    python benchmarks/result_formats.py --rows 10000 100000 1000000
+"""
+
+import argparse
+import datetime
+import gzip
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'webapp'))
+import app as webapp  # noqa: E402
+from query_cursors import OpenCursor  # noqa: E402
+from result_formats import ARROW_AVAILABLE, ZSTD_AVAILABLE, ColumnarResult, compress  # noqa: E402
+
+flask_app = webapp.create_app()
+
+if ARROW_AVAILABLE:
+    import pyarrow as pa
+if ZSTD_AVAILABLE:
+    import zstandard
+
+DESCRIPTION = [
+    ('id', 'bigint'), ('name', 'varchar'), ('event_time', 'timestamp(6)'),
+    ('amount', 'double'), ('quantity', 'integer'), ('is_valid', 'boolean'),
+]
+
+
+class MemoryCursor:
+    """DB-API cursor over pre-built rows, so row generation isn't measured"""
+
+    description = DESCRIPTION
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.position = 0
+
+    def fetchmany(self, size):
+        batch = self.rows[self.position:self.position + size]
+        self.position += len(batch)
+        return batch
+
+    def cancel(self):
+        pass
+
+
+def make_rows(count):
+    start = datetime.datetime(2024, 1, 1)
+    return [
+        [i, f"event-{i % 1000}", start + datetime.timedelta(seconds=i), i * 0.25, i % 17, i % 3 == 0]
+        for i in range(count)
+    ]
+
+
+def json_rows(rows):
+    """The current /execute_query path: one JSON document of row arrays"""
+    entry = OpenCursor(None, MemoryCursor(rows), [name for name, _ in DESCRIPTION])
+    with flask_app.app_context():
+        encoded, _, _ = webapp.read_result_page(entry, len(rows))
+        body = '{"success": true, "columns": [], "rows": [' + ','.join(encoded) + ']}'
+    return body.encode('utf-8')
+
+
+def columnar(rows, encoding=None):
+    return compress(ColumnarResult(MemoryCursor(rows), fetch_size=10000).to_columnar_json(), encoding)
+
+
+def arrow(rows, compression=None):
+    return ColumnarResult(MemoryCursor(rows), fetch_size=10000).to_arrow(compression=compression).to_pybytes()
+
+
+def decode_json(body, encoding=None):
+    if encoding == 'gzip':
+        body = gzip.decompress(body)
+    elif encoding == 'zstd':
+        body = zstandard.ZstdDecompressor().decompress(body, max_output_size=1 << 34)
+    return json.loads(body)
+
+
+def decode_arrow(body):
+    # Reads the IPC buffers in place (no copy for uncompressed streams)
+    return pa.ipc.open_stream(pa.py_buffer(body)).read_all()
+
+
+def measure(encode, decode):
+    start = time.perf_counter()
+    body = encode()
+    encoded_at = time.perf_counter()
+    decode(body)
+    decoded_at = time.perf_counter()
+    return (encoded_at - start) * 1000, (decoded_at - encoded_at) * 1000, len(body)
+
+
+def main(args):
+    webapp.QUERY_MAX_ROWS = max(args.rows)
+    webapp.QUERY_MAX_BYTES = 1 << 40
+
+    formats = [
+        ('json rows (current)', lambda r: json_rows(r), lambda b: decode_json(b)),
+        ('columnar json', lambda r: columnar(r), lambda b: decode_json(b)),
+        ('columnar json + gzip', lambda r: columnar(r, 'gzip'), lambda b: decode_json(b, 'gzip')),
+    ]
+    if ZSTD_AVAILABLE:
+        formats.append(('columnar json + zstd', lambda r: columnar(r, 'zstd'), lambda b: decode_json(b, 'zstd')))
+    if ARROW_AVAILABLE:
+        formats += [
+            ('arrow ipc', lambda r: arrow(r), decode_arrow),
+            ('arrow ipc + lz4', lambda r: arrow(r, 'lz4'), decode_arrow),
+            ('arrow ipc + zstd', lambda r: arrow(r, 'zstd'), decode_arrow),
+        ]
+
+    print(f"{'rows':>9}  {'format':<22} {'encode ms':>10} {'decode ms':>10} {'bytes':>13} {'vs json':>8}")
+    for count in args.rows:
+        rows = make_rows(count)
+        baseline = None
+        for name, encode, decode in formats:
+            encode_ms, decode_ms, size = min(
+                (measure(lambda: encode(rows), decode) for _ in range(args.runs)), key=lambda m: m[0] + m[1]
+            )
+            baseline = baseline or size
+            print(f"{count:>9}  {name:<22} {encode_ms:>10.1f} {decode_ms:>10.1f} {size:>13,} {size / baseline:>7.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark /execute_query result encodings")
+    parser.add_argument("--rows", type=int, nargs='+', default=[10000, 100000, 1000000], help="Result sizes to test")
+    parser.add_argument("--runs", type=int, default=3, help="Runs per format; the fastest is reported")
+    exit(main(parser.parse_args()))
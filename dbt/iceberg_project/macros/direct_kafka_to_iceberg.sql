@@ -52,21 +52,10 @@ ORDER BY _kafka_offset
 LIMIT {{ limit }}
 {% endset %}
 
-{% do run_query(insert_data_sql) %}
-{% do log("Inserted new records into " ~ target_table, info=True) %}
-
-{% set count_records_sql %}
-SELECT COUNT(*) AS record_count FROM {{ target_table }}
-{% endset %}
-
-{% set count_result = run_query(count_records_sql) %}
-{% if execute %}
-    {% set record_count = count_result.columns['record_count'][0] %}
-{% else %}
-    {% set record_count = 0 %}
-{% endif %}
-
-{% do log("Total records in table: " ~ record_count, info=True) %}
+{% set insert_result = run_query(insert_data_sql) %}
+{% set rows_inserted = inserted_row_count(insert_result, target_table) %}
+{% do log("Inserted " ~ rows_inserted ~ " new records into " ~ target_table, info=True) %}
+{% do log_sync_metrics(ref('kafka_view'), target_table, rows_inserted, last_offset) %}
 
 {{ return("Successfully synced data to " ~ target_table) }}
 
@@ -37,36 +37,31 @@ FROM {{ target_table }}
 
 {% set insert_data_sql %}
 INSERT INTO {{ target_table }}
+WITH parsed AS (
+    SELECT
+        {{ parsed_kafka_message('message') }} AS event,
+        _kafka_partition,
+        _kafka_offset,
+        _timestamp
+    FROM {{ kafka_source }}
+    WHERE _kafka_offset > {{ last_offset }}
+)
 SELECT 
-    CAST(JSON_EXTRACT_SCALAR(CAST(message AS VARCHAR), '$.id') AS BIGINT) AS id,
-    JSON_EXTRACT_SCALAR(CAST(message AS VARCHAR), '$.name') AS name,
-    CAST(JSON_EXTRACT_SCALAR(CAST(message AS VARCHAR), '$.created_at') AS TIMESTAMP(6)) AS created_at,
+    {{ kafka_message_fields('event') }},
     _kafka_partition AS kafka_partition,
     _kafka_offset AS kafka_offset,
     CAST(_timestamp AS TIMESTAMP(6)) AS kafka_timestamp,
     CAST(CURRENT_TIMESTAMP AS TIMESTAMP(6)) AS processed_at
-FROM {{ kafka_source }}
-WHERE _kafka_offset > {{ last_offset }}
-  AND JSON_EXTRACT_SCALAR(CAST(message AS VARCHAR), '$.id') IS NOT NULL
+FROM parsed
+WHERE event."id" IS NOT NULL
 ORDER BY _kafka_offset
 LIMIT {{ limit }}
 {% endset %}
 
-{% do run_query(insert_data_sql) %}
-{% do log("Inserted new records into " ~ target_table, info=True) %}
-
-{% set count_records_sql %}
-SELECT COUNT(*) AS record_count FROM {{ target_table }}
-{% endset %}
-
-{% set count_result = run_query(count_records_sql) %}
-{% if execute %}
-    {% set record_count = count_result.columns['record_count'][0] %}
-{% else %}
-    {% set record_count = 0 %}
-{% endif %}
-
-{% do log("Total records in table: " ~ record_count, info=True) %}
+{% set insert_result = run_query(insert_data_sql) %}
+{% set rows_inserted = inserted_row_count(insert_result, target_table) %}
+{% do log("Inserted " ~ rows_inserted ~ " new records into " ~ target_table, info=True) %}
+{% do log_sync_metrics(kafka_source, target_table, rows_inserted, last_offset) %}
 
 {{ return("Successfully synced data from " ~ kafka_source ~ " to " ~ target_table) }}
 
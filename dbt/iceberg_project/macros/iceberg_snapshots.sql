@@ -0,0 +1,137 @@
+{% macro snapshot_watermark_table() %}
+    {# Last source snapshot each snapshot-incremental model processed #}
+    {{ return(var('snapshot_watermark_table', 'iceberg.default.dbt_snapshot_watermarks')) }}
+{% endmacro %}
+
+{% macro ensure_snapshot_watermark_table() %}
+    {# high_water is the largest order-column value read, as text, and high_water_type its SQL type #}
+    {% set create_table %}
+        CREATE TABLE IF NOT EXISTS {{ snapshot_watermark_table() }} (
+            model VARCHAR,
+            source_table VARCHAR,
+            snapshot_id BIGINT,
+            updated_at TIMESTAMP(6),
+            high_water VARCHAR,
+            high_water_type VARCHAR
+        )
+    {% endset %}
+    {% do run_query(create_table) %}
+    {# Tables created before the order-column watermark #}
+    {% do run_query("ALTER TABLE " ~ snapshot_watermark_table() ~ " ADD COLUMN IF NOT EXISTS high_water VARCHAR") %}
+    {% do run_query("ALTER TABLE " ~ snapshot_watermark_table() ~ " ADD COLUMN IF NOT EXISTS high_water_type VARCHAR") %}
+{% endmacro %}
+
+{% macro load_snapshot_watermark(model, source_table) %}
+    {% set watermark_query %}
+        SELECT snapshot_id, high_water, high_water_type FROM {{ snapshot_watermark_table() }}
+        WHERE model = '{{ model }}' AND source_table = '{{ source_table }}'
+    {% endset %}
+    {% set rows = run_query(watermark_query).rows %}
+    {% if not rows %}
+        {{ return(none) }}
+    {% endif %}
+    {{ return({'snapshot_id': rows[0][0] | int, 'high_water': rows[0][1], 'high_water_type': rows[0][2]}) }}
+{% endmacro %}
+
+{% macro sql_string(value) %}
+    {{ return("NULL" if value is none else "'" ~ (value | string).replace("'", "''") ~ "'") }}
+{% endmacro %}
+
+{% macro stage_snapshot_watermark(relation, source_table, snapshot_id, high_water=none, high_water_type=none) %}
+    {# Recorded as pending; commit_snapshot_watermark promotes it once the run's rows are in #}
+    {% set pending = kafka_consumer_name(relation) ~ '#pending' %}
+    {% do run_query("DELETE FROM " ~ snapshot_watermark_table() ~ " WHERE model = '" ~ pending ~ "' AND source_table = '" ~ source_table ~ "'") %}
+    {% if snapshot_id is not none %}
+        {% do run_query("INSERT INTO " ~ snapshot_watermark_table() ~ " VALUES ('" ~ pending ~ "', '" ~ source_table ~ "', "
+                        ~ snapshot_id ~ ", CURRENT_TIMESTAMP, " ~ sql_string(high_water) ~ ", " ~ sql_string(high_water_type) ~ ")") %}
+    {% endif %}
+{% endmacro %}
+
+{% macro iceberg_snapshot_changes(source_table, order_column=none) %}
+    {# A subquery of the rows added to an Iceberg table since the snapshot this model last processed #}
+    {# Reads are pinned to the table's current snapshot, which becomes the watermark once the run succeeds. #}
+    {# New rows are found by order_column, a column that grows with every commit (e.g. an ingest time): #}
+    {# the watermark also records the largest value read, and the pinned version is filtered above it, #}
+    {# so Iceberg's per-file min/max stats skip the files written before. Compactions keep the values and #}
+    {# are not read again; rows without a value and deleted rows are not propagated downstream. #}
+    {% set order_column = order_column or var('snapshot_order_columns', {}).get(source_table) %}
+    {% if not order_column %}
+        {% do exceptions.raise_compiler_error(
+            "iceberg_snapshot_changes needs an order column for " ~ source_table ~ "; "
+            ~ "pass order_column or add it to the snapshot_order_columns var"
+        ) %}
+    {% endif %}
+    {% if not execute %}
+        {{ return('(SELECT * FROM ' ~ source_table ~ ')') }}
+    {% endif %}
+    {% do ensure_snapshot_watermark_table() %}
+    {% set current_query %}
+        SELECT snapshot_id FROM {{ iceberg_metadata_table(source_table, 'history') }}
+        WHERE is_current_ancestor
+        ORDER BY made_current_at DESC
+        LIMIT 1
+    {% endset %}
+    {% set latest = run_query(current_query).rows %}
+    {% set current = latest[0][0] | int if latest else none %}
+    {% if current is none %}
+        {# No snapshot yet: the table has never been written #}
+        {% do stage_snapshot_watermark(this, source_table, none) %}
+        {{ return('(SELECT * FROM ' ~ source_table ~ ' WHERE FALSE)') }}
+    {% endif %}
+
+    {% set pinned = source_table ~ ' FOR VERSION AS OF ' ~ current %}
+    {% set watermark = load_snapshot_watermark(kafka_consumer_name(this), source_table) if is_incremental() else none %}
+    {% if is_incremental() and (watermark is none or watermark.high_water_type is none) %}
+        {# e.g. the first run after the model became incremental, or a watermark recorded without an order column: #}
+        {# appending the whole table would duplicate it #}
+        {% do exceptions.raise_compiler_error(
+            this ~ " has no " ~ order_column ~ " watermark for " ~ source_table ~ "; "
+            ~ "rebuild the model once with --full-refresh"
+        ) %}
+    {% endif %}
+    {% if watermark is not none and watermark.snapshot_id == current %}
+        {% do log(this ~ ": no new snapshots of " ~ source_table ~ " since " ~ current, info=True) %}
+        {% do stage_snapshot_watermark(this, source_table, current, watermark.high_water, watermark.high_water_type) %}
+        {{ return('(SELECT * FROM ' ~ pinned ~ ' WHERE FALSE)') }}
+    {% endif %}
+
+    {% set above_watermark = order_column ~ ' > CAST(' ~ sql_string(watermark.high_water) ~ ' AS ' ~ watermark.high_water_type ~ ')'
+        if watermark is not none and watermark.high_water is not none else none %}
+    {# typeof() still names the column type when max() is NULL #}
+    {% set bounds_query %}
+        SELECT CAST(max({{ order_column }}) AS VARCHAR), typeof(max({{ order_column }}))
+        FROM {{ pinned }}
+        {% if above_watermark %}WHERE {{ above_watermark }}{% endif %}
+    {% endset %}
+    {% set bounds = run_query(bounds_query).rows[0] %}
+    {% if bounds[0] is none %}
+        {% do log(this ~ ": no rows of " ~ source_table ~ " above the " ~ order_column ~ " watermark", info=True) %}
+        {% do stage_snapshot_watermark(this, source_table, current,
+                                       watermark.high_water if watermark is not none else none, bounds[1]) %}
+        {{ return('(SELECT * FROM ' ~ pinned ~ ' WHERE FALSE)') }}
+    {% endif %}
+    {% do stage_snapshot_watermark(this, source_table, current, bounds[0], bounds[1]) %}
+
+    {# The upper bound keeps the read to exactly the rows the staged watermark covers #}
+    {% set up_to_high_water = order_column ~ ' <= CAST(' ~ sql_string(bounds[0]) ~ ' AS ' ~ bounds[1] ~ ')' %}
+    {% do log(this ~ ": reading " ~ source_table ~ " rows with " ~ order_column ~ " in ("
+              ~ (watermark.high_water if watermark is not none else '') ~ ", " ~ bounds[0] ~ "]", info=True) %}
+    {{ return('(SELECT * FROM ' ~ pinned ~ ' WHERE ' ~ (above_watermark ~ ' AND ' if above_watermark else '') ~ up_to_high_water ~ ')') }}
+{% endmacro %}
+
+{% macro commit_snapshot_watermark(relation, source_table) %}
+    {# post_hook: the staged snapshot becomes the model's watermark #}
+    MERGE INTO {{ snapshot_watermark_table() }} t
+    USING (
+        SELECT '{{ kafka_consumer_name(relation) }}' AS model, source_table, snapshot_id, high_water, high_water_type
+        FROM {{ snapshot_watermark_table() }}
+        WHERE model = '{{ kafka_consumer_name(relation) }}#pending' AND source_table = '{{ source_table }}'
+    ) s
+    ON t.model = s.model AND t.source_table = s.source_table
+    WHEN MATCHED THEN
+        UPDATE SET snapshot_id = s.snapshot_id, updated_at = CURRENT_TIMESTAMP,
+                   high_water = s.high_water, high_water_type = s.high_water_type
+    WHEN NOT MATCHED THEN
+        INSERT (model, source_table, snapshot_id, updated_at, high_water, high_water_type)
+        VALUES (s.model, s.source_table, s.snapshot_id, CURRENT_TIMESTAMP, s.high_water, s.high_water_type)
+{% endmacro %}
@@ -0,0 +1,121 @@
+{% macro kafka_offset_table() %}
+    {# Checkpoint table shared with kafka_to_iceberg.py (--offset-table) #}
+    {{ return(var('kafka_offset_table', 'iceberg.default.kafka_offsets')) }}
+{% endmacro %}
+
+{% macro kafka_consumer_name(relation) %}
+    {# Checkpoints are keyed by the target table, as kafka_to_iceberg.py does: catalog.schema.table #}
+    {{ return(relation.database ~ '.' ~ relation.schema ~ '.' ~ relation.identifier) }}
+{% endmacro %}
+
+{% macro ensure_kafka_offset_table() %}
+    {% set create_table %}
+        CREATE TABLE IF NOT EXISTS {{ kafka_offset_table() }} (
+            consumer VARCHAR,
+            topic VARCHAR,
+            partition_id BIGINT,
+            committed_offset BIGINT,
+            updated_at TIMESTAMP(6)
+        )
+    {% endset %}
+    {% do run_query(create_table) %}
+{% endmacro %}
+
+{% macro kafka_pending_predicate(offsets, partition_column='_partition_id', offset_column='_partition_offset') %}
+    {#- Records past each checkpointed partition's offset. The lowest offset is also a plain bound, which the -#}
+    {#- Kafka connector turns into a start offset; partitions without one are kafka_new_partitions_predicate's -#}
+    {%- if not offsets -%}
+        TRUE
+    {%- else -%}
+        {%- set clauses = [] -%}
+        {%- for partition in offsets | sort -%}
+            {%- do clauses.append('(' ~ partition_column ~ ' = ' ~ partition ~ ' AND ' ~ offset_column ~ ' > ' ~ offsets[partition] ~ ')') -%}
+        {%- endfor -%}
+        ({{ offset_column }} > {{ offsets.values() | min }} AND ({{ clauses | join(' OR ') }}))
+    {%- endif -%}
+{% endmacro %}
+
+{% macro kafka_new_partitions_predicate(offsets, partition_column='_partition_id') %}
+    {#- Partitions without a checkpoint (e.g. newly added), read from the beginning -#}
+    {{ partition_column }} NOT IN ({{ offsets | sort | join(', ') }})
+{%- endmacro %}
+
+{% macro kafka_pending_rows(relation, offsets, columns, partition_column='_partition_id', offset_column='_partition_offset') %}
+    {#- SELECT of the given columns for every record past the checkpoints. Checkpointed and new partitions -#}
+    {#- are separate scans: OR-ing them would leave no offset bound to push down. The second reads no -#}
+    {#- partition until one is added. -#}
+    SELECT {{ columns | join(', ') }} FROM {{ relation }}
+    WHERE {{ kafka_pending_predicate(offsets, partition_column, offset_column) }}
+    {%- if offsets %}
+    UNION ALL
+    SELECT {{ columns | join(', ') }} FROM {{ relation }}
+    WHERE {{ kafka_new_partitions_predicate(offsets, partition_column) }}
+    {%- endif -%}
+{% endmacro %}
+
+{% macro load_kafka_checkpoints(relation, topic) %}
+    {# Returns {partition: committed_offset} recorded for the relation and topic #}
+    {% if not execute %}
+        {{ return({}) }}
+    {% endif %}
+    {% do ensure_kafka_offset_table() %}
+    {% set checkpoints_query %}
+        SELECT partition_id, committed_offset
+        FROM {{ kafka_offset_table() }}
+        WHERE consumer = '{{ kafka_consumer_name(relation) }}' AND topic = '{{ topic }}'
+    {% endset %}
+    {% set offsets = {} %}
+    {% for row in run_query(checkpoints_query).rows %}
+        {% do offsets.update({row[0] | int: row[1] | int}) %}
+    {% endfor %}
+    {{ return(offsets) }}
+{% endmacro %}
+
+{% macro kafka_batch_watermarks(relation, topic) %}
+    {# Offsets already in the relation for each partition: its checkpoints, advanced past any batch #}
+    {# appended by a run that failed before its post_hook recorded it. The probe only reads offsets #}
+    {# past the checkpoints, so older data files are pruned by their stats instead of joined like MERGE. #}
+    {% set offsets = load_kafka_checkpoints(relation, topic) %}
+    {% if not execute %}
+        {{ return(offsets) }}
+    {% endif %}
+    {% set appended_query %}
+        SELECT _partition_id, MAX(_partition_offset)
+        FROM ({{ kafka_pending_rows(relation, offsets, ['_partition_id', '_partition_offset']) }})
+        GROUP BY _partition_id
+    {% endset %}
+    {% set appended = {} %}
+    {% for row in run_query(appended_query).rows %}
+        {% do appended.update({row[0] | int: row[1] | int}) %}
+    {% endfor %}
+    {% if appended %}
+        {% do log("Offsets already in " ~ relation ~ " without a checkpoint: " ~ tojson(appended), info=True) %}
+        {% do offsets.update(appended) %}
+    {% endif %}
+    {{ return(offsets) }}
+{% endmacro %}
+
+{% macro checkpoint_kafka_batches(relation, topic, full_refresh=false) %}
+    {# post_hook: records the highest offset of each partition the run appended #}
+    {# After --full-refresh the table was rebuilt from the start of the topic, so old checkpoints no longer apply #}
+    {% set offsets = {} if full_refresh else load_kafka_checkpoints(relation, topic) %}
+    {% if full_refresh %}
+        {% do ensure_kafka_offset_table() %}
+    {% endif %}
+    MERGE INTO {{ kafka_offset_table() }} t
+    USING (
+        SELECT
+            '{{ kafka_consumer_name(relation) }}' AS consumer,
+            '{{ topic }}' AS topic,
+            _partition_id AS partition_id,
+            MAX(_partition_offset) AS committed_offset
+        FROM ({{ kafka_pending_rows(relation, offsets, ['_partition_id', '_partition_offset']) }})
+        GROUP BY _partition_id
+    ) s
+    ON t.consumer = s.consumer AND t.topic = s.topic AND t.partition_id = s.partition_id
+    WHEN MATCHED THEN
+        UPDATE SET committed_offset = s.committed_offset, updated_at = CURRENT_TIMESTAMP
+    WHEN NOT MATCHED THEN
+        INSERT (consumer, topic, partition_id, committed_offset, updated_at)
+        VALUES (s.consumer, s.topic, s.partition_id, s.committed_offset, CURRENT_TIMESTAMP)
+{% endmacro %}
@@ -40,4 +40,69 @@
         END AS status
     FROM kafka_count, table_count
     
-{% endmacro %}
\ No newline at end of file
+{% endmacro %}
+
+{% macro iceberg_metadata_table(relation, suffix) %}
+    {# Returns the name of an Iceberg metadata table, e.g. iceberg.default."events$snapshots" #}
+    {% set parts = (relation | string).split('.') %}
+    {% set table_name = parts[-1] | replace('"', '') %}
+    {{ return((parts[:-1] + ['"' ~ table_name ~ '$' ~ suffix ~ '"']) | join('.')) }}
+{% endmacro %}
+
+{% macro inserted_row_count(insert_result, target_table) %}
+    {# Row count of an INSERT, taken from Trino's update count instead of rescanning the table #}
+    {# Falls back to the added-records summary of the latest Iceberg snapshot #}
+    {% if not execute %}
+        {{ return(0) }}
+    {% endif %}
+
+    {% if insert_result is not none and insert_result.rows | length > 0 and insert_result.rows[0][0] is number %}
+        {{ return(insert_result.rows[0][0] | int) }}
+    {% endif %}
+
+    {% set added_records_query %}
+        SELECT CAST(summary['added-records'] AS BIGINT) AS added_records
+        FROM {{ iceberg_metadata_table(target_table, 'snapshots') }}
+        ORDER BY committed_at DESC
+        LIMIT 1
+    {% endset %}
+    {% set result = run_query(added_records_query) %}
+    {% if result.rows | length > 0 and result.rows[0][0] is not none %}
+        {{ return(result.rows[0][0] | int) }}
+    {% endif %}
+    {{ return(0) }}
+{% endmacro %}
+
+{% macro log_sync_metrics(source, target_table, rows_inserted, last_offset) %}
+    {# Emits one structured (JSON) metrics line per sync run #}
+    {% do log("sync_metrics " ~ tojson({
+        'source': source | string,
+        'target_table': target_table | string,
+        'rows_inserted': rows_inserted | int,
+        'last_offset': last_offset | int,
+        'run_started_at': run_started_at | string
+    }), info=True) %}
+{% endmacro %}
+
+{% macro kafka_message_columns() %}
+    {# Column mapping for Kafka messages, in the shape of a Trino topic description's `fields` #}
+    {{ return(var('kafka_message_columns')) }}
+{% endmacro %}
+
+{% macro parsed_kafka_message(message_column, columns=none) %}
+    {#- Parses a JSON message once into a ROW holding every mapped field as JSON; a malformed or non-object message gives NULL -#}
+    {%- set columns = columns if columns is not none else kafka_message_columns() -%}
+    {%- set fields = [] -%}
+    {%- for column in columns -%}
+        {%- do fields.append('"' ~ column['mapping'] ~ '" JSON') -%}
+    {%- endfor -%}
+    TRY(CAST(json_parse(CAST({{ message_column }} AS VARCHAR)) AS ROW({{ fields | join(', ') }})))
+{%- endmacro %}
+
+{% macro kafka_message_fields(alias='event', columns=none) %}
+    {#- Typed select list reading each mapped field from a message parsed by parsed_kafka_message; objects and arrays give NULL -#}
+    {%- set columns = columns if columns is not none else kafka_message_columns() -%}
+    {%- for column in columns -%}
+        CAST(TRY(CAST({{ alias }}."{{ column['mapping'] }}" AS VARCHAR)) AS {{ column['type'] }}) AS {{ column['name'] }}{{ ",\n        " if not loop.last }}
+    {%- endfor -%}
+{%- endmacro %}
@@ -0,0 +1,103 @@
+{% macro kafka_offset_range_predicate(lower, upper, partition_column='_partition_id', offset_column='_partition_offset') %}
+    {#- Records past each partition's lower offset, up to its upper one -#}
+    {#- The ranges' overall bounds lead as plain conjuncts, so file stats can prune on them -#}
+    {%- set clauses = [] -%}
+    {%- set starts = [] -%}
+    {%- set ends = [] -%}
+    {%- for partition in upper | sort -%}
+        {%- set start = lower.get(partition, -1) -%}
+        {%- if upper[partition] > start -%}
+            {%- do clauses.append('(' ~ partition_column ~ ' = ' ~ partition ~ ' AND ' ~ offset_column ~ ' > ' ~ start ~ ' AND ' ~ offset_column ~ ' <= ' ~ upper[partition] ~ ')') -%}
+            {%- do starts.append(start) -%}
+            {%- do ends.append(upper[partition]) -%}
+        {%- endif -%}
+    {%- endfor -%}
+    {%- if clauses -%}
+        ({{ offset_column }} > {{ starts | min }} AND {{ offset_column }} <= {{ ends | max }} AND ({{ clauses | join(' OR ') }}))
+    {%- else -%}
+        FALSE
+    {%- endif -%}
+{% endmacro %}
+
+{% macro kafka_rollup_pending_consumer(relation) %}
+    {{ return(kafka_consumer_name(relation) ~ '#pending') }}
+{% endmacro %}
+
+{% macro stage_kafka_rollup(relation, source_relation, topic, grain, time_column, upstream=none) %}
+    {# Plans a rollup run: the source offsets it covers and the time buckets the new ones fall in #}
+    {# The run covers up to the source's current offsets, or for a rollup built from a finer one (upstream) #}
+    {# up to that rollup's checkpoints. They are staged as pending checkpoints; commit_kafka_rollup promotes #}
+    {# them once the rebuilt buckets are in, so a failed run is simply redone. #}
+    {% if not execute %}
+        {{ return({'buckets': []}) }}
+    {% endif %}
+    {% do ensure_kafka_offset_table() %}
+    {% set lower = load_kafka_checkpoints(relation, topic) if is_incremental() else {} %}
+    {% if upstream is not none %}
+        {% set upper = load_kafka_checkpoints(upstream, topic) %}
+    {% else %}
+        {% set upper = lower.copy() %}
+        {% set latest_query %}
+            SELECT _partition_id, MAX(_partition_offset)
+            FROM ({{ kafka_pending_rows(source_relation, lower, ['_partition_id', '_partition_offset']) }})
+            GROUP BY _partition_id
+        {% endset %}
+        {% for row in run_query(latest_query).rows %}
+            {% do upper.update({row[0] | int: row[1] | int}) %}
+        {% endfor %}
+    {% endif %}
+
+    {% set pending = kafka_rollup_pending_consumer(relation) %}
+    {% do run_query("DELETE FROM " ~ kafka_offset_table() ~ " WHERE consumer = '" ~ pending ~ "' AND topic = '" ~ topic ~ "'") %}
+    {% if upper %}
+        {% set values = [] %}
+        {% for partition in upper | sort %}
+            {% do values.append("('" ~ pending ~ "', '" ~ topic ~ "', " ~ partition ~ ", " ~ upper[partition] ~ ", CURRENT_TIMESTAMP)") %}
+        {% endfor %}
+        {% do run_query("INSERT INTO " ~ kafka_offset_table() ~ " VALUES " ~ values | join(', ')) %}
+    {% endif %}
+
+    {% set buckets = [] %}
+    {% if is_incremental() %}
+        {% set buckets_query %}
+            SELECT DISTINCT date_trunc('{{ grain }}', {{ time_column }})
+            FROM {{ source_relation }}
+            WHERE {{ kafka_offset_range_predicate(lower, upper) }}
+            ORDER BY 1
+        {% endset %}
+        {% for row in run_query(buckets_query).rows if row[0] is not none %}
+            {% do buckets.append(row[0]) %}
+        {% endfor %}
+        {% do log(relation ~ ": recomputing " ~ buckets | length ~ " " ~ grain ~ " buckets", info=True) %}
+    {% endif %}
+    {{ return({'buckets': buckets}) }}
+{% endmacro %}
+
+{% macro kafka_rollup_filter(column, grain, buckets) %}
+    {#- Rows in the given buckets: a range that prunes files, narrowed to the buckets themselves -#}
+    {%- if not buckets -%}
+        FALSE
+    {%- else -%}
+        ({{ column }} >= TIMESTAMP '{{ buckets[0] }}'
+        AND {{ column }} < TIMESTAMP '{{ buckets[-1] }}' + INTERVAL '1' {{ grain }}
+        {%- if buckets | length <= 1000 %}
+        AND date_trunc('{{ grain }}', {{ column }}) IN ({% for bucket in buckets %}TIMESTAMP '{{ bucket }}'{{ ", " if not loop.last }}{% endfor %})
+        {%- endif -%})
+    {%- endif -%}
+{% endmacro %}
+
+{% macro commit_kafka_rollup(relation, topic) %}
+    {# post_hook: the staged offsets become the rollup's checkpoints #}
+    MERGE INTO {{ kafka_offset_table() }} t
+    USING (
+        SELECT '{{ kafka_consumer_name(relation) }}' AS consumer, topic, partition_id, committed_offset
+        FROM {{ kafka_offset_table() }}
+        WHERE consumer = '{{ kafka_rollup_pending_consumer(relation) }}' AND topic = '{{ topic }}'
+    ) s
+    ON t.consumer = s.consumer AND t.topic = s.topic AND t.partition_id = s.partition_id
+    WHEN MATCHED THEN
+        UPDATE SET committed_offset = s.committed_offset, updated_at = CURRENT_TIMESTAMP
+    WHEN NOT MATCHED THEN
+        INSERT (consumer, topic, partition_id, committed_offset, updated_at)
+        VALUES (s.consumer, s.topic, s.partition_id, s.committed_offset, CURRENT_TIMESTAMP)
+{% endmacro %}
@@ -0,0 +1,46 @@
+{% macro kafka_array_literal(values) %}
+    {{ return("ARRAY[" ~ ("'" ~ values | join("', '") ~ "'") ~ "]") }}
+{% endmacro %}
+
+{% macro kafka_table_properties(partition_column, offset_column, default_partitioning=[]) %}
+    {# Iceberg table properties of a Kafka-fed table, from the kafka_table_layout var #}
+    {# Tables keep default_partitioning unless the var sets partitioning #}
+    {# sort_by_offset sorts each data file on (partition, offset) so offset lookups prune files #}
+    {% set layout = var('kafka_table_layout', {}) %}
+    {% set properties = {'format': "'PARQUET'"} %}
+    {% set partitioning = layout.get('partitioning', default_partitioning) %}
+    {% if partitioning %}
+        {% do properties.update({'partitioning': kafka_array_literal(partitioning)}) %}
+    {% endif %}
+    {% if layout.get('sort_by_offset') %}
+        {% do properties.update({'sorted_by': kafka_array_literal([partition_column, offset_column])}) %}
+    {% endif %}
+    {% if layout.get('bloom_filter_columns') %}
+        {% do properties.update({'parquet_bloom_filter_columns': kafka_array_literal(layout['bloom_filter_columns'])}) %}
+    {% endif %}
+    {{ return(properties) }}
+{% endmacro %}
+
+{% macro kafka_table_with_clause(partition_column, offset_column, default_partitioning=[]) %}
+    {%- set properties = kafka_table_properties(partition_column, offset_column, default_partitioning) -%}
+    {%- set assignments = [] -%}
+    {%- for name, value in properties.items() -%}
+        {%- do assignments.append(name ~ ' = ' ~ value) -%}
+    {%- endfor -%}
+    WITH ({{ assignments | join(', ') }})
+{%- endmacro %}
+
+{% macro migrate_kafka_table_layout(table, partition_column='_partition_id', offset_column='_partition_offset', rewrite=true) %}
+    {# Applies the kafka_table_layout var to an existing table while ingestion keeps running #}
+    {# dbt run-operation migrate_kafka_table_layout --args '{"table": "iceberg.default.raw_events_streaming", "partition_column": "_kafka_partition", "offset_column": "_kafka_offset"}' #}
+    {# Property changes only affect new files; with rewrite, optimize rewrites the existing ones into the new layout #}
+    {% set properties = kafka_table_properties(partition_column, offset_column) %}
+    {% for name, value in properties.items() if name != 'format' %}
+        {% do run_query("ALTER TABLE " ~ table ~ " SET PROPERTIES " ~ name ~ " = " ~ value) %}
+        {% do log("Set " ~ name ~ " = " ~ value ~ " on " ~ table, info=True) %}
+    {% endfor %}
+    {% if rewrite %}
+        {% do run_query("ALTER TABLE " ~ table ~ " EXECUTE optimize(file_size_threshold => '1024MB')") %}
+        {% do log("Rewrote the data files of " ~ table ~ " with the new layout", info=True) %}
+    {% endif %}
+{% endmacro %}
@@ -13,10 +13,7 @@ CREATE TABLE IF NOT EXISTS {{ target_table }} (
     _kafka_offset BIGINT,
     processed_at TIMESTAMP
 )
-WITH (
-    format = 'PARQUET',
-    partitioning = ARRAY['day(processed_at)']
-)
+{{ kafka_table_with_clause('_kafka_partition', '_kafka_offset', ['day(processed_at)']) }}
 {% endset %}
 
 {% do run_query(create_table_if_not_exists) %}
@@ -38,16 +35,21 @@ FROM {{ target_table }}
 
 {% set insert_new_records %}
 INSERT INTO {{ target_table }}
-WITH kafka_data AS (
+WITH parsed AS (
     SELECT
-        CAST(JSON_EXTRACT_SCALAR(CAST(message AS VARCHAR), '$.id') AS BIGINT) AS id,
-        JSON_EXTRACT_SCALAR(CAST(message AS VARCHAR), '$.name') AS name,
-        CAST(JSON_EXTRACT_SCALAR(CAST(message AS VARCHAR), '$.created_at') AS TIMESTAMP) AS created_at,
+        {{ parsed_kafka_message('message') }} AS event,
         _kafka_partition,
-        _kafka_offset,
-        CURRENT_TIMESTAMP AS processed_at
+        _kafka_offset
     FROM {{ kafka_topic }}
     WHERE _kafka_offset > {{ last_offset }}
+),
+kafka_data AS (
+    SELECT
+        {{ kafka_message_fields('event') }},
+        _kafka_partition,
+        _kafka_offset,
+        CURRENT_TIMESTAMP AS processed_at
+    FROM parsed
     ORDER BY _kafka_offset
     LIMIT {{ batch_size }}
 )
@@ -62,21 +64,10 @@ FROM kafka_data
 WHERE id IS NOT NULL
 {% endset %}
 
-{% do run_query(insert_new_records) %}
-{% do log("Inserted new records from Kafka into " ~ target_table, info=True) %}
-
-{% set count_query %}
-SELECT COUNT(*) as cnt FROM {{ target_table }}
-{% endset %}
-
-{% set count_result = run_query(count_query) %}
-{% if execute %}
-    {% set record_count = count_result.columns['cnt'][0] %}
-{% else %}
-    {% set record_count = 0 %}
-{% endif %}
-
-{% do log("Total records in " ~ target_table ~ ": " ~ record_count, info=True) %}
+{% set insert_result = run_query(insert_new_records) %}
+{% set rows_inserted = inserted_row_count(insert_result, target_table) %}
+{% do log("Inserted " ~ rows_inserted ~ " new records from Kafka into " ~ target_table, info=True) %}
+{% do log_sync_metrics(kafka_topic, target_table, rows_inserted, last_offset) %}
 
 {# Return success message #}
 {{ return("Successfully synced data from " ~ kafka_topic ~ " to " ~ target_table) }}
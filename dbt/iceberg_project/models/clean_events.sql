@@ -1,8 +1,13 @@
-{{ config(materialized='table') }}
+{{ config(
+    materialized='incremental',
+    incremental_strategy='append',
+    post_hook="{{ commit_snapshot_watermark(this, 'iceberg.default.raw_events') }}"
+) }}
 
+{# Each run only cleans the rows added to raw_events since the snapshot the previous run read (see the snapshot_order_columns var) #}
 SELECT
   id,
   name,
   CAST(created_at AS timestamp) AS event_time
-FROM iceberg.default.raw_events
-WHERE id IS NOT NULL;
\ No newline at end of file
+FROM {{ iceberg_snapshot_changes('iceberg.default.raw_events') }} AS raw_events
+WHERE id IS NOT NULL
@@ -1,38 +1,36 @@
 {{ config(
     materialized='incremental',
-    unique_key='id', 
-    incremental_strategy='merge'
+    incremental_strategy='append',
+    properties=kafka_table_properties('_partition_id', '_partition_offset'),
+    post_hook="{{ checkpoint_kafka_batches(this, 'events_topic', full_refresh=flags.FULL_REFRESH) }}"
 ) }}
 
-{% set target_table = this %}
+{# Each batch is an offset range per partition. Appending only the records past each partition's #}
+{# watermark makes a re-run after a failure a no-op, without MERGE joining the whole table on id. #}
+{% if is_incremental() %}
+    {% set watermarks = kafka_batch_watermarks(this, 'events_topic') %}
+{% endif %}
 
-{% set max_offset_query %}
+WITH messages AS (
     {% if is_incremental() %}
-        SELECT COALESCE(MAX(_partition_offset), -1) as max_offset
-        FROM {{ target_table }}
+    {{ kafka_pending_rows(source('kafka_events', 'events_topic'), watermarks, ['_message', '_partition_id', '_partition_offset']) }}
     {% else %}
-        SELECT -1 as max_offset
+    SELECT _message, _partition_id, _partition_offset FROM {{ source('kafka_events', 'events_topic') }}
     {% endif %}
-{% endset %}
-
-{% set max_offset_result = run_query(max_offset_query) %}
-{% if execute %}
-    {% set last_offset = max_offset_result.columns['max_offset'][0] %}
-{% else %}
-    {% set last_offset = -1 %}
-{% endif %}
-
-WITH kafka_data AS (
+),
+parsed AS (
     SELECT
-        CAST(JSON_EXTRACT_SCALAR(CAST(_message AS VARCHAR), '$.id') AS BIGINT) AS id,
-        JSON_EXTRACT_SCALAR(CAST(_message AS VARCHAR), '$.name') AS name,
-        CAST(JSON_EXTRACT_SCALAR(CAST(_message AS VARCHAR), '$.created_at') AS TIMESTAMP(6)) AS created_at,
+        {{ parsed_kafka_message('_message') }} AS event,
         _partition_id,
         _partition_offset
-    FROM {{ source('kafka_events', 'events_topic') }}
-    {% if is_incremental() %}
-    WHERE _partition_offset > {{ last_offset }}
-    {% endif %}
+    FROM messages
+),
+kafka_data AS (
+    SELECT
+        {{ kafka_message_fields('event') }},
+        _partition_id,
+        _partition_offset
+    FROM parsed
 )
 
 SELECT
@@ -43,4 +41,4 @@ SELECT
     _partition_offset,
     CAST(CURRENT_TIMESTAMP AS TIMESTAMP(6)) AS processed_at
 FROM kafka_data
-WHERE id IS NOT NULL
\ No newline at end of file
+WHERE id IS NOT NULL
@@ -6,11 +6,16 @@
 ) }}
 
 SELECT
-    CAST(JSON_EXTRACT_SCALAR(CAST(message AS VARCHAR), '$.id') AS BIGINT) AS id,
-    JSON_EXTRACT_SCALAR(CAST(message AS VARCHAR), '$.name') AS name,
-    CAST(JSON_EXTRACT_SCALAR(CAST(message AS VARCHAR), '$.created_at') AS TIMESTAMP) AS created_at,
+    {{ kafka_message_fields('event') }},
     _kafka_partition,
     _kafka_offset,
     _timestamp
-FROM kafka.default.events_topic
-WHERE JSON_EXTRACT_SCALAR(CAST(message AS VARCHAR), '$.id') IS NOT NULL
\ No newline at end of file
+FROM (
+    SELECT
+        {{ parsed_kafka_message('message') }} AS event,
+        _kafka_partition,
+        _kafka_offset,
+        _timestamp
+    FROM kafka.default.events_topic
+)
+WHERE event."id" IS NOT NULL
\ No newline at end of file
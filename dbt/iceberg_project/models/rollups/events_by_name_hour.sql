@@ -0,0 +1,26 @@
+{{ config(
+    materialized='incremental',
+    incremental_strategy='delete+insert',
+    unique_key='bucket_start',
+    properties={'format': "'PARQUET'", 'partitioning': "ARRAY['month(bucket_start)']"},
+    post_hook="{{ commit_kafka_rollup(this, 'events_topic') }}"
+) }}
+
+{# Events per hour and name, summed from the minute rollup. It covers the offsets the minute rollup #}
+{# has checkpointed, so every hour it recomputes is complete there. #}
+{% set plan = stage_kafka_rollup(
+    this, ref('events_streaming'), 'events_topic', 'hour', 'created_at', upstream=ref('events_by_name_minute')
+) %}
+
+SELECT
+    date_trunc('hour', bucket_start) AS bucket_start,
+    name,
+    SUM(event_count) AS event_count,
+    MIN(first_event_at) AS first_event_at,
+    MAX(last_event_at) AS last_event_at,
+    CAST(CURRENT_TIMESTAMP AS TIMESTAMP(6)) AS refreshed_at
+FROM {{ ref('events_by_name_minute') }}
+{% if is_incremental() %}
+WHERE {{ kafka_rollup_filter('bucket_start', 'hour', plan['buckets']) }}
+{% endif %}
+GROUP BY 1, 2
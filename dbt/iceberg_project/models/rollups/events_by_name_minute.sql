@@ -0,0 +1,24 @@
+{{ config(
+    materialized='incremental',
+    incremental_strategy='delete+insert',
+    unique_key='bucket_start',
+    properties={'format': "'PARQUET'", 'partitioning': "ARRAY['day(bucket_start)']"},
+    post_hook="{{ commit_kafka_rollup(this, 'events_topic') }}"
+) }}
+
+{# Events per minute and name. A run recomputes only the minutes that rows appended to events_streaming #}
+{# since the last run fall in; delete+insert replaces those minutes whole. #}
+{% set plan = stage_kafka_rollup(this, ref('events_streaming'), 'events_topic', 'minute', 'created_at') %}
+
+SELECT
+    date_trunc('minute', created_at) AS bucket_start,
+    name,
+    COUNT(*) AS event_count,
+    MIN(created_at) AS first_event_at,
+    MAX(created_at) AS last_event_at,
+    CAST(CURRENT_TIMESTAMP AS TIMESTAMP(6)) AS refreshed_at
+FROM {{ ref('events_streaming') }}
+{% if is_incremental() %}
+WHERE {{ kafka_rollup_filter('created_at', 'minute', plan['buckets']) }}
+{% endif %}
+GROUP BY 1, 2
@@ -1,135 +1,399 @@
-from flask import Flask, render_template, request, jsonify
+from flask import (Blueprint, Flask, after_this_request, current_app, g, render_template, request, jsonify,
+                   stream_with_context)
+from flask import json as flask_json
+from werkzeug.local import LocalProxy
 import trino
 import json
 import traceback
 import uuid
 import datetime
-import socket
-
-# Try to import confluent_kafka, but provide fallback if not available
-try:
-    from confluent_kafka import Producer
-    KAFKA_AVAILABLE = True
-    print("Confluent Kafka is available, using real Kafka integration")
-except ImportError:
-    print("confluent_kafka package not available. Kafka event production will be simulated.")
-    KAFKA_AVAILABLE = False
-
-# Stub for Producer to use when Kafka is not available
-class MockProducer:
-    def produce(self, topic, key=None, value=None):
-        print(f"MOCK KAFKA: Would send to topic {topic}, key={key}, value={value}")
-        return True
-        
-    def flush(self):
-        return True
+import time
 
-app = Flask(__name__)
+from event_spool import EventSpool, SpoolDrainer, SpoolFullError, claim_spool_directory
+from kafka_producer import KAFKA_AVAILABLE, EventProducer
+from metadata_cache import MetadataCache
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY, record_trino_query
+from query_cursors import CachedRows, CursorRegistry, OpenCursor
+from query_execution import QueryRunner
+from query_jobs import JOB_STATES, JobLimitError, QueryJobManager
+from query_profiles import QueryHistory, add_iceberg_pruning, build_query_profile, fetch_query_info
+from result_cache import ResultCache
+from rollups import RollupRouter, load_rollups
+from result_formats import (ARROW_AVAILABLE, ARROW_STREAM_MIMETYPE, COLUMNAR_JSON_MIMETYPE, ColumnarResult,
+                            compress, negotiate_encoding, negotiate_format)
+from trino_pool import TrinoConnectionPool
 
 # Trino connection details from environment variables
 import os
 
 # Update these values to match your Trino server settings
+# (defaults for each app's config; /update_settings changes them per app)
 TRINO_HOST = os.environ.get("TRINO_HOST", "localhost")  # Change to your Trino server hostname/IP
 TRINO_PORT = int(os.environ.get("TRINO_PORT", 8080))
 TRINO_USER = os.environ.get("TRINO_USER", "trino")
 TRINO_CATALOG = os.environ.get("TRINO_CATALOG", "iceberg")
 TRINO_SCHEMA = os.environ.get("TRINO_SCHEMA", "default")
 
+# Trino connection pool tuning
+TRINO_POOL_SIZE = int(os.environ.get("TRINO_POOL_SIZE", 8))
+TRINO_POOL_TIMEOUT = float(os.environ.get("TRINO_POOL_TIMEOUT", 10))
+TRINO_POOL_HEALTH_CHECK_AFTER = float(os.environ.get("TRINO_POOL_HEALTH_CHECK_AFTER", 30))
+TRINO_POOL_MAX_IDLE = float(os.environ.get("TRINO_POOL_MAX_IDLE", 300))
+TRINO_POOL_MAX_LIFETIME = float(os.environ.get("TRINO_POOL_MAX_LIFETIME", 1800))
+
+# Result delivery limits for /execute_query
+QUERY_MAX_ROWS = int(os.environ.get("QUERY_MAX_ROWS", 100000))
+QUERY_MAX_BYTES = int(os.environ.get("QUERY_MAX_BYTES", 64 * 1024 * 1024))
+QUERY_FETCH_SIZE = int(os.environ.get("QUERY_FETCH_SIZE", 1000))
+QUERY_CURSOR_TTL = float(os.environ.get("QUERY_CURSOR_TTL", 300))
+# Each open cursor holds a pooled connection; capped below TRINO_POOL_SIZE so other requests always get one
+QUERY_MAX_OPEN_CURSORS = int(os.environ.get("QUERY_MAX_OPEN_CURSORS", max(1, TRINO_POOL_SIZE // 2)))
+# Rows per batch when encoding Arrow / columnar JSON results
+QUERY_COLUMNAR_BATCH_ROWS = int(os.environ.get("QUERY_COLUMNAR_BATCH_ROWS", 10000))
+
+# Catalog/schema/table/column listings cache
+METADATA_CACHE_TTL = float(os.environ.get("METADATA_CACHE_TTL", 60))
+METADATA_CACHE_STALE_TTL = float(os.environ.get("METADATA_CACHE_STALE_TTL", 600))
+METADATA_CACHE_MAX_ENTRIES = int(os.environ.get("METADATA_CACHE_MAX_ENTRIES", 1024))
+
+# Asynchronous query jobs (/jobs)
+QUERY_JOB_THREADS = int(os.environ.get("QUERY_JOB_THREADS", 8))
+QUERY_JOB_MAX_PER_USER = int(os.environ.get("QUERY_JOB_MAX_PER_USER", 4))
+QUERY_JOB_MAX_ACTIVE = int(os.environ.get("QUERY_JOB_MAX_ACTIVE", 64))
+QUERY_JOB_TTL = float(os.environ.get("QUERY_JOB_TTL", 300))
+
+# Result cache for repeated read-only queries over Iceberg tables
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+RESULT_CACHE_SPILL_DIR = os.environ.get("RESULT_CACHE_SPILL_DIR")  # unset: memory only
+RESULT_CACHE_SPILL_MAX_BYTES = int(os.environ.get("RESULT_CACHE_SPILL_MAX_BYTES", 1024 * 1024 * 1024))
+RESULT_CACHE_SNAPSHOT_TTL = float(os.environ.get("RESULT_CACHE_SNAPSHOT_TTL", 1))
+RESULT_CACHE_CATALOGS = set(os.environ.get("RESULT_CACHE_CATALOGS", "iceberg").split(','))
+
+# Rollup tables kept by kafka_to_iceberg.py --rollup (or dbt) that /execute_query may answer aggregate
+# queries from, as JSON, e.g. [{"source": "iceberg.default.events_streaming", "grains": ["minute", "hour"]}]
+QUERY_ROLLUPS = os.environ.get("QUERY_ROLLUPS", "")  # unset: always query the raw tables
+
+# Query profiles (/query_profile/<query_id>, "profile": true) and the slow query history (/slow_queries)
+QUERY_PROFILE_WAIT = float(os.environ.get("QUERY_PROFILE_WAIT", 2))  # seconds to wait for final stage stats
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get("SLOW_QUERY_THRESHOLD_MS", 1000))
+SLOW_QUERY_HISTORY = int(os.environ.get("SLOW_QUERY_HISTORY", 200))
+SLOW_QUERY_FINGERPRINTS = int(os.environ.get("SLOW_QUERY_FINGERPRINTS", 1000))
+
 # Kafka connection details from environment variables
 # Default to localhost for when running on the host machine
 KAFKA_BOOTSTRAP_SERVERS = os.environ.get("KAFKA_BOOTSTRAP_SERVERS", "localhost:9092")
 KAFKA_TOPIC = os.environ.get("KAFKA_TOPIC", "events_topic")
 
-def get_trino_connection():
-    """Create and return a Trino connection"""
+# Batching settings for the shared Kafka producer
+KAFKA_PRODUCER_CONFIG = {
+    'linger.ms': int(os.environ.get("KAFKA_LINGER_MS", 20)),
+    'batch.size': int(os.environ.get("KAFKA_BATCH_BYTES", 512 * 1024)),
+    'compression.type': os.environ.get("KAFKA_COMPRESSION", "lz4"),
+    'queue.buffering.max.messages': int(os.environ.get("KAFKA_QUEUE_MAX_MESSAGES", 500000)),
+    'acks': os.environ.get("KAFKA_ACKS", "all"),
+}
+# Upper bound for a single /send_events request
+KAFKA_MAX_BULK_EVENTS = int(os.environ.get("KAFKA_MAX_BULK_EVENTS", 100000))
+
+# Local spool for /send_event(s): events are acked once on disk and drained to Kafka in the background,
+# so broker outages don't fail or slow down requests. Each worker process claims a worker-N subdirectory.
+EVENT_SPOOL_DIR = os.environ.get("EVENT_SPOOL_DIR")  # unset: send straight to the producer
+EVENT_SPOOL_MAX_BYTES = int(os.environ.get("EVENT_SPOOL_MAX_BYTES", 1024 * 1024 * 1024))
+EVENT_SPOOL_SEGMENT_BYTES = int(os.environ.get("EVENT_SPOOL_SEGMENT_BYTES", 64 * 1024 * 1024))
+EVENT_SPOOL_SYNC_MS = float(os.environ.get("EVENT_SPOOL_SYNC_MS", 5))  # fsync batching window
+EVENT_SPOOL_FSYNC = os.environ.get("EVENT_SPOOL_FSYNC", "1") == "1"  # 0: ack before the fsync
+EVENT_SPOOL_DRAIN_BATCH = int(os.environ.get("EVENT_SPOOL_DRAIN_BATCH", 5000))
+EVENT_SPOOL_MAX_BACKOFF = float(os.environ.get("EVENT_SPOOL_MAX_BACKOFF", 30))
+
+# Seconds a stopping worker waits for queued Kafka messages to be delivered
+SHUTDOWN_FLUSH_TIMEOUT = float(os.environ.get("SHUTDOWN_FLUSH_TIMEOUT", 10))
+
+bp = Blueprint('webapp', __name__)
+
+# Webapp metrics, served at /metrics with the Trino and Kafka producer ones
+HTTP_REQUESTS = REGISTRY.counter(
+    'webapp_http_requests_total', 'HTTP requests handled', ['endpoint', 'method', 'status'])
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    'webapp_http_request_duration_seconds', 'Time to build a response (streamed bodies excluded)', ['endpoint'])
+TRINO_POOL_CONNECTIONS = REGISTRY.gauge(
+    'trino_pool_connections', 'Pooled Trino connections', ['state'])
+KAFKA_PRODUCER_PENDING = REGISTRY.gauge(
+    'kafka_producer_pending_messages', 'Kafka messages queued but not yet delivered')
+QUERY_JOBS = REGISTRY.gauge(
+    'query_jobs', 'Query jobs kept in memory', ['state'])
+OPEN_CURSORS = REGISTRY.gauge(
+    'query_open_cursors', 'Server-side cursors waiting for their next page')
+EVENT_SPOOL_PENDING_EVENTS = REGISTRY.gauge(
+    'event_spool_pending_events', 'Spooled events not yet delivered to Kafka')
+EVENT_SPOOL_PENDING_BYTES = REGISTRY.gauge(
+    'event_spool_pending_bytes', 'Bytes of spooled events not yet delivered to Kafka')
+
+def get_trino_connection(config):
+    """Create and return a Trino connection using an app's connection settings"""
     try:
-        print(f"Connecting to Trino at {TRINO_HOST}:{TRINO_PORT} as user '{TRINO_USER}'")
-        conn = trino.dbapi.connect(
-            host=TRINO_HOST,
-            port=TRINO_PORT,
-            user=TRINO_USER,
-            catalog=TRINO_CATALOG,
-            schema=TRINO_SCHEMA,
+        print(f"Connecting to Trino at {config['TRINO_HOST']}:{config['TRINO_PORT']} as user '{config['TRINO_USER']}'")
+        # trino.dbapi connections are lazy; the pool health checks them once they go idle
+        return trino.dbapi.connect(
+            host=config['TRINO_HOST'],
+            port=config['TRINO_PORT'],
+            user=config['TRINO_USER'],
+            catalog=config['TRINO_CATALOG'],
+            schema=config['TRINO_SCHEMA'],
             # Add a reasonable connection timeout
             http_scheme="http",
             request_timeout=30,
         )
-        # Test the connection with a simple query
-        cursor = conn.cursor()
-        cursor.execute("SELECT 1")
-        result = cursor.fetchone()
-        print(f"Successfully connected to Trino and executed test query: {result}")
-        return conn
     except Exception as e:
         print(f"Error connecting to Trino: {str(e)}")
         traceback.print_exc()
         return None
 
+class AppServices:
+    """The Trino pool, caches, query jobs and Kafka producer of one app
+
+    ``create_app`` builds one per worker process, after gunicorn has forked, and
+    its request threads share it (every member is thread-safe). ``shutdown``
+    cancels running queries and flushes the producer before the worker exits.
+    """
+
+    def __init__(self, config):
+        # Shared pool of Trino connections, rebuilt when the connection settings change
+        self.trino_pool = TrinoConnectionPool(
+            lambda: get_trino_connection(config),
+            max_size=TRINO_POOL_SIZE,
+            acquire_timeout=TRINO_POOL_TIMEOUT,
+            health_check_after=TRINO_POOL_HEALTH_CHECK_AFTER,
+            max_idle=TRINO_POOL_MAX_IDLE,
+            max_lifetime=TRINO_POOL_MAX_LIFETIME,
+            # A request that would time out waiting takes the connection of the least recently used cursor
+            reclaim=lambda: self.cursor_registry.evict_oldest(),
+        )
+
+        # Timings of finished queries by SQL fingerprint, and the slowest recent ones
+        self.query_history = QueryHistory(
+            threshold_ms=SLOW_QUERY_THRESHOLD_MS,
+            max_slow=SLOW_QUERY_HISTORY,
+            max_fingerprints=SLOW_QUERY_FINGERPRINTS,
+        )
+
+        # Server-side cursors for paged /execute_query results
+        self.cursor_registry = CursorRegistry(
+            self.trino_pool.release, ttl=QUERY_CURSOR_TTL,
+            max_open=min(QUERY_MAX_OPEN_CURSORS, TRINO_POOL_SIZE - 1),
+            on_close=self.query_closed
+        )
+
+        # Browser listings, so sidebar refreshes and autocomplete don't hit the metastore each time
+        self.metadata_cache = MetadataCache(
+            ttl=METADATA_CACHE_TTL,
+            stale_ttl=METADATA_CACHE_STALE_TTL,
+            max_entries=METADATA_CACHE_MAX_ENTRIES,
+        )
+
+        # Query results reused until a referenced Iceberg table commits a new snapshot
+        self.result_cache = ResultCache(
+            max_bytes=RESULT_CACHE_MAX_BYTES,
+            spill_dir=RESULT_CACHE_SPILL_DIR,
+            spill_max_bytes=RESULT_CACHE_SPILL_MAX_BYTES,
+            snapshot_ttl=RESULT_CACHE_SNAPSHOT_TTL,
+        )
+
+        # Aggregate queries the rollup tables can answer
+        self.rollup_router = RollupRouter(load_rollups(QUERY_ROLLUPS))
+
+        # Rollup routing, result caching and DDL handling shared by /execute_query and /jobs
+        self.query_runner = QueryRunner(self.result_cache, self.metadata_cache, self.rollup_router, RESULT_CACHE_CATALOGS)
+
+        # Queries submitted through /jobs run here instead of in the request thread
+        self.query_jobs = QueryJobManager(
+            self.trino_pool.acquire,
+            self.trino_pool.release,
+            flask_json.dumps,
+            self.query_runner,
+            on_finished=self.query_job_finished,
+            max_workers=QUERY_JOB_THREADS,
+            max_per_user=QUERY_JOB_MAX_PER_USER,
+            max_active=QUERY_JOB_MAX_ACTIVE,
+            max_rows=QUERY_MAX_ROWS,
+            max_bytes=QUERY_MAX_BYTES,
+            fetch_size=QUERY_FETCH_SIZE,
+            ttl=QUERY_JOB_TTL,
+        )
+
+        # One long-lived producer per process; messages are batched by librdkafka
+        self.event_producer = EventProducer(config['KAFKA_BOOTSTRAP_SERVERS'], KAFKA_PRODUCER_CONFIG)
+
+        # Optional on-disk spool in front of the producer
+        self.event_spool = None
+        self.spool_drainer = None
+        if EVENT_SPOOL_DIR:
+            directory, self._spool_lock = claim_spool_directory(EVENT_SPOOL_DIR)
+            self.event_spool = EventSpool(
+                directory,
+                segment_bytes=EVENT_SPOOL_SEGMENT_BYTES,
+                max_bytes=EVENT_SPOOL_MAX_BYTES,
+                sync_interval=EVENT_SPOOL_SYNC_MS / 1000,
+                wait_for_sync=EVENT_SPOOL_FSYNC,
+            )
+            self.spool_drainer = SpoolDrainer(
+                self.event_spool, self.event_producer,
+                batch_size=EVENT_SPOOL_DRAIN_BATCH, max_backoff=EVENT_SPOOL_MAX_BACKOFF,
+            )
+            print(f"Spooling events in {directory} ({self.event_spool.pending_events} waiting for Kafka)")
+
+    def query_closed(self, entry):
+        """Record the final Trino stats of an /execute_query cursor"""
+        record_trino_query('execute_query', entry.cursor.stats)
+        self.query_history.record('execute_query', entry.query, entry.cursor.stats)
+
+    def query_job_finished(self, job):
+        """Record the job's Trino stats"""
+        record_trino_query('job', job.trino_stats)
+        self.query_history.record('job', job.query, job.trino_stats)
+
+    def shutdown(self, timeout=SHUTDOWN_FLUSH_TIMEOUT):
+        """Cancel running queries, deliver queued Kafka messages and close connections"""
+        self.query_jobs.shutdown()
+        self.cursor_registry.close_all()
+        spooled = 0
+        if self.event_spool is not None:
+            # Undelivered events stay in the spool for the next worker
+            self.spool_drainer.stop(timeout)
+            self.event_spool.close()
+            self._spool_lock.close()
+            spooled = self.event_spool.pending_events
+        remaining = self.event_producer.close(timeout)
+        self.trino_pool.close()
+        print(f"Webapp shut down ({remaining} Kafka messages undelivered, {spooled} left in the spool)")
+
+def create_app(config=None):
+    """Build the Flask app; gunicorn calls this once in each worker ('app:create_app()')"""
+    app = Flask(__name__)
+    app.config.update(
+        TRINO_HOST=TRINO_HOST,
+        TRINO_PORT=TRINO_PORT,
+        TRINO_USER=TRINO_USER,
+        TRINO_CATALOG=TRINO_CATALOG,
+        TRINO_SCHEMA=TRINO_SCHEMA,
+        KAFKA_BOOTSTRAP_SERVERS=KAFKA_BOOTSTRAP_SERVERS,
+        KAFKA_TOPIC=KAFKA_TOPIC,
+    )
+    if config:
+        app.config.update(config)
+    app.extensions['webapp'] = AppServices(app.config)
+    app.register_blueprint(bp)
+    app.before_request(start_request_timer)
+    app.after_request(record_request_metrics)
+    return app
+
+def shutdown_app(app, timeout=SHUTDOWN_FLUSH_TIMEOUT):
+    """Release an app's connections, flushing pending Kafka messages first"""
+    app.extensions['webapp'].shutdown(timeout)
+
+def start_request_timer():
+    g.request_started = time.monotonic()
+
+def record_request_metrics(response):
+    """Count the request and time it, by endpoint (not URL, to keep label values bounded)"""
+    endpoint = request.endpoint or 'unmatched'
+    HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    if 'request_started' in g:
+        HTTP_REQUEST_DURATION.observe(time.monotonic() - g.request_started, endpoint=endpoint)
+    return response
+
+def services():
+    """The current app's AppServices"""
+    return current_app.extensions['webapp']
+
+# The current app's shared resources, for use inside requests
+trino_pool = LocalProxy(lambda: services().trino_pool)
+cursor_registry = LocalProxy(lambda: services().cursor_registry)
+metadata_cache = LocalProxy(lambda: services().metadata_cache)
+result_cache = LocalProxy(lambda: services().result_cache)
+query_jobs = LocalProxy(lambda: services().query_jobs)
+event_producer = LocalProxy(lambda: services().event_producer)
+event_spool = LocalProxy(lambda: services().event_spool)
+query_runner = LocalProxy(lambda: services().query_runner)
+query_history = LocalProxy(lambda: services().query_history)
+
+def trino_settings():
+    """The current app's Trino connection settings, as a comparable tuple"""
+    config = current_app.config
+    return (config['TRINO_HOST'], config['TRINO_PORT'], config['TRINO_USER'],
+            config['TRINO_CATALOG'], config['TRINO_SCHEMA'])
+
+def connection_details():
+    """Trino connection settings for error responses"""
+    host, port, user, catalog, schema = trino_settings()
+    return {'host': host, 'port': port, 'user': user, 'catalog': catalog, 'schema': schema}
+
 def get_kafka_producer():
-    """Create and return a Kafka producer, or a mock producer if Kafka is not available"""
-    if not KAFKA_AVAILABLE:
-        # Return a mock producer that logs messages instead of sending them
-        return MockProducer()
-        
-    try:
-        producer_config = {
-            'bootstrap.servers': KAFKA_BOOTSTRAP_SERVERS,
-            'client.id': socket.gethostname()
-        }
-        return Producer(producer_config)
-    except Exception as e:
-        print(f"Error creating Kafka producer: {str(e)}")
-        print("Falling back to mock Kafka producer")
-        return MockProducer()
+    """Return the shared Kafka producer (simulated if Kafka is not available)"""
+    return event_producer
+
+def prepare_event(event_data):
+    """Add default fields and return the (key, JSON value) pair for an event"""
+    if 'id' not in event_data:
+        event_data['id'] = str(uuid.uuid4())
+    if 'timestamp' not in event_data:
+        event_data['timestamp'] = datetime.datetime.now().isoformat()
+    return str(event_data.get('id')), json.dumps(event_data)
 
-@app.route('/')
+@bp.route('/')
 def index():
     """Render the main page"""
+    config = current_app.config
     connection_settings = {
-        'trino_host': TRINO_HOST,
-        'trino_port': TRINO_PORT,
-        'trino_user': TRINO_USER,
-        'trino_catalog': TRINO_CATALOG,
-        'trino_schema': TRINO_SCHEMA,
-        'kafka_bootstrap_servers': KAFKA_BOOTSTRAP_SERVERS,
-        'kafka_topic': KAFKA_TOPIC,
+        'trino_host': config['TRINO_HOST'],
+        'trino_port': config['TRINO_PORT'],
+        'trino_user': config['TRINO_USER'],
+        'trino_catalog': config['TRINO_CATALOG'],
+        'trino_schema': config['TRINO_SCHEMA'],
+        'kafka_bootstrap_servers': config['KAFKA_BOOTSTRAP_SERVERS'],
+        'kafka_topic': config['KAFKA_TOPIC'],
         'kafka_available': KAFKA_AVAILABLE
     }
     return render_template('index.html', **connection_settings)
 
-@app.route('/update_settings', methods=['POST'])
+@bp.route('/update_settings', methods=['POST'])
 def update_settings():
     """Update connection settings"""
-    global TRINO_HOST, TRINO_PORT, TRINO_USER, TRINO_CATALOG, TRINO_SCHEMA
-    global KAFKA_BOOTSTRAP_SERVERS, KAFKA_TOPIC
+    config = current_app.config
     
     data = request.json
+    previous_trino_settings = trino_settings()
     
     # Update Trino settings
     if 'trino_host' in data:
-        TRINO_HOST = data['trino_host']
+        config['TRINO_HOST'] = data['trino_host']
     if 'trino_port' in data:
-        TRINO_PORT = int(data['trino_port'])
+        config['TRINO_PORT'] = int(data['trino_port'])
     if 'trino_user' in data:
-        TRINO_USER = data['trino_user']
+        config['TRINO_USER'] = data['trino_user']
     if 'trino_catalog' in data:
-        TRINO_CATALOG = data['trino_catalog']
+        config['TRINO_CATALOG'] = data['trino_catalog']
     if 'trino_schema' in data:
-        TRINO_SCHEMA = data['trino_schema']
+        config['TRINO_SCHEMA'] = data['trino_schema']
+    
+    # Pooled connections carry the old host/catalog/schema, so rebuild the pool
+    if trino_settings() != previous_trino_settings:
+        trino_pool.reset()
+        metadata_cache.invalidate()
+        result_cache.clear()
         
     # Update Kafka settings
     if 'kafka_bootstrap_servers' in data:
-        KAFKA_BOOTSTRAP_SERVERS = data['kafka_bootstrap_servers']
+        config['KAFKA_BOOTSTRAP_SERVERS'] = data['kafka_bootstrap_servers']
     if 'kafka_topic' in data:
-        KAFKA_TOPIC = data['kafka_topic']
+        config['KAFKA_TOPIC'] = data['kafka_topic']
+    event_producer.reconfigure(config['KAFKA_BOOTSTRAP_SERVERS'])
         
     # Test Kafka connection if bootstrap servers were updated
     kafka_status = {'available': False, 'message': 'Not tested'}
     if 'kafka_bootstrap_servers' in data and KAFKA_AVAILABLE:
         try:
             import socket
-            for server in KAFKA_BOOTSTRAP_SERVERS.split(','):
+            for server in config['KAFKA_BOOTSTRAP_SERVERS'].split(','):
                 host, port = server.split(':')
                 print(f"Testing connection to Kafka at {host}:{port}")
                 
@@ -151,22 +415,22 @@ def update_settings():
         'success': True,
         'message': 'Settings updated successfully',
         'settings': {
-            'trino_host': TRINO_HOST,
-            'trino_port': TRINO_PORT,
-            'trino_user': TRINO_USER,
-            'trino_catalog': TRINO_CATALOG,
-            'trino_schema': TRINO_SCHEMA,
-            'kafka_bootstrap_servers': KAFKA_BOOTSTRAP_SERVERS,
-            'kafka_topic': KAFKA_TOPIC
+            'trino_host': config['TRINO_HOST'],
+            'trino_port': config['TRINO_PORT'],
+            'trino_user': config['TRINO_USER'],
+            'trino_catalog': config['TRINO_CATALOG'],
+            'trino_schema': config['TRINO_SCHEMA'],
+            'kafka_bootstrap_servers': config['KAFKA_BOOTSTRAP_SERVERS'],
+            'kafka_topic': config['KAFKA_TOPIC']
         },
         'kafka_status': kafka_status
     })
 
-@app.route('/test_connection', methods=['POST'])
+@bp.route('/test_connection', methods=['POST'])
 def test_connection():
     """Test the Trino connection"""
     try:
-        conn = get_trino_connection()
+        conn = trino_pool.acquire()
         if not conn:
             return jsonify({'success': False, 'message': 'Failed to connect to Trino'}), 500
             
@@ -177,82 +441,295 @@ def test_connection():
         return jsonify({
             'success': True,
             'message': result,
-            'connection_details': {
-                'host': TRINO_HOST,
-                'port': TRINO_PORT,
-                'user': TRINO_USER,
-                'catalog': TRINO_CATALOG,
-                'schema': TRINO_SCHEMA
-            }
+            'connection_details': connection_details()
         })
     except Exception as e:
         error_details = {
             'success': False,
             'message': f"Error connecting to Trino: {str(e)}",
             'traceback': traceback.format_exc(),
-            'connection_details': {
-                'host': TRINO_HOST,
-                'port': TRINO_PORT,
-                'user': TRINO_USER,
-                'catalog': TRINO_CATALOG,
-                'schema': TRINO_SCHEMA
-            }
+            'connection_details': connection_details()
         }
         return jsonify(error_details), 500
     finally:
         if 'conn' in locals() and conn:
-            conn.close()
+            trino_pool.release(conn)
 
-@app.route('/execute_query', methods=['POST'])
+@bp.route('/pool_stats', methods=['GET'])
+def pool_stats():
+    """Return Trino connection pool metrics"""
+    return jsonify(trino_pool.stats())
+
+def read_result_page(entry, page_size):
+    """Read up to page_size rows from an open cursor as encoded JSON rows
+
+    Stops early once QUERY_MAX_ROWS/QUERY_MAX_BYTES would be exceeded.
+    Returns (encoded_rows, exhausted, truncated).
+    """
+    encoded = []
+    while len(encoded) < page_size:
+        if not entry.lookahead:
+            entry.lookahead.extend(entry.cursor.fetchmany(QUERY_FETCH_SIZE))
+            if not entry.lookahead:
+                return encoded, True, False
+        if entry.rows_sent >= QUERY_MAX_ROWS:
+            return encoded, True, True
+        row = entry.lookahead[0] if entry.encoded else flask_json.dumps(entry.lookahead[0])
+        if entry.bytes_sent + len(row) > QUERY_MAX_BYTES:
+            return encoded, True, True
+        entry.lookahead.popleft()
+        encoded.append(row)
+        entry.rows_sent += 1
+        entry.bytes_sent += len(row)
+
+    # Peek ahead so clients only get a next_token when more rows exist
+    if not entry.lookahead:
+        entry.lookahead.extend(entry.cursor.fetchmany(QUERY_FETCH_SIZE))
+    return encoded, not entry.lookahead, False
+
+def stream_query_results(entry, output_format):
+    """Yield query results page by page as NDJSON or a JSON document"""
+    columns = flask_json.dumps(entry.columns)
+    if output_format == 'ndjson':
+        yield '{"columns": ' + columns + '}\n'
+    else:
+        yield '{"success": true, "columns": ' + columns + ', "rows": ['
+
+    exhausted = truncated = False
+    error = None
+    first = True
+    try:
+        while not exhausted:
+            rows, exhausted, truncated = read_result_page(entry, QUERY_FETCH_SIZE)
+            if not rows:
+                continue
+            if output_format == 'ndjson':
+                yield '\n'.join(rows) + '\n'
+            else:
+                yield ('' if first else ',') + ','.join(rows)
+            first = False
+    except Exception as e:
+        print(f"Error streaming query results: {str(e)}")
+        traceback.print_exc()
+        error = str(e)
+    finally:
+        # Cancel on truncation, errors or a client disconnect (GeneratorExit)
+        cursor_registry.close(entry, cancel=not exhausted or truncated)
+
+    summary = {'rowCount': entry.rows_sent, 'truncated': truncated}
+    if error:
+        summary['error'] = error
+    if output_format == 'ndjson':
+        yield flask_json.dumps(summary) + '\n'
+    else:
+        yield '], ' + flask_json.dumps(summary)[1:]
+
+def fetch_next_page(next_token, page_size):
+    """Return the next page of a server-side cursor"""
+    entry = cursor_registry.take(next_token)
+    if entry is None:
+        return jsonify({'error': 'Unknown or expired next_token'}), 404
+
+    try:
+        rows, exhausted, truncated = read_result_page(entry, page_size)
+    except Exception as e:
+        cursor_registry.close(entry, cancel=True)
+        print(f"Error fetching result page: {str(e)}")
+        traceback.print_exc()
+        return jsonify({'error': str(e), 'traceback': traceback.format_exc()}), 500
+    return page_response(entry, rows, exhausted, truncated)
+
+def result_body(columns, rows, summary):
+    """JSON response body for encoded rows, with the ``summary`` fields after them"""
+    return ('{"success": true, "columns": ' + flask_json.dumps(columns)
+            + ', "rows": [' + ','.join(rows) + '], '
+            + flask_json.dumps(summary)[1:])
+
+def page_response(entry, rows, exhausted, truncated):
+    """Build a paged result response, keeping the cursor open if rows remain"""
+    if exhausted:
+        cursor_registry.close(entry, cancel=truncated)
+        next_token = None
+    else:
+        next_token = cursor_registry.register(entry)
+
+    body = ('{"success": true, "columns": ' + flask_json.dumps(entry.columns)
+            + ', "rows": [' + ','.join(rows) + '], '
+            + flask_json.dumps({
+                'rowCount': len(rows),
+                'totalRows': entry.rows_sent,
+                'truncated': truncated,
+                'next_token': next_token,
+            })[1:])
+    return current_app.response_class(body, mimetype='application/json')
+
+def columnar_response(entry, result_format):
+    """Encode a whole result as an Arrow IPC stream or columnar JSON
+
+    Columnar JSON is compressed according to Accept-Encoding (zstd or gzip);
+    Arrow buffers can be compressed with the ``arrow_compression`` field
+    ('lz4' or 'zstd') so clients still read them without an extra copy.
+    """
+    result = ColumnarResult(
+        entry.cursor,
+        fetch_size=QUERY_COLUMNAR_BATCH_ROWS,
+        max_rows=QUERY_MAX_ROWS,
+        max_bytes=QUERY_MAX_BYTES,
+    )
+    encoding = None
+    try:
+        if result_format == 'arrow':
+            body = result.to_arrow(compression=request.json.get('arrow_compression')).to_pybytes()
+            mimetype = ARROW_STREAM_MIMETYPE
+        else:
+            encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+            body = compress(result.to_columnar_json(), encoding)
+            mimetype = COLUMNAR_JSON_MIMETYPE
+    finally:
+        cursor_registry.close(entry, cancel=not result.exhausted)
+
+    print(f"Query returned {result.row_count} rows as {result_format}{' (truncated)' if result.truncated else ''}")
+    headers = {
+        'X-Row-Count': str(result.row_count),
+        'X-Truncated': 'true' if result.truncated else 'false',
+        'Vary': 'Accept, Accept-Encoding',
+    }
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    return current_app.response_class(body, mimetype=mimetype, headers=headers)
+
+@bp.route('/execute_query', methods=['POST'])
 def execute_query():
-    """Execute a Trino query and return the results"""
+    """Execute a Trino query and return the results
+
+    Optional JSON fields: ``stream`` ('ndjson' or 'json') streams the results
+    as they arrive, ``page_size`` returns a page plus a ``next_token`` for a
+    server-side cursor, and ``next_token`` fetches the following page.
+    ``format`` ('arrow' or 'columnar', also negotiated from the Accept header)
+    returns the whole result in a columnar encoding instead of JSON rows.
+    Aggregates a rollup can answer are run against it (``rollups``: false
+    opts out); the X-Query-Rollup header names the table used. ``profile``
+    adds the query's stage timings and table scans (see /query_profile).
+    """
     query = request.json.get('query', '')
+    next_token = request.json.get('next_token')
+    page_size = request.json.get('page_size')
+    output_format = request.json.get('stream')
+    profile = bool(request.json.get('profile'))
+
+    result_format = negotiate_format(request.json.get('format'), request.headers.get('Accept'))
+
+    if page_size is not None:
+        page_size = max(1, min(int(page_size), QUERY_MAX_ROWS))
+    if output_format and output_format not in ('ndjson', 'json'):
+        return jsonify({'error': f"Unsupported stream format: {output_format}"}), 400
+    if result_format not in ('json', 'columnar', 'arrow'):
+        return jsonify({'error': f"Unsupported result format: {result_format}"}), 400
+    if result_format != 'json' and (output_format or page_size or next_token):
+        return jsonify({'error': f"The {result_format} format returns whole results; it can't be streamed or paged"}), 400
+    if profile and (result_format != 'json' or output_format or page_size or next_token):
+        return jsonify({'error': 'Profiles are only collected for whole JSON results'}), 400
+    if result_format == 'arrow' and not ARROW_AVAILABLE:
+        return jsonify({'error': 'Arrow output requires pyarrow on the server'}), 406
+
+    if next_token:
+        return fetch_next_page(next_token, page_size or QUERY_FETCH_SIZE)
     
     if not query:
         return jsonify({'error': 'No query provided'}), 400
     
     print(f"Executing query: {query}")
-        
+
     try:
-        conn = get_trino_connection()
+        conn = trino_pool.acquire()
         if not conn:
-            connection_details = {
-                'host': TRINO_HOST,
-                'port': TRINO_PORT,
-                'user': TRINO_USER,
-                'catalog': TRINO_CATALOG,
-                'schema': TRINO_SCHEMA
-            }
-            error_message = f"Could not connect to Trino server. Please check your connection settings: {connection_details}"
+            details = connection_details()
+            error_message = f"Could not connect to Trino server. Please check your connection settings: {details}"
             print(error_message)
             return jsonify({
                 'error': error_message,
-                'connection_details': connection_details
+                'connection_details': details
             }), 500
-            
-        cursor = conn.cursor()
-        print(f"Executing query with cursor: {query}")
-        cursor.execute(query)
-        
+
+        # Whole or paged JSON results of read-only Iceberg queries can be answered from the cache
+        run = query_runner.prepare(
+            conn.cursor(), query, trino_settings(), rollups=request.json.get('rollups', True),
+            cache=not output_format and not profile and result_format == 'json',
+        )
+        cached = query_runner.cached(run)
+        if cached is not None:
+            if run.rollup:
+                mark_rollup_response(run.rollup)
+            columns, rows = cached
+            if page_size:
+                # Later pages come from the cached rows, without holding a connection
+                entry = OpenCursor(None, CachedRows(rows), columns, run.sql, encoded=True)
+                rows, exhausted, truncated = read_result_page(entry, page_size)
+                response = page_response(entry, rows, exhausted, truncated)
+                response.headers['X-Result-Cache'] = 'hit'
+                return response
+            return current_app.response_class(
+                result_body(columns, rows, {'rowCount': len(rows), 'truncated': False}),
+                mimetype='application/json', headers={'X-Result-Cache': 'hit'}
+            )
+
+        print(f"Executing query with cursor: {run.sql}")
+        cursor = query_runner.execute(conn, run)
+        if run.rollup:
+            mark_rollup_response(run.rollup)
+
         # Get column names
         columns = [desc[0] for desc in cursor.description] if cursor.description else []
         print(f"Query returned {len(columns)} columns")
-        
-        # Get data rows
-        rows = []
-        row_count = 0
-        for row in cursor:
-            rows.append(row)
-            row_count += 1
-        
-        print(f"Query returned {row_count} rows")
-            
-        return jsonify({
-            'success': True,
-            'columns': columns,
-            'rows': rows,
-            'rowCount': row_count
-        })
+
+        # From here on the open cursor owns the pooled connection
+        entry = OpenCursor(conn, cursor, columns, run.sql)
+        conn = None
+
+        if result_format != 'json':
+            return columnar_response(entry, result_format)
+
+        if output_format:
+            mimetype = 'application/x-ndjson' if output_format == 'ndjson' else 'application/json'
+            return current_app.response_class(
+                stream_with_context(stream_query_results(entry, output_format)),
+                mimetype=mimetype
+            )
+
+        try:
+            # Get data rows (bounded by QUERY_MAX_ROWS / QUERY_MAX_BYTES)
+            rows, exhausted, truncated = read_result_page(entry, page_size or QUERY_MAX_ROWS)
+        except Exception:
+            cursor_registry.close(entry, cancel=True)
+            raise
+
+        if page_size:
+            if exhausted and not truncated:
+                # The whole result fit in the first page
+                query_runner.store(run, columns, rows)
+            response = page_response(entry, rows, exhausted, truncated)
+            response.headers['X-Result-Cache'] = run.cache_status
+            return response
+        truncated = truncated or not exhausted
+        cursor_registry.close(entry, cancel=truncated)
+        query_runner.finished(run)
+        summary = {'rowCount': len(rows), 'truncated': truncated}
+        if profile:
+            try:
+                summary['profile'] = collect_query_profile((cursor.stats or {}).get('queryId'))
+            except Exception as e:
+                print(f"Error collecting the query profile: {str(e)}")
+                traceback.print_exc()
+                summary['profile_error'] = str(e)
+
+        print(f"Query returned {len(rows)} rows{' (truncated)' if truncated else ''}")
+
+        if not truncated:
+            query_runner.store(run, columns, rows)
+        return current_app.response_class(
+            result_body(columns, rows, summary), mimetype='application/json',
+            headers={'X-Result-Cache': run.cache_status}
+        )
     except Exception as e:
         print(f"Error executing query: {str(e)}")
         traceback.print_exc()
@@ -260,44 +737,153 @@ def execute_query():
             'error': str(e),
             'traceback': traceback.format_exc(),
             'query': query,
-            'connection_details': {
-                'host': TRINO_HOST,
-                'port': TRINO_PORT,
-                'user': TRINO_USER,
-                'catalog': TRINO_CATALOG,
-                'schema': TRINO_SCHEMA
-            }
+            'connection_details': connection_details()
         }
         return jsonify(error_details), 500
     finally:
         if 'conn' in locals() and conn:
-            conn.close()
+            trino_pool.release(conn)
+
+def collect_query_profile(query_id):
+    """Profile of a query Trino still remembers, with Iceberg pruning for the tables it read
+
+    Returns None if Trino has dropped the query from its history.
+    """
+    config = current_app.config
+    info = fetch_query_info(f"http://{config['TRINO_HOST']}:{config['TRINO_PORT']}", config['TRINO_USER'],
+                            query_id, wait=QUERY_PROFILE_WAIT)
+    if info is None:
+        return None
+    profile = build_query_profile(info)
+    if profile['scans']:
+        conn = trino_pool.acquire()
+        if conn:
+            try:
+                add_iceberg_pruning(conn.cursor(), profile['scans'])
+            finally:
+                trino_pool.release(conn)
+    query_history.attach_profile(profile['query_id'], profile['scans'])
+    return profile
+
+def request_user():
+    """Who a job belongs to, for per-user concurrency limits"""
+    return request.headers.get('X-User') or request.remote_addr or 'anonymous'
+
+def mark_rollup_response(rollup):
+    """Name the rollup a query was answered from in the response headers"""
+    @after_this_request
+    def add_rollup_header(response):
+        response.headers['X-Query-Rollup'] = rollup.table
+        return response
+
+@bp.route('/jobs', methods=['POST'])
+def submit_job():
+    """Submit a query to run in the background and return its job id
+
+    Like /execute_query, aggregates a rollup can answer run against it
+    (``rollups``: false opts out); the status's ``routed_to`` names the table.
+    """
+    query = (request.json or {}).get('query', '')
+    if not query:
+        return jsonify({'error': 'No query provided'}), 400
+    try:
+        job = query_jobs.submit(query, request_user(), trino_settings(), rollups=request.json.get('rollups', True))
+    except JobLimitError as e:
+        return jsonify({'error': str(e)}), 429
+    print(f"Submitted query job {job.id}: {query}")
+    return jsonify(job.status()), 202
+
+@bp.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Return a job's state and Trino progress (splits, rows, bytes processed)"""
+    job = query_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    return jsonify(job.status())
+
+@bp.route('/jobs/<job_id>/results', methods=['GET'])
+def job_results(job_id):
+    """Return the rows a job has fetched so far, from ``offset``, up to ``limit``"""
+    job = query_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = max(1, min(request.args.get('limit', QUERY_FETCH_SIZE, type=int), QUERY_MAX_ROWS))
+    status = job.status()
+    rows, more = job.page(offset, limit)
+    body = ('{"success": true, "columns": ' + flask_json.dumps(status['columns'] or [])
+            + ', "rows": [' + ','.join(rows) + '], '
+            + flask_json.dumps({
+                'state': status['state'],
+                'error': status['error'],
+                'rowCount': len(rows),
+                'offset': offset,
+                'next_offset': offset + len(rows) if more else None,
+                'truncated': status['truncated'],
+            })[1:])
+    return current_app.response_class(body, mimetype='application/json')
+
+@bp.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancel a job, including its query on Trino"""
+    job = query_jobs.cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    return jsonify(job.status())
+
+@bp.route('/job_stats', methods=['GET'])
+def job_stats():
+    """Return query job executor counters"""
+    return jsonify(query_jobs.stats())
+
+@bp.route('/query_profile/<query_id>', methods=['GET'])
+def query_profile(query_id):
+    """Return per-stage timing, rows, bytes, spill and skew of a query, and the Iceberg files it scanned"""
+    try:
+        profile = collect_query_profile(query_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error collecting the query profile: {str(e)}")
+        traceback.print_exc()
+        return jsonify({'error': str(e), 'connection_details': connection_details()}), 500
+    if profile is None:
+        return jsonify({'error': 'Unknown query, or no longer in Trino\'s query history'}), 404
+    return jsonify(profile)
 
-@app.route('/send_event', methods=['POST'])
+@bp.route('/slow_queries', methods=['GET'])
+def slow_queries():
+    """Return the slowest recent queries and the fingerprints taking the most time"""
+    limit = max(1, request.args.get('limit', 50, type=int))
+    return jsonify({
+        'threshold_ms': SLOW_QUERY_THRESHOLD_MS,
+        'slowest': query_history.slowest(limit),
+        'fingerprints': query_history.fingerprints(limit),
+    })
+
+@bp.route('/send_event', methods=['POST'])
 def send_event():
     """Send an event to Kafka"""
+    config = current_app.config
     try:
         event_data = request.json.get('event_data', {})
-        use_docker_method = request.json.get('use_docker_method', True)  # Default to Docker method
+        use_docker_method = request.json.get('use_docker_method', False)
+        wait_for_delivery = request.json.get('wait_for_delivery', False)
         
-        # Add default fields if not provided
-        if 'id' not in event_data:
-            event_data['id'] = str(uuid.uuid4())
-        if 'timestamp' not in event_data:
-            event_data['timestamp'] = datetime.datetime.now().isoformat()
-            
-        # Convert dict to JSON string
-        event_json = json.dumps(event_data)
+        # Add default fields if not provided and convert dict to JSON string
+        event_key, event_json = prepare_event(event_data)
         
         if use_docker_method:
             # Use Docker exec to send the event directly to Kafka within the container
+            # (starts a console producer per event; kept for debugging without a client library)
             import subprocess
             
             # Escape double quotes in the JSON string
+            topic = config['KAFKA_TOPIC']
             escaped_json = event_json.replace('"', '\\"')
             
             # Create the command to execute
-            command = f'docker exec -i kafka bash -c \'echo "{escaped_json}" | kafka-console-producer --broker-list kafka:9092 --topic {KAFKA_TOPIC}\''
+            command = f'docker exec -i kafka bash -c \'echo "{escaped_json}" | kafka-console-producer --broker-list kafka:9092 --topic {topic}\''
             
             print(f"Executing command: {command}")
             
@@ -323,52 +909,38 @@ def send_event():
                 'event': event_data,
                 'command_output': result.stdout
             })
+        elif event_spool:
+            # Acked once the event is on disk; the drain thread delivers it when Kafka is reachable
+            start_time = time.monotonic()
+            sequence = event_spool.append(config['KAFKA_TOPIC'], event_key, event_json)
+            delivered = event_spool.wait_drained(sequence, timeout=5.0) if wait_for_delivery else False
+            get_kafka_producer().stats.record_request(1, len(event_json), time.monotonic() - start_time)
+
+            success_message = 'Event sent successfully' if delivered else 'Event spooled for delivery'
+            if not KAFKA_AVAILABLE:
+                success_message += ' (in simulation mode)'
+
+            return jsonify({
+                'success': True,
+                'message': success_message,
+                'event': event_data,
+                'spooled': True,
+                'delivered': delivered,
+                'kafka_available': KAFKA_AVAILABLE,
+                'bootstrap_servers': config['KAFKA_BOOTSTRAP_SERVERS']
+            })
         else:
-            # Try the original method using Kafka producer
-            # Create Kafka producer
+            # Queue the event on the shared producer; delivery is reported asynchronously
+            start_time = time.monotonic()
             producer = get_kafka_producer()
-            if not producer:
-                return jsonify({
-                    'error': 'Could not create Kafka producer',
-                    'details': f'Bootstrap servers: {KAFKA_BOOTSTRAP_SERVERS}',
-                    'simulation_mode': not KAFKA_AVAILABLE
-                }), 500
-                
-            # Send message
-            print(f"Sending event to Kafka topic {KAFKA_TOPIC} at {KAFKA_BOOTSTRAP_SERVERS}")
-            try:
-                # Create a dummy check to see if Kafka is truly reachable
-                import socket
-                for server in KAFKA_BOOTSTRAP_SERVERS.split(','):
-                    host, port = server.split(':')
-                    print(f"Testing connection to {host}:{port}")
-                    
-                    try:
-                        # Try to connect to the host:port to verify it's reachable
-                        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                        s.settimeout(2)
-                        s.connect((host, int(port)))
-                        s.close()
-                        print(f"Successfully connected to {host}:{port}")
-                    except Exception as e:
-                        print(f"Failed to connect to {host}:{port}: {str(e)}")
-                        if not isinstance(producer, MockProducer):
-                            raise Exception(f"Cannot connect to Kafka at {host}:{port}: {str(e)}")
-                
-                # Now try to produce the message
-                producer.produce(KAFKA_TOPIC, key=str(event_data.get('id')), value=event_json)
-                producer.flush(timeout=5.0)  # Add timeout to prevent hanging
-                print(f"Event sent successfully: {event_json}")
-            except Exception as produce_error:
-                # Check if we're using a mock producer
-                if isinstance(producer, MockProducer):
-                    # With mock producer, just log and continue
-                    print(f"Mock producer simulated sending event: {event_json}")
-                else:
-                    # Real producer failed, raise the error
-                    raise produce_error
+            producer.send(config['KAFKA_TOPIC'], event_key, event_json)
+            if wait_for_delivery:
+                remaining = producer.flush(timeout=5.0)
+                if remaining:
+                    raise Exception(f"{remaining} messages still undelivered after 5s (bootstrap servers: {config['KAFKA_BOOTSTRAP_SERVERS']})")
+            producer.stats.record_request(1, len(event_json), time.monotonic() - start_time)
             
-            success_message = 'Event sent successfully'
+            success_message = 'Event sent successfully' if wait_for_delivery else 'Event queued for delivery'
             if not KAFKA_AVAILABLE:
                 success_message += ' (in simulation mode)'
                 
@@ -377,8 +949,10 @@ def send_event():
                 'message': success_message,
                 'event': event_data,
                 'kafka_available': KAFKA_AVAILABLE,
-                'bootstrap_servers': KAFKA_BOOTSTRAP_SERVERS
+                'bootstrap_servers': config['KAFKA_BOOTSTRAP_SERVERS']
             })
+    except SpoolFullError as e:
+        return jsonify({'error': str(e), 'kafka_available': KAFKA_AVAILABLE}), 503
     except Exception as e:
         print(f"Error sending event to Kafka: {str(e)}")
         traceback.print_exc()
@@ -387,71 +961,188 @@ def send_event():
             'error': str(e),
             'traceback': traceback.format_exc(),
             'kafka_available': KAFKA_AVAILABLE,
-            'bootstrap_servers': KAFKA_BOOTSTRAP_SERVERS
+            'bootstrap_servers': config['KAFKA_BOOTSTRAP_SERVERS']
         }
         return jsonify(error_details), 500
 
-@app.route('/catalogs', methods=['GET'])
+@bp.route('/send_events', methods=['POST'])
+def send_events():
+    """Send a batch of events to Kafka
+
+    Accepts a JSON array, ``{"events": [...]}`` or NDJSON (one event per line).
+    """
+    config = current_app.config
+    start_time = time.monotonic()
+    try:
+        if request.mimetype in ('application/x-ndjson', 'application/jsonl', 'text/plain'):
+            events = [json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+        else:
+            payload = request.get_json(force=True)
+            events = payload.get('events', []) if isinstance(payload, dict) else payload
+    except ValueError as e:
+        return jsonify({'error': f"Invalid event payload: {str(e)}"}), 400
+
+    if not isinstance(events, list) or not all(isinstance(event, dict) for event in events):
+        return jsonify({'error': 'Expected a list of JSON objects'}), 400
+    if len(events) > KAFKA_MAX_BULK_EVENTS:
+        return jsonify({'error': f"Too many events in one request (max {KAFKA_MAX_BULK_EVENTS})"}), 413
+
+    wait_for_delivery = request.args.get('wait_for_delivery', 'false').lower() == 'true'
+    try:
+        producer = get_kafka_producer()
+        total_bytes = 0
+        if event_spool:
+            # One spool write (and fsync) for the whole request
+            messages = [prepare_event(event_data) for event_data in events]
+            total_bytes = sum(len(event_json) for _, event_json in messages)
+            sequence = event_spool.append_many(config['KAFKA_TOPIC'], messages)
+            if wait_for_delivery:
+                event_spool.wait_drained(sequence, timeout=30.0)
+            remaining = event_spool.pending_events
+        else:
+            for event_data in events:
+                event_key, event_json = prepare_event(event_data)
+                producer.send(config['KAFKA_TOPIC'], event_key, event_json)
+                total_bytes += len(event_json)
+            remaining = producer.flush(timeout=30.0) if wait_for_delivery else producer.pending()
+        elapsed = time.monotonic() - start_time
+        producer.stats.record_request(len(events), total_bytes, elapsed)
+
+        return jsonify({
+            'success': True,
+            'queued': len(events),
+            'pending': remaining,
+            'bytes': total_bytes,
+            'elapsed_ms': round(elapsed * 1000, 3),
+            'events_per_second': round(len(events) / elapsed, 2) if elapsed > 0 else None,
+            'kafka_available': KAFKA_AVAILABLE,
+            'topic': config['KAFKA_TOPIC']
+        })
+    except SpoolFullError as e:
+        return jsonify({'error': str(e), 'kafka_available': KAFKA_AVAILABLE}), 503
+    except Exception as e:
+        print(f"Error sending events to Kafka: {str(e)}")
+        traceback.print_exc()
+        return jsonify({
+            'error': str(e),
+            'traceback': traceback.format_exc(),
+            'kafka_available': KAFKA_AVAILABLE,
+            'bootstrap_servers': config['KAFKA_BOOTSTRAP_SERVERS']
+        }), 500
+
+@bp.route('/producer_stats', methods=['GET'])
+def producer_stats():
+    """Return Kafka producer throughput and latency counters"""
+    stats = get_kafka_producer().snapshot()
+    stats['kafka_available'] = KAFKA_AVAILABLE
+    if event_spool:
+        stats['spool'] = event_spool.stats()
+    return jsonify(stats)
+
+def metadata_rows(pool, statement):
+    """Run a metadata statement on a pooled connection and return all rows"""
+    conn = pool.acquire()
+    if not conn:
+        raise Exception('Could not connect to Trino')
+    try:
+        cursor = conn.cursor()
+        cursor.execute(statement)
+        return cursor.fetchall()
+    finally:
+        pool.release(conn)
+
+def cached_metadata(statement, *names):
+    """Rows of a metadata statement, cached per connection settings and object names"""
+    config = current_app.config
+    key = (config['TRINO_HOST'], config['TRINO_PORT'], config['TRINO_USER']) + names
+    # Stale entries reload on a background thread, outside the app context
+    pool = services().trino_pool
+    return metadata_cache.get(key, lambda: metadata_rows(pool, statement))
+
+@bp.route('/catalogs', methods=['GET'])
 def get_catalogs():
     """Get list of available catalogs"""
     try:
-        conn = get_trino_connection()
-        if not conn:
-            return jsonify({'error': 'Could not connect to Trino'}), 500
-            
-        cursor = conn.cursor()
-        cursor.execute("SHOW CATALOGS")
-        
-        catalogs = [row[0] for row in cursor]
+        catalogs = [row[0] for row in cached_metadata("SHOW CATALOGS", 'catalogs')]
         return jsonify({'catalogs': catalogs})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    finally:
-        if 'conn' in locals() and conn:
-            conn.close()
 
-@app.route('/schemas', methods=['GET'])
+@bp.route('/schemas', methods=['GET'])
 def get_schemas():
     """Get list of schemas for a catalog"""
-    catalog = request.args.get('catalog', TRINO_CATALOG)
+    config = current_app.config
+    catalog = request.args.get('catalog', config['TRINO_CATALOG'])
     
     try:
-        conn = get_trino_connection()
-        if not conn:
-            return jsonify({'error': 'Could not connect to Trino'}), 500
-            
-        cursor = conn.cursor()
-        cursor.execute(f"SHOW SCHEMAS FROM {catalog}")
-        
-        schemas = [row[0] for row in cursor]
-        return jsonify({'schemas': schemas})
+        rows = cached_metadata(f"SHOW SCHEMAS FROM {catalog}", 'schemas', catalog)
+        return jsonify({'schemas': [row[0] for row in rows]})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    finally:
-        if 'conn' in locals() and conn:
-            conn.close()
 
-@app.route('/tables', methods=['GET'])
+@bp.route('/tables', methods=['GET'])
 def get_tables():
     """Get list of tables for a schema"""
-    catalog = request.args.get('catalog', TRINO_CATALOG)
-    schema = request.args.get('schema', TRINO_SCHEMA)
+    config = current_app.config
+    catalog = request.args.get('catalog', config['TRINO_CATALOG'])
+    schema = request.args.get('schema', config['TRINO_SCHEMA'])
     
     try:
-        conn = get_trino_connection()
-        if not conn:
-            return jsonify({'error': 'Could not connect to Trino'}), 500
-            
-        cursor = conn.cursor()
-        cursor.execute(f"SHOW TABLES FROM {catalog}.{schema}")
-        
-        tables = [row[0] for row in cursor]
-        return jsonify({'tables': tables})
+        rows = cached_metadata(f"SHOW TABLES FROM {catalog}.{schema}", 'tables', catalog, schema)
+        return jsonify({'tables': [row[0] for row in rows]})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    finally:
-        if 'conn' in locals() and conn:
-            conn.close()
+
+@bp.route('/columns', methods=['GET'])
+def get_columns():
+    """Get the columns of a table (for the table browser and autocomplete)"""
+    config = current_app.config
+    catalog = request.args.get('catalog', config['TRINO_CATALOG'])
+    schema = request.args.get('schema', config['TRINO_SCHEMA'])
+    table = request.args.get('table')
+    if not table:
+        return jsonify({'error': 'No table provided'}), 400
+    
+    try:
+        rows = cached_metadata(f"SHOW COLUMNS FROM {catalog}.{schema}.{table}", 'columns', catalog, schema, table)
+        columns = [
+            {'name': row[0], 'type': row[1], 'extra': row[2], 'comment': row[3]}
+            for row in rows
+        ]
+        return jsonify({'columns': columns})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/result_cache_stats', methods=['GET'])
+def result_cache_stats():
+    """Return query result cache hit/miss counters"""
+    return jsonify(result_cache.stats())
+
+@bp.route('/metadata_cache_stats', methods=['GET'])
+def metadata_cache_stats():
+    """Return metadata cache hit/miss counters"""
+    return jsonify(metadata_cache.stats())
+
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Return request, Trino query, Kafka producer and pool metrics in the Prometheus text format"""
+    pool = trino_pool.stats()
+    TRINO_POOL_CONNECTIONS.set(pool['idle'], state='idle')
+    TRINO_POOL_CONNECTIONS.set(pool['in_use'], state='in_use')
+    KAFKA_PRODUCER_PENDING.set(event_producer.pending())
+    if event_spool:
+        EVENT_SPOOL_PENDING_EVENTS.set(event_spool.pending_events)
+        EVENT_SPOOL_PENDING_BYTES.set(event_spool.pending_bytes)
+    states = query_jobs.stats()['states']
+    for state in JOB_STATES:
+        QUERY_JOBS.set(states.get(state, 0), state=state)
+    OPEN_CURSORS.set(cursor_registry.open_count())
+    return current_app.response_class(REGISTRY.render(), content_type=METRICS_CONTENT_TYPE)
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # Development server only; production runs gunicorn -c gunicorn.conf.py 'app:create_app()'
+    app = create_app()
+    try:
+        app.run(debug=os.environ.get("FLASK_DEBUG") == "1", host='0.0.0.0', port=5000, threaded=True)
+    finally:
+        shutdown_app(app)
@@ -0,0 +1,375 @@
+import fcntl
+import json
+import os
+import struct
+import tempfile
+import threading
+import time
+import traceback
+import zlib
+
+# Each record: payload length and CRC32, then the JSON [topic, key, value] payload
+_HEADER = struct.Struct('>II')
+_SEGMENT_SUFFIX = '.log'
+
+
+class SpoolFullError(Exception):
+    """The spool holds max_bytes of undelivered events"""
+
+
+def claim_spool_directory(base_dir):
+    """Lock and return the first free ``worker-N`` spool under ``base_dir``
+
+    Each worker process gets its own spool. A restarted worker takes over the
+    directory (and undelivered events) of the one it replaces.
+    """
+    index = 0
+    while True:
+        directory = os.path.join(base_dir, f"worker-{index}")
+        os.makedirs(directory, exist_ok=True)
+        lock_file = open(os.path.join(directory, 'lock'), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return directory, lock_file
+        except BlockingIOError:
+            lock_file.close()
+            index += 1
+
+
+class EventSpool:
+    """Append-only, segmented on-disk log of events waiting to be sent to Kafka
+
+    ``append`` writes the event to the current segment file and, with
+    ``wait_for_sync``, returns once an fsync covers it. A sync thread fsyncs
+    every ``sync_interval`` seconds at most, so concurrent requests share one
+    fsync. The drain position is kept in ``position.json``. Segments that were
+    fully drained are deleted, and ``append`` raises SpoolFullError once
+    ``max_bytes`` of events are waiting. On startup, a torn record at the end
+    of the last segment (from a crash mid-write) is truncated away.
+    """
+
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024, max_bytes=1024 * 1024 * 1024,
+                 sync_interval=0.005, wait_for_sync=True):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.sync_interval = sync_interval
+        self.wait_for_sync = wait_for_sync
+        self._condition = threading.Condition()
+        # Held around fsync, so a segment isn't closed (rolled) while being synced
+        self._sync_lock = threading.Lock()
+        self._closed = False
+
+        os.makedirs(directory, exist_ok=True)
+        self._read_segment, self._read_offset = self._load_position()
+        segments = self._segment_ids() or [self._read_segment]
+        self._read_segment = max(self._read_segment, segments[0])
+        for segment in segments:
+            if segment < self._read_segment:
+                # Drained, but a crash came before it was deleted
+                os.remove(self._segment_path(segment))
+        segments = [segment for segment in segments if segment >= self._read_segment] or [self._read_segment]
+        # Everything past the drain position is pending: count it and drop a torn tail
+        self.pending_events = 0
+        self.pending_bytes = 0
+        for segment in segments:
+            start = self._read_offset if segment == self._read_segment else 0
+            end, count = self._scan_segment(segment, start)
+            path = self._segment_path(segment)
+            if os.path.exists(path) and end < os.path.getsize(path):
+                print(f"Event spool: truncating {os.path.getsize(path) - end} bytes of torn records in {path}")
+                os.truncate(path, end)
+            self.pending_events += count
+            self.pending_bytes += end - start
+
+        self._write_segment = segments[-1]
+        self._file = open(self._segment_path(self._write_segment), 'ab', buffering=0)
+        self._write_offset = self._file.tell()
+        # Sequence numbers of appended, fsynced and drained events (since startup)
+        self._appended = self.pending_events
+        self._synced = self.pending_events
+        self._drained = 0
+
+        self._sync_thread = threading.Thread(target=self._sync_loop, name='event-spool-sync', daemon=True)
+        self._sync_thread.start()
+
+    def append(self, topic, key, value):
+        """Write one event; returns its sequence number"""
+        return self.append_many(topic, [(key, value)])
+
+    def append_many(self, topic, messages):
+        """Write (key, value) events with one write and at most one fsync wait; returns the last sequence number"""
+        data = b''.join(_encode(topic, key, value) for key, value in messages)
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Event spool is closed")
+            if self.pending_bytes + len(data) > self.max_bytes:
+                raise SpoolFullError(f"Event spool is full ({self.pending_bytes} bytes waiting for Kafka)")
+            if self._write_offset and self._write_offset + len(data) > self.segment_bytes:
+                self._roll_segment()
+            self._file.write(data)
+            self._write_offset += len(data)
+            self.pending_bytes += len(data)
+            self.pending_events += len(messages)
+            self._appended += len(messages)
+            sequence = self._appended
+            self._condition.notify_all()
+            if self.wait_for_sync:
+                while self._synced < sequence and not self._closed:
+                    self._condition.wait()
+        return sequence
+
+    def read(self, max_events):
+        """Up to ``max_events`` undrained events as [((segment, offset) after it, topic, key, value)]"""
+        with self._condition:
+            segment, offset = self._read_segment, self._read_offset
+            end_segment, end_offset = self._write_segment, self._write_offset
+        events = []
+        while len(events) < max_events and (segment, offset) < (end_segment, end_offset):
+            path = self._segment_path(segment)
+            limit = end_offset if segment == end_segment else None
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    f.seek(offset)
+                    for next_offset, topic, key, value in _read_records(f, offset, limit):
+                        events.append(((segment, next_offset), topic, key, value))
+                        if len(events) >= max_events:
+                            return events
+            if segment == end_segment:
+                break
+            segment, offset = segment + 1, 0
+        return events
+
+    def commit(self, position, events):
+        """Mark everything before ``position`` (``events`` events) as delivered"""
+        with self._condition:
+            drained_bytes = self._bytes_between((self._read_segment, self._read_offset), position)
+            old_segment = self._read_segment
+            self._read_segment, self._read_offset = position
+            self.pending_bytes -= drained_bytes
+            self.pending_events -= events
+            self._drained += events
+            self._condition.notify_all()
+        self._store_position(position)
+        for segment in range(old_segment, position[0]):
+            try:
+                os.remove(self._segment_path(segment))
+            except FileNotFoundError:
+                pass
+
+    def wait_for_events(self, timeout):
+        """Block until undrained events exist (or ``timeout``); returns whether there are any"""
+        with self._condition:
+            if not self.pending_events and not self._closed:
+                self._condition.wait(timeout)
+            return self.pending_events > 0
+
+    def wait_drained(self, sequence, timeout):
+        """Block until the event with this sequence number was delivered; returns whether it was"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self._drained < sequence and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            return self._drained >= sequence
+
+    def stats(self):
+        with self._condition:
+            return {
+                'directory': self.directory,
+                'pending_events': self.pending_events,
+                'pending_bytes': self.pending_bytes,
+                'max_bytes': self.max_bytes,
+                'segments': self._write_segment - self._read_segment + 1,
+            }
+
+    def close(self):
+        """fsync what was written and stop the sync thread; undrained events stay on disk"""
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        self._sync_thread.join()
+        with self._condition:
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    def _sync_loop(self):
+        while True:
+            with self._condition:
+                while self._synced >= self._appended and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+            # Let concurrent appends join this fsync
+            time.sleep(self.sync_interval)
+            with self._condition:
+                sequence = self._appended
+                file = self._file
+            with self._sync_lock:
+                if not file.closed:
+                    os.fsync(file.fileno())
+            with self._condition:
+                self._synced = max(self._synced, sequence)
+                self._condition.notify_all()
+
+    def _roll_segment(self):
+        with self._sync_lock:
+            os.fsync(self._file.fileno())
+            self._file.close()
+        self._write_segment += 1
+        self._file = open(self._segment_path(self._write_segment), 'ab', buffering=0)
+        self._write_offset = 0
+
+    def _bytes_between(self, start, end):
+        if start[0] == end[0]:
+            return end[1] - start[1]
+        total = self._segment_size(start[0]) - start[1]
+        for segment in range(start[0] + 1, end[0]):
+            total += self._segment_size(segment)
+        return total + end[1]
+
+    def _segment_size(self, segment):
+        if segment == self._write_segment:
+            return self._write_offset
+        path = self._segment_path(segment)
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, f"{segment:012d}{_SEGMENT_SUFFIX}")
+
+    def _segment_ids(self):
+        return sorted(int(name[:-len(_SEGMENT_SUFFIX)]) for name in os.listdir(self.directory)
+                      if name.endswith(_SEGMENT_SUFFIX) and name[:-len(_SEGMENT_SUFFIX)].isdigit())
+
+    def _scan_segment(self, segment, start):
+        """End offset of the last intact record of a segment, and the records after ``start``"""
+        path = self._segment_path(segment)
+        if not os.path.exists(path):
+            return start, 0
+        end, count = start, 0
+        with open(path, 'rb') as f:
+            f.seek(start)
+            for end, _, _, _ in _read_records(f, start):
+                count += 1
+        return end, count
+
+    def _load_position(self):
+        path = os.path.join(self.directory, 'position.json')
+        if not os.path.exists(path):
+            return 0, 0
+        with open(path) as f:
+            position = json.load(f)
+        return position['segment'], position['offset']
+
+    def _store_position(self, position):
+        # Write to a temp file and rename so a crash never leaves a torn file
+        with tempfile.NamedTemporaryFile('w', dir=self.directory, delete=False) as f:
+            json.dump({'segment': position[0], 'offset': position[1]}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f.name, os.path.join(self.directory, 'position.json'))
+
+
+class SpoolDrainer:
+    """Background thread sending spooled events through an EventProducer
+
+    One batch is in flight at a time. The drain position only moves past
+    events whose delivery Kafka confirmed, so a crash or outage can resend
+    events but never lose them. While the broker is down, librdkafka keeps
+    retrying the batch in flight. Once it reports failures, the rest of
+    the batch is resent after a backoff that doubles up to ``max_backoff``.
+    """
+
+    def __init__(self, spool, producer, batch_size=5000, flush_timeout=1.0, min_backoff=0.5, max_backoff=30.0):
+        self.spool = spool
+        self.producer = producer
+        self.batch_size = batch_size
+        self.flush_timeout = flush_timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.failures = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='event-spool-drain', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10.0):
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        backoff = self.min_backoff
+        while not self._stop.is_set():
+            try:
+                if not self.spool.wait_for_events(0.5):
+                    continue
+                if self._drain_batch():
+                    backoff = self.min_backoff
+                else:
+                    self.failures += 1
+                    self._stop.wait(backoff)
+                    backoff = min(self.max_backoff, backoff * 2)
+            except Exception:
+                traceback.print_exc()
+                self._stop.wait(backoff)
+
+    def _drain_batch(self):
+        """Send one batch and commit its delivered prefix; returns whether all of it was delivered"""
+        events = self.spool.read(self.batch_size)
+        if not events:
+            return True
+        results = [None] * len(events)
+        done = threading.Event()
+        remaining = [len(events)]
+        lock = threading.Lock()
+
+        def reporter(index):
+            def on_delivery(err, msg):
+                results[index] = err if err is not None else False
+                with lock:
+                    remaining[0] -= 1
+                    if not remaining[0]:
+                        done.set()
+            return on_delivery
+
+        for index, (_, topic, key, value) in enumerate(events):
+            self.producer.send(topic, key, value, on_delivery=reporter(index))
+        # Wait for every delivery report; librdkafka retries on its own until message.timeout.ms
+        while not done.is_set():
+            self.producer.flush(self.flush_timeout)
+            if self._stop.is_set() and not done.is_set():
+                break
+
+        delivered = 0
+        for result in results:
+            if result is not False:
+                break
+            delivered += 1
+        if delivered:
+            self.spool.commit(events[delivered - 1][0], delivered)
+        if delivered < len(events) and results[delivered] is not None:
+            print(f"Event spool: Kafka delivery failed, retrying {len(events) - delivered} events: {results[delivered]}")
+        return delivered == len(events)
+
+
+def _encode(topic, key, value):
+    payload = json.dumps([topic, key, value]).encode('utf-8')
+    return _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def _read_records(f, offset, limit=None):
+    """Yield (offset after the record, topic, key, value) until the end, ``limit`` or a torn record"""
+    while limit is None or offset < limit:
+        header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            return
+        length, crc = _HEADER.unpack(header)
+        payload = f.read(length)
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            return
+        offset += _HEADER.size + length
+        topic, key, value = json.loads(payload)
+        yield offset, topic, key, value
@@ -0,0 +1,32 @@
+# gunicorn settings for the webapp: gunicorn -c gunicorn.conf.py 'app:create_app()'
+import multiprocessing
+import os
+
+bind = os.environ.get("WEB_BIND", "0.0.0.0:5000")
+
+# Query jobs, next_token cursors, caches and /update_settings live in each worker
+# process, so more than one worker needs sticky routing (or clients that don't
+# use those). Threads are cheap: most of a request is spent waiting on Trino.
+workers = int(os.environ.get("WEB_WORKERS", 1))
+threads = int(os.environ.get("WEB_THREADS", min(4 * multiprocessing.cpu_count(), 32)))
+worker_class = "gthread"
+
+# Long enough for whole-result queries; streamed responses keep the worker busy too
+timeout = int(os.environ.get("WEB_TIMEOUT", 300))
+graceful_timeout = int(os.environ.get("WEB_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.environ.get("WEB_KEEPALIVE", 5))
+
+# Build the app (pools, producer threads) in each worker, never in the master before fork
+preload_app = False
+
+accesslog = os.environ.get("WEB_ACCESS_LOG", "-")
+errorlog = "-"
+
+
+def worker_exit(server, worker):
+    """Cancel running queries and flush the Kafka producer before the worker exits"""
+    from app import shutdown_app
+
+    app = getattr(worker, "wsgi", None)
+    if app is not None and "webapp" in getattr(app, "extensions", {}):
+        shutdown_app(app)
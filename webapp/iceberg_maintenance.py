@@ -0,0 +1,168 @@
+import json
+import logging
+import time
+from datetime import date, datetime, timedelta
+
+from offset_store import sql_literal
+
+logger = logging.getLogger('kafka_to_iceberg')
+
+
+def metadata_table(table, suffix):
+    """Name of an Iceberg metadata table, e.g. iceberg.default."events$snapshots" """
+    prefix, _, name = table.rpartition('.')
+    quoted = '"' + name.strip('"') + '$' + suffix + '"'
+    return f"{prefix}.{quoted}" if prefix else quoted
+
+
+def table_file_stats(cursor, table):
+    """Data file count, total and average size of a table, from Iceberg metadata"""
+    cursor.execute(f"""
+    SELECT COUNT(*), COALESCE(SUM(file_size_in_bytes), 0), COALESCE(AVG(file_size_in_bytes), 0)
+    FROM {metadata_table(table, 'files')}
+    WHERE content = 0
+    """)
+    files, total_bytes, avg_bytes = cursor.fetchone()
+    return {'files': files, 'total_bytes': int(total_bytes), 'avg_file_bytes': int(avg_bytes)}
+
+
+def partitions_needing_compaction(cursor, table, min_files, target_file_bytes):
+    """Partitions with at least ``min_files`` data files averaging under ``target_file_bytes``
+
+    Returns a list of dicts with the partition values (None for an
+    unpartitioned table), file count and total size.
+    """
+    cursor.execute(f"SHOW COLUMNS FROM {table}")
+    column_types = {row[0]: row[1] for row in cursor.fetchall()}
+
+    if not _is_partitioned(cursor, table):
+        stats = table_file_stats(cursor, table)
+        if stats['files'] >= min_files and stats['avg_file_bytes'] < target_file_bytes:
+            return [{'partition': None, 'predicate': None, 'files': stats['files'], 'total_bytes': stats['total_bytes']}]
+        return []
+
+    cursor.execute(f"""
+    SELECT json_format(CAST("partition" AS JSON)), file_count, total_size
+    FROM {metadata_table(table, 'partitions')}
+    WHERE file_count >= {int(min_files)} AND total_size < CAST(file_count AS BIGINT) * {int(target_file_bytes)}
+    ORDER BY file_count DESC
+    """)
+    candidates = []
+    for partition_json, file_count, total_size in cursor.fetchall():
+        partition = json.loads(partition_json)
+        candidates.append({
+            'partition': partition,
+            'predicate': partition_predicate(partition, column_types),
+            'files': file_count,
+            'total_bytes': total_size,
+        })
+    return candidates
+
+
+def partition_predicate(partition, column_types):
+    """WHERE clause matching one partition, or None if it can't be expressed
+
+    Identity partitions become equality checks, and day() and hour() partitions
+    become ranges on the source column between plain literals computed here, so
+    the clause has no expressions for optimize to evaluate. bucket() and
+    truncate() fields can't be expressed, so they are left out and the clause
+    covers all of their partitions (e.g. every bucket of one hour). Other
+    transforms are not supported by optimize's WHERE clause.
+    """
+    clauses = []
+    for field, value in partition.items():
+        if field in column_types:
+            if value is None:
+                clauses.append(f'"{field}" IS NULL')
+            else:
+                clauses.append(f'"{field}" = CAST({sql_literal(value)} AS {column_types[field]})')
+        elif field.endswith('_day') and field[:-len('_day')] in column_types and value is not None:
+            column = field[:-len('_day')]
+            start = datetime.combine(date.fromisoformat(str(value)), datetime.min.time())
+            clauses.append(_time_range(column, column_types[column], start, start + timedelta(days=1)))
+        elif field.endswith('_hour') and field[:-len('_hour')] in column_types and isinstance(value, int):
+            # Hours since the epoch
+            column = field[:-len('_hour')]
+            start = datetime(1970, 1, 1) + timedelta(hours=value)
+            clauses.append(_time_range(column, column_types[column], start, start + timedelta(hours=1)))
+        elif field.endswith(('_bucket', '_trunc')):
+            continue
+        else:
+            return None
+    return " AND ".join(clauses) if clauses else None
+
+
+def _time_range(column, column_type, start, end):
+    column_type = column_type.lower()
+    if column_type == 'date':
+        kind, fmt, zone = 'DATE', '%Y-%m-%d', ''
+    else:
+        kind, fmt = 'TIMESTAMP', '%Y-%m-%d %H:%M:%S'
+        zone = ' UTC' if 'with time zone' in column_type else ''
+    lower = f"{kind} '{start.strftime(fmt)}{zone}'"
+    upper = f"{kind} '{end.strftime(fmt)}{zone}'"
+    return f'"{column}" >= {lower} AND "{column}" < {upper}'
+
+
+def run_maintenance(cursor, table, min_files=50, target_file_mb=128, snapshot_retention='7d',
+                    orphan_retention='7d'):
+    """Compact small files, expire old snapshots and remove orphan files for one table
+
+    Returns a report with the file count and average file size before and after.
+    """
+    start_time = time.monotonic()
+    target_file_bytes = target_file_mb * 1024 * 1024
+    before = table_file_stats(cursor, table)
+    logger.info(f"Maintenance for {table}: {before['files']} files, avg {before['avg_file_bytes']} bytes")
+
+    candidates = partitions_needing_compaction(cursor, table, min_files, target_file_bytes)
+    optimized = 0
+    if any(candidate['predicate'] is None for candidate in candidates):
+        # Some partition can't be targeted individually: small-file rewrite of the whole table
+        logger.info(f"Optimizing all of {table} ({len(candidates)} partitions over the small-file threshold)")
+        _execute(cursor, f"ALTER TABLE {table} EXECUTE optimize(file_size_threshold => '{target_file_mb}MB')")
+        optimized = len(candidates)
+    else:
+        for candidate in candidates:
+            logger.info(f"Optimizing {table} partition {candidate['partition']} ({candidate['files']} files)")
+            try:
+                _execute(cursor, f"ALTER TABLE {table} EXECUTE optimize(file_size_threshold => '{target_file_mb}MB') "
+                                 f"WHERE {candidate['predicate']}")
+            except Exception as e:
+                # e.g. a Trino release that can't enforce the clause on the partitions: rewrite the small files
+                # of the whole table instead, which also covers the partitions still to go
+                logger.warning(f"Optimizing {table} WHERE {candidate['predicate']} failed ({str(e)}), "
+                               f"optimizing the whole table")
+                _execute(cursor, f"ALTER TABLE {table} EXECUTE optimize(file_size_threshold => '{target_file_mb}MB')")
+                optimized = len(candidates)
+                break
+            optimized += 1
+
+    _execute(cursor, f"ALTER TABLE {table} EXECUTE expire_snapshots(retention_threshold => '{snapshot_retention}')")
+    _execute(cursor, f"ALTER TABLE {table} EXECUTE remove_orphan_files(retention_threshold => '{orphan_retention}')")
+
+    after = table_file_stats(cursor, table)
+    report = {
+        'table': table,
+        'partitions_optimized': optimized,
+        'files_before': before['files'],
+        'files_after': after['files'],
+        'avg_file_bytes_before': before['avg_file_bytes'],
+        'avg_file_bytes_after': after['avg_file_bytes'],
+        'duration_ms': round((time.monotonic() - start_time) * 1000, 1),
+    }
+    logger.info("maintenance_report " + json.dumps(report, sort_keys=True))
+    return report
+
+
+def _is_partitioned(cursor, table):
+    cursor.execute(f"SELECT * FROM {metadata_table(table, 'partitions')} LIMIT 0")
+    cursor.fetchall()
+    # Unpartitioned tables expose no "partition" column in $partitions
+    return any(column[0] == 'partition' for column in cursor.description or [])
+
+
+def _execute(cursor, statement):
+    logger.debug(f"Executing maintenance statement: {statement}")
+    cursor.execute(statement)
+    cursor.fetchall()
@@ -0,0 +1,177 @@
+import heapq
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from message_columns import EVENT_COLUMNS, load_topic_columns
+from metrics import INGEST_SCHEDULE_DELAY
+from table_layout import TableLayout
+
+# YAML pipeline configs need PyYAML; JSON configs work without it
+try:
+    import yaml
+    YAML_AVAILABLE = True
+except ImportError:
+    YAML_AVAILABLE = False
+
+logger = logging.getLogger('kafka_to_iceberg')
+
+# Per-pipeline settings a config may override, with the command line values as defaults
+PIPELINE_SETTINGS = (
+    'batch_size', 'interval', 'min_batch_size', 'max_batch_size', 'min_interval', 'max_interval',
+    'min_commit_rows', 'max_commit_delay', 'parallelism',
+)
+
+
+class Pipeline:
+    """One Kafka topic -> Iceberg table stream of a pipeline config
+
+    ``state`` belongs to the cycle function (offset store, adaptive scheduler...);
+    the daemon only keeps the scheduling fields. ``rollups`` lists the grains of
+    the rollup tables kept for the target, counted by ``rollup_dimensions``.
+    """
+
+    def __init__(self, name, topic, target_table, columns=EVENT_COLUMNS, layout=None, rollups=(),
+                 rollup_dimensions=('name',), **settings):
+        self.name = name
+        self.topic = topic
+        self.target_table = target_table
+        self.columns = columns
+        self.layout = layout or TableLayout()
+        self.rollups = list(rollups)
+        self.rollup_dimensions = list(rollup_dimensions)
+        self.settings = settings
+        self.state = {}
+        self.failures = 0
+
+    def __repr__(self):
+        return f"Pipeline({self.name!r}, {self.topic!r} -> {self.target_table!r})"
+
+
+def load_pipeline_config(path, defaults):
+    """Pipelines from a YAML or JSON config file
+
+    The file holds ``pipelines`` (a list of {name, topic, target_table, ...}) and
+    optional ``defaults`` applied to every pipeline. Each pipeline's columns come
+    from ``topic_description`` (a Trino Kafka topic description file, relative to
+    the config) or inline ``fields`` in the same format, else the default
+    id/name/timestamp mapping. ``partition_by``, ``sort_by`` and
+    ``bloom_filter_columns`` set the table layout, ``rollups`` (grains) and
+    ``rollup_dimensions`` its rollup tables. Any of PIPELINE_SETTINGS
+    overrides ``defaults``.
+    """
+    with open(path) as f:
+        if path.endswith(('.yml', '.yaml')):
+            if not YAML_AVAILABLE:
+                raise RuntimeError("YAML pipeline configs need PyYAML; install it or use a JSON config")
+            config = yaml.safe_load(f)
+        else:
+            config = json.load(f)
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    config_defaults = dict(defaults, **config.get('defaults', {}))
+    pipelines = []
+    for entry in config.get('pipelines', []):
+        entry = dict(config_defaults, **entry)
+        missing = [key for key in ('topic', 'target_table') if not entry.get(key)]
+        if missing:
+            raise ValueError(f"Pipeline {entry.get('name', len(pipelines))} is missing {', '.join(missing)}")
+        if entry.get('topic_description'):
+            columns = load_topic_columns(os.path.join(base_dir, entry['topic_description']))
+        elif entry.get('fields'):
+            columns = [
+                {'name': field['name'], 'mapping': field.get('mapping', field['name']), 'type': field['type']}
+                for field in entry['fields']
+            ]
+        else:
+            columns = EVENT_COLUMNS
+        layout = TableLayout(
+            partitioning=entry.get('partition_by', []),
+            sorted_by=entry.get('sort_by', []),
+            bloom_filter_columns=entry.get('bloom_filter_columns', []),
+        )
+        pipelines.append(Pipeline(
+            entry.get('name', entry['topic']), entry['topic'], entry['target_table'], columns, layout,
+            rollups=entry.get('rollups', []), rollup_dimensions=entry.get('rollup_dimensions', ['name']),
+            **{key: entry[key] for key in PIPELINE_SETTINGS if key in entry}
+        ))
+
+    if not pipelines:
+        raise ValueError(f"{path} defines no pipelines")
+    # Offsets are checkpointed per target table, so two pipelines can't share one
+    tables = [pipeline.target_table for pipeline in pipelines]
+    duplicates = sorted({table for table in tables if tables.count(table) > 1})
+    if duplicates:
+        raise ValueError(f"Several pipelines write to {', '.join(duplicates)}")
+    return pipelines
+
+
+class PipelineDaemon:
+    """Runs the ingestion cycles of many pipelines on one shared pool of workers
+
+    ``run_cycle(pipeline)`` runs one cycle and returns the seconds until that
+    pipeline's next one. Due pipelines are started earliest-due first, ties in
+    arrival order, and only when a worker is free. A pipeline never has more
+    than one cycle in flight, so its offsets advance in order and a backlogged
+    stream (due again immediately) takes one worker at most and queues behind
+    the others. Its batch size bounds how long it holds that worker. Failing
+    pipelines are retried with exponential backoff.
+    """
+
+    def __init__(self, pipelines, run_cycle, workers=4, retry_interval=1.0, max_retry_interval=60.0):
+        self.pipelines = list(pipelines)
+        self.run_cycle = run_cycle
+        self.workers = max(1, workers)
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self._condition = threading.Condition()
+        self._queue = []
+        self._sequence = itertools.count()
+        self._idle_workers = self.workers
+        self._stopping = False
+
+    def run(self):
+        """Schedule cycles until ``stop`` is called, then wait for the ones in flight"""
+        now = time.monotonic()
+        with self._condition:
+            for pipeline in self.pipelines:
+                self._schedule(pipeline, now)
+        logger.info(f"Serving {len(self.pipelines)} pipelines with {self.workers} workers")
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='pipeline') as executor:
+            with self._condition:
+                while not self._stopping:
+                    now = time.monotonic()
+                    if self._idle_workers and self._queue and self._queue[0][0] <= now:
+                        due, _, pipeline = heapq.heappop(self._queue)
+                        self._idle_workers -= 1
+                        INGEST_SCHEDULE_DELAY.observe(now - due, table=pipeline.target_table)
+                        executor.submit(self._run_pipeline, pipeline)
+                        continue
+                    timeout = self._queue[0][0] - now if self._idle_workers and self._queue else None
+                    self._condition.wait(timeout)
+        logger.info("Pipeline daemon stopped")
+
+    def stop(self):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+
+    def _schedule(self, pipeline, due):
+        heapq.heappush(self._queue, (due, next(self._sequence), pipeline))
+
+    def _run_pipeline(self, pipeline):
+        try:
+            delay = self.run_cycle(pipeline)
+            pipeline.failures = 0
+        except Exception as e:
+            pipeline.failures += 1
+            delay = min(self.max_retry_interval, self.retry_interval * 2 ** (pipeline.failures - 1))
+            logger.error(f"Pipeline {pipeline.name} failed ({pipeline.failures} in a row), retrying in {delay:.1f}s: {str(e)}")
+        with self._condition:
+            self._idle_workers += 1
+            self._schedule(pipeline, time.monotonic() + delay)
+            self._condition.notify()
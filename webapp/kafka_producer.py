@@ -0,0 +1,233 @@
+import socket
+import threading
+import time
+import traceback
+
+from metrics import KAFKA_PRODUCE_LATENCY, KAFKA_PRODUCE_REQUEST, KAFKA_PRODUCED_BYTES
+
+# Try to import confluent_kafka, but provide fallback if not available
+try:
+    from confluent_kafka import Producer
+    KAFKA_AVAILABLE = True
+    print("Confluent Kafka is available, using real Kafka integration")
+except ImportError:
+    print("confluent_kafka package not available. Kafka event production will be simulated.")
+    KAFKA_AVAILABLE = False
+
+
+# Stub for Producer to use when Kafka is not available
+class MockProducer:
+    def produce(self, topic, key=None, value=None, on_delivery=None):
+        print(f"MOCK KAFKA: Would send to topic {topic}, key={key}, value={value}")
+        if on_delivery:
+            on_delivery(None, None)
+        return True
+
+    def poll(self, timeout=None):
+        if timeout:
+            time.sleep(timeout)
+        return 0
+
+    def flush(self, timeout=None):
+        return 0
+
+    def __len__(self):
+        return 0
+
+
+class ProducerStats:
+    """Thread-safe throughput and latency counters for the event producer"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = time.time()
+            self.requests = 0
+            self.request_time_total = 0.0
+            self.request_time_max = 0.0
+            self.events_queued = 0
+            self.bytes_queued = 0
+            self.events_delivered = 0
+            self.events_failed = 0
+            self.delivery_time_total = 0.0
+            self.delivery_time_max = 0.0
+            self.last_error = None
+
+    def record_request(self, events, nbytes, elapsed):
+        with self._lock:
+            self.requests += 1
+            self.events_queued += events
+            self.bytes_queued += nbytes
+            self.request_time_total += elapsed
+            self.request_time_max = max(self.request_time_max, elapsed)
+        KAFKA_PRODUCE_REQUEST.observe(elapsed)
+        KAFKA_PRODUCED_BYTES.inc(nbytes)
+
+    def record_delivery(self, elapsed, error=None):
+        with self._lock:
+            if error is None:
+                self.events_delivered += 1
+            else:
+                self.events_failed += 1
+                self.last_error = str(error)
+            self.delivery_time_total += elapsed
+            self.delivery_time_max = max(self.delivery_time_max, elapsed)
+        KAFKA_PRODUCE_LATENCY.observe(elapsed, result='delivered' if error is None else 'failed')
+
+    def snapshot(self, pending=0):
+        with self._lock:
+            uptime = max(time.time() - self.started_at, 1e-9)
+            completed = self.events_delivered + self.events_failed
+            return {
+                'uptime_seconds': round(uptime, 3),
+                'requests': self.requests,
+                'events_queued': self.events_queued,
+                'bytes_queued': self.bytes_queued,
+                'events_delivered': self.events_delivered,
+                'events_failed': self.events_failed,
+                'events_pending': pending,
+                'events_per_second': round(self.events_delivered / uptime, 2),
+                'avg_request_ms': round(self.request_time_total * 1000 / self.requests, 3) if self.requests else 0.0,
+                'max_request_ms': round(self.request_time_max * 1000, 3),
+                'avg_delivery_ms': round(self.delivery_time_total * 1000 / completed, 3) if completed else 0.0,
+                'max_delivery_ms': round(self.delivery_time_max * 1000, 3),
+                'last_error': self.last_error,
+            }
+
+
+class EventProducer:
+    """One long-lived, batching Kafka producer shared by all requests
+
+    Messages are queued asynchronously (librdkafka batches them according to
+    ``linger.ms``/``batch.size``/``compression.type``) and a background thread
+    serves delivery reports, which feed the throughput/latency counters.
+    """
+
+    def __init__(self, bootstrap_servers, config=None):
+        self.bootstrap_servers = bootstrap_servers
+        self.config = config or {}
+        self.stats = ProducerStats()
+        self._lock = threading.Lock()
+        self._producer = None
+        self._poll_thread = None
+        self._poll_stop = None
+
+    @property
+    def simulated(self):
+        return isinstance(self._get_producer(), MockProducer)
+
+    def send(self, topic, key, value, on_delivery=None):
+        """Queue one message; returns without waiting for delivery
+
+        ``on_delivery(err, msg)`` is also called with the message's delivery report.
+        Messages are queued under the lock that ``close`` swaps the producer
+        under, so none lands in a producer that has already been flushed.
+        """
+        enqueued_at = time.monotonic()
+
+        def report(err, msg):
+            self.stats.record_delivery(time.monotonic() - enqueued_at, err)
+            if on_delivery:
+                on_delivery(err, msg)
+
+        while True:
+            with self._lock:
+                producer = self._current_producer()
+                try:
+                    producer.produce(topic, key=key, value=value, on_delivery=report)
+                    return
+                except BufferError:
+                    pass
+            # Local queue is full: let librdkafka drain it before retrying, without blocking close()
+            producer.poll(0.1)
+
+    def send_many(self, topic, messages):
+        """Queue many (key, value) messages"""
+        for key, value in messages:
+            self.send(topic, key, value)
+
+    def flush(self, timeout=5.0):
+        """Wait for queued messages to be delivered; returns the number still pending"""
+        with self._lock:
+            producer = self._producer
+        if producer is None:
+            return 0
+        return producer.flush(timeout)
+
+    def pending(self):
+        with self._lock:
+            return len(self._producer) if self._producer is not None else 0
+
+    def reconfigure(self, bootstrap_servers):
+        """Point the producer at new brokers, flushing what the old one still holds"""
+        if bootstrap_servers == self.bootstrap_servers:
+            return
+        with self._lock:
+            self.bootstrap_servers = bootstrap_servers
+        self.close()
+
+    def close(self, timeout=5.0):
+        """Flush pending messages and stop the delivery report thread
+
+        Sends that start after the swap go to a new producer, so the old one
+        can be flushed without holding the lock.
+        """
+        with self._lock:
+            producer, self._producer = self._producer, None
+            poll_thread, self._poll_thread = self._poll_thread, None
+            poll_stop, self._poll_stop = self._poll_stop, None
+        if producer is None:
+            return 0
+        poll_stop.set()
+        poll_thread.join(timeout)
+        remaining = producer.flush(timeout)
+        if remaining:
+            print(f"Kafka producer closed with {remaining} undelivered messages")
+        return remaining
+
+    def snapshot(self):
+        return self.stats.snapshot(pending=self.pending())
+
+    def _get_producer(self):
+        with self._lock:
+            return self._current_producer()
+
+    def _current_producer(self):
+        # Called with the lock held; creates the producer on first use
+        if self._producer is None:
+            self._producer = self._create_producer()
+            self._poll_stop = threading.Event()
+            self._poll_thread = threading.Thread(
+                target=self._poll_loop, args=(self._producer, self._poll_stop),
+                name='kafka-delivery-reports', daemon=True
+            )
+            self._poll_thread.start()
+        return self._producer
+
+    def _create_producer(self):
+        if not KAFKA_AVAILABLE:
+            # Return a mock producer that logs messages instead of sending them
+            return MockProducer()
+        try:
+            producer_config = {
+                'bootstrap.servers': self.bootstrap_servers,
+                'client.id': socket.gethostname(),
+            }
+            producer_config.update(self.config)
+            return Producer(producer_config)
+        except Exception as e:
+            print(f"Error creating Kafka producer: {str(e)}")
+            print("Falling back to mock Kafka producer")
+            return MockProducer()
+
+    @staticmethod
+    def _poll_loop(producer, stop):
+        while not stop.is_set():
+            try:
+                producer.poll(0.1)
+            except Exception:
+                traceback.print_exc()
+                time.sleep(0.1)
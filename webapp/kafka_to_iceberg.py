@@ -3,9 +3,26 @@
 import trino
 import time
 import argparse
+import json
 import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 import os
+import signal
+import threading
+
+from iceberg_maintenance import metadata_table, run_maintenance
+from ingest_daemon import PIPELINE_SETTINGS, PipelineDaemon, load_pipeline_config
+from message_columns import (EVENT_COLUMNS, load_topic_columns, message_fields_sql, parsed_message_sql,
+                             quote_identifier)
+from metrics import (INGEST_BYTES, INGEST_COMMIT_DURATION, INGEST_CYCLE_DURATION, INGEST_CYCLE_ROWS, INGEST_CYCLES,
+                     INGEST_FRESHNESS_LAG, INGEST_LAG_RECORDS, INGEST_ROWS, record_trino_query, start_http_server)
+from native_ingest import NATIVE_ENGINE_AVAILABLE, NativeKafkaIngestor
+from offset_store import FileOffsetStore, TrinoOffsetStore, offset_ranges_predicate
+from rollups import RollupRefresher, rollup_table_name
+from table_layout import TableLayout, migrate_table_layout
+from trino_pool import TrinoConnectionPool
 
 # Setup logging
 logging.basicConfig(
@@ -29,75 +46,572 @@ def get_trino_connection(host='localhost', port=8080, user='trino', catalog='ice
         logger.error(f"Error connecting to Trino: {str(e)}")
         return None
 
-def create_target_table_if_not_exists(cursor, target_table):
-    """Create the target Iceberg table if it doesn't exist"""
+def create_target_table_if_not_exists(cursor, target_table, layout=None, columns=EVENT_COLUMNS):
+    """Create the target Iceberg table if it doesn't exist, with the given TableLayout
+
+    The table has one column per message column mapping, plus the Kafka offset,
+    partition and ingest time.
+    """
+    message_columns = "".join(f"{quote_identifier(column['name'])} {column['type']},\n            " for column in columns)
     try:
         cursor.execute(f"""
         CREATE TABLE IF NOT EXISTS {target_table} (
-            id INTEGER,
-            name VARCHAR,
-            timestamp TIMESTAMP(6),
-            offset BIGINT,
+            {message_columns}offset BIGINT,
             partition_id BIGINT,
             ingest_time TIMESTAMP
         )
+        {layout.with_clause() if layout else ""}
         """)
         logger.info(f"Ensured target table {target_table} exists")
     except Exception as e:
         logger.error(f"Error creating target table: {str(e)}")
         raise
 
-def get_last_offset(cursor, target_table):
-    """Get the highest offset from the target table"""
+def get_last_offsets_from_table(cursor, target_table):
+    """Get the highest offset of each partition from the target table (full scan)"""
     try:
-        cursor.execute(f"SELECT COALESCE(MAX(offset), -1) FROM {target_table}")
-        row = cursor.fetchone()
-        last_offset = row[0] if row else -1
-        logger.info(f"Last processed offset: {last_offset}")
-        return last_offset
+        cursor.execute(f"SELECT partition_id, MAX(offset) FROM {target_table} GROUP BY partition_id")
+        return {partition: offset for partition, offset in cursor.fetchall()}
     except Exception as e:
-        logger.error(f"Error retrieving last offset: {str(e)}")
-        return -1  # Start from the beginning if we can't determine the last offset
+        logger.error(f"Error retrieving last offsets from {target_table}: {str(e)}")
+        return {}
+
+def get_committed_offsets(offset_store, cursor, kafka_topic, target_table):
+    """Get the committed offset of each partition from the checkpoint store"""
+    offsets = offset_store.load(kafka_topic)
+    if not offsets:
+        # First run against this store: seed it once from the data already ingested
+        offsets = get_last_offsets_from_table(cursor, target_table)
+        if offsets:
+            logger.info(f"Seeding offset checkpoints from {target_table}: {offsets}")
+            offset_store.commit(kafka_topic, offsets)
+    return offsets
+
+def pending_partitions_predicate(offsets):
+    """WHERE clause selecting Kafka records past each checkpointed partition's committed offset
+
+    The lowest checkpoint is also a plain bound, which the Kafka connector turns
+    into a start offset instead of reading every partition from its beginning.
+    Partitions without a checkpoint are selected by ``new_partitions_predicate``.
+    """
+    if not offsets:
+        return "TRUE"
+    clauses = " OR ".join(
+        f"(_partition_id = {partition} AND _partition_offset > {offset})"
+        for partition, offset in sorted(offsets.items())
+    )
+    return f"_partition_offset > {min(offsets.values())} AND ({clauses})"
+
+def new_partitions_predicate(offsets):
+    """WHERE clause selecting the partitions without a checkpoint (e.g. newly added), or None if there are none yet"""
+    if not offsets:
+        return None
+    return f"_partition_id NOT IN ({', '.join(str(partition) for partition in sorted(offsets))})"
+
+def plan_partitions(cursor, kafka_topic, offsets):
+    """Find the pending offsets of every partition: {partition: (first, last, pending)}
+
+    Checkpointed and new partitions are separate scans: OR-ing them would leave
+    the connector no offset bound. The second reads no partition until one is added.
+    """
+    scans = [pending_partitions_predicate(offsets), new_partitions_predicate(offsets)]
+    records = "\n        UNION ALL\n        ".join(
+        f"SELECT _partition_id, _partition_offset FROM kafka.default.{kafka_topic} WHERE {predicate}"
+        for predicate in scans if predicate
+    )
+    cursor.execute(f"""
+    SELECT _partition_id, MIN(_partition_offset), MAX(_partition_offset), COUNT(*)
+    FROM (
+        {records}
+    )
+    GROUP BY _partition_id
+    """)
+    return {partition: (first, last, pending) for partition, first, last, pending in cursor.fetchall()}
+
+def recover_unrecorded_offsets(cursor, target_table, offsets, pending):
+    """Highest offset per partition already in the target table past its checkpoint
+
+    Every row carries its Kafka (partition_id, offset), so an INSERT whose snapshot
+    committed but whose checkpoint was never written (a crash or failed cycle in
+    between) is found by probing only the offsets between each checkpoint and the
+    newest pending record. Files of earlier cycles are pruned by their offset stats.
+    """
+    probe = {partition: (offsets.get(partition, -1), last) for partition, (_, last, _) in pending.items()}
+    cursor.execute(f"""
+    SELECT partition_id, MAX(offset) FROM {target_table}
+    WHERE {offset_ranges_predicate(probe, 'partition_id', 'offset')}
+    GROUP BY partition_id
+    """)
+    return {partition: offset for partition, offset in cursor.fetchall() if offset is not None}
 
-def ingest_from_kafka(cursor, kafka_topic, target_table, batch_size=1000):
-    """Ingest data from Kafka to Iceberg"""
-    last_offset = get_last_offset(cursor, target_table)
+def group_partitions(ranges, parallelism):
+    """Split partition ranges into at most ``parallelism`` groups of similar size"""
+    groups = [{} for _ in range(max(1, min(parallelism, len(ranges))))]
+    for index, partition in enumerate(sorted(ranges)):
+        groups[index % len(groups)][partition] = ranges[partition]
+    return groups
+
+def ingest_partition_group(cursor, kafka_topic, target_table, ranges, columns=EVENT_COLUMNS):
+    """Insert the given partition offset ranges and return the number of rows written"""
+    # Get new records from Kafka, parsing each message once and reading every column from the parsed row
+    query = f"""
+    INSERT INTO {target_table}
+    SELECT
+        {message_fields_sql(columns)},
+        _partition_offset AS offset,
+        _partition_id AS partition_id,
+        CURRENT_TIMESTAMP AS ingest_time
+    FROM (
+        SELECT {parsed_message_sql('_message', columns)} AS event, _partition_offset, _partition_id
+        FROM kafka.default.{kafka_topic}
+        WHERE {offset_ranges_predicate(ranges, '_partition_id', '_partition_offset')}
+    )
+    """
     
+    logger.debug(f"Executing query: {query}")
+    start_time = time.monotonic()
+    cursor.execute(query)
+    result = cursor.fetchall()
+    # The INSERT returns once its Iceberg snapshot is committed
+    INGEST_COMMIT_DURATION.observe(time.monotonic() - start_time, table=target_table, stage='data')
+    stats = cursor.stats or {}
+    record_trino_query('ingest', stats)
+    INGEST_BYTES.inc(stats.get('processedBytes', 0), table=target_table)
+    
+    # Get number of rows affected from the INSERT itself rather than rescanning the table
+    rows_inserted = insert_update_count(cursor, result)
+    if rows_inserted is None:
+        rows_inserted = snapshot_added_records(cursor, target_table)
+    return rows_inserted
+
+def insert_update_count(cursor, result):
+    """Row count reported by Trino for the INSERT just executed, if any"""
+    rowcount = getattr(cursor, 'rowcount', -1)
+    if rowcount is not None and rowcount >= 0:
+        return rowcount
+    if result and result[0] and isinstance(result[0][0], int):
+        return result[0][0]
+    return None
+
+def snapshot_added_records(cursor, table):
+    """Records added by the table's latest snapshot, from Iceberg snapshot metadata"""
+    cursor.execute(f"""
+    SELECT CAST(summary['added-records'] AS BIGINT)
+    FROM {metadata_table(table, 'snapshots')}
+    ORDER BY committed_at DESC
+    LIMIT 1
+    """)
+    row = cursor.fetchone()
+    return row[0] if row and row[0] is not None else 0
+
+def newest_event_time(cursor, target_table, ranges):
+    """Newest event ``timestamp`` among the rows inserted for the given offset ranges"""
+    # Only the files of this cycle match the offset ranges, so this reads little beyond them
+    cursor.execute(f"""
+    SELECT MAX("timestamp") FROM {target_table}
+    WHERE {offset_ranges_predicate(ranges, 'partition_id', 'offset')}
+    """)
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def record_freshness(cursor, target_table, ranges):
+    """Set the freshness lag gauge: now minus the newest event timestamp just ingested"""
     try:
-        # Get new records from Kafka
-        query = f"""
-        INSERT INTO {target_table}
-        SELECT 
-            CAST(json_extract_scalar(json_parse(_message), '$.id') AS INTEGER) AS id,
-            CAST(json_extract_scalar(json_parse(_message), '$.name') AS VARCHAR) AS name,
-            CAST(json_extract_scalar(json_parse(_message), '$.timestamp') AS TIMESTAMP(6)) AS timestamp,
-            _partition_offset AS offset,
-            _partition_id AS partition_id,
-            CURRENT_TIMESTAMP AS ingest_time
-        FROM kafka.default.{kafka_topic}
-        WHERE _partition_offset > {last_offset}
-        LIMIT {batch_size}
-        """
-        
-        logger.info(f"Executing query: {query}")
-        cursor.execute(query)
-        
-        # Get number of rows affected
-        cursor.execute(f"SELECT COUNT(*) FROM {target_table} WHERE offset > {last_offset}")
-        row = cursor.fetchone()
-        rows_inserted = row[0] if row else 0
-        
-        logger.info(f"Inserted {rows_inserted} new records into {target_table}")
-        return rows_inserted
+        newest = newest_event_time(cursor, target_table, ranges)
     except Exception as e:
-        logger.error(f"Error ingesting data: {str(e)}")
-        return 0
+        logger.warning(f"Could not read the newest ingested timestamp: {str(e)}")
+        return
+    if newest is not None:
+        # Events carry naive local timestamps (see prepare_event in app.py)
+        INGEST_FRESHNESS_LAG.set((datetime.now() - newest.replace(tzinfo=None)).total_seconds(), table=target_table)
+
+def log_cycle_metrics(**metrics):
+    """Emit one structured (JSON) metrics line per ingestion cycle"""
+    logger.info("ingest_metrics " + json.dumps(metrics, sort_keys=True))
+    table = metrics['target_table']
+    INGEST_CYCLES.inc(table=table)
+    INGEST_CYCLE_DURATION.observe(metrics['duration_ms'] / 1000, table=table)
+    INGEST_ROWS.inc(metrics['rows_inserted'], table=table)
+    INGEST_CYCLE_ROWS.observe(metrics['rows_inserted'], table=table)
+    INGEST_LAG_RECORDS.set(metrics['lag'], table=table)
+
+# Outcome of one ingestion cycle; lag is measured in offsets still to ingest. needs_recovery is set
+# when an INSERT may have committed without its checkpoint, so the next cycle should probe for it.
+IngestResult = namedtuple('IngestResult', ['rows_inserted', 'pending_records', 'lag', 'max_partition_lag',
+                                           'needs_recovery'], defaults=(False,))
+
+def ingest_from_kafka(cursor, kafka_topic, target_table, offset_store, batch_size=1000, pool=None, parallelism=1,
+                      min_commit_rows=0, columns=EVENT_COLUMNS, track_freshness=False, recover=False):
+    """Ingest data from Kafka to Iceberg
+
+    Each partition is read from its own committed offset, up to ``batch_size``
+    records per partition. With a connection ``pool`` and ``parallelism`` > 1
+    the partitions are split into groups that are inserted concurrently.
+    Nothing is written while fewer than ``min_commit_rows`` records are pending.
+    With ``track_freshness`` each commit also reads back the newest event
+    timestamp for the freshness lag metric.
+
+    Batches are identified by their (partition, offset range), which every
+    inserted row carries. With ``recover`` (on startup and after a failed
+    cycle) offsets found in the table past their checkpoint are recorded
+    instead of inserted again, so a replayed batch is a no-op.
+    """
+    cycle_start = time.monotonic()
+    offsets = get_committed_offsets(offset_store, cursor, kafka_topic, target_table)
+    
+    try:
+        pending = plan_partitions(cursor, kafka_topic, offsets)
+        if recover and pending:
+            recovered = recover_unrecorded_offsets(cursor, target_table, offsets, pending)
+            if recovered:
+                logger.warning(f"Offsets already in {target_table} without a checkpoint, recording them: {recovered}")
+                offset_store.commit(kafka_topic, recovered)
+                offsets.update(recovered)
+                pending = plan_partitions(cursor, kafka_topic, offsets)
+    except Exception as e:
+        logger.error(f"Error planning partitions: {str(e)}")
+        return IngestResult(0, 0, 0, 0, needs_recovery=recover)
+    if not pending:
+        logger.info("No new records in Kafka")
+        INGEST_LAG_RECORDS.set(0, table=target_table)
+        return IngestResult(0, 0, 0, 0)
+
+    pending_records = sum(count for _, _, count in pending.values())
+    if pending_records < min_commit_rows:
+        lag = {partition: last - offsets.get(partition, -1) for partition, (_, last, _) in pending.items()}
+        logger.info(f"Deferring commit: {pending_records} pending records < {min_commit_rows}")
+        INGEST_LAG_RECORDS.set(sum(lag.values()), table=target_table)
+        return IngestResult(0, pending_records, sum(lag.values()), max(lag.values()))
+
+    # Bound each partition's batch by offsets so the checkpoint matches what gets inserted
+    ranges = {
+        partition: (offsets.get(partition, -1), min(last, first + batch_size - 1))
+        for partition, (first, last, _) in pending.items()
+    }
+    groups = group_partitions(ranges, parallelism if pool else 1)
+
+    rows_inserted = 0
+    committed = {}
+    if len(groups) == 1:
+        try:
+            rows_inserted = ingest_partition_group(cursor, kafka_topic, target_table, groups[0], columns)
+            committed.update(groups[0])
+        except Exception as e:
+            logger.error(f"Error ingesting data: {str(e)}")
+    else:
+        with ThreadPoolExecutor(max_workers=len(groups), thread_name_prefix='ingest') as executor:
+            futures = {
+                executor.submit(ingest_group_with_pool, pool, kafka_topic, target_table, group, columns): group
+                for group in groups
+            }
+            for future in as_completed(futures):
+                group = futures[future]
+                try:
+                    rows_inserted += future.result()
+                    committed.update(group)
+                except Exception as e:
+                    logger.error(f"Error ingesting partitions {sorted(group)}: {str(e)}")
+
+    # Record the new checkpoints in the same cycle as the inserts
+    if committed:
+        commit_start = time.monotonic()
+        offset_store.commit(kafka_topic, {partition: end for partition, (_, end) in committed.items()})
+        INGEST_COMMIT_DURATION.observe(time.monotonic() - commit_start, table=target_table, stage='offsets')
+        if track_freshness and rows_inserted and any(column['name'] == 'timestamp' for column in columns):
+            record_freshness(cursor, target_table, committed)
+
+    # Per-partition lag: offsets still behind the newest record seen while planning
+    lag = {}
+    for partition, (_, last, _) in sorted(pending.items()):
+        committed_offset = committed[partition][1] if partition in committed else offsets.get(partition, -1)
+        lag[partition] = last - committed_offset
+        logger.info(f"Partition {partition}: committed offset {committed_offset}, lag {lag[partition]}")
+    
+    logger.info(f"Inserted {rows_inserted} new records into {target_table}")
+    failed = len(ranges) - len(committed)
+    log_cycle_metrics(
+        topic=kafka_topic,
+        target_table=target_table,
+        rows_inserted=rows_inserted,
+        partitions=len(pending),
+        partitions_committed=len(committed),
+        partition_groups=len(groups),
+        lag=sum(lag.values()),
+        duration_ms=round((time.monotonic() - cycle_start) * 1000, 1),
+    )
+    return IngestResult(rows_inserted, pending_records, sum(lag.values()), max(lag.values()), needs_recovery=failed > 0)
+
+def ingest_group_with_pool(pool, kafka_topic, target_table, ranges, columns=EVENT_COLUMNS):
+    """Run one partition group's insert on a pooled connection"""
+    conn = pool.acquire()
+    if conn is None:
+        raise Exception("Could not get a Trino connection from the pool")
+    try:
+        return ingest_partition_group(conn.cursor(), kafka_topic, target_table, ranges, columns)
+    finally:
+        pool.release(conn)
+
+class AdaptiveScheduler:
+    """Adapts the batch size and polling interval of continuous mode to consumer lag
+
+    While lag builds up the batch size grows (up to ``max_batch_size``) and the
+    next cycle starts after ``min_interval``; when the topic is idle the interval
+    backs off exponentially up to ``max_interval``. Commits smaller than
+    ``min_commit_rows`` are deferred, but never for longer than
+    ``max_commit_delay`` seconds, so we get fewer, larger Iceberg snapshots
+    without losing freshness.
+    """
+
+    def __init__(self, batch_size, interval, min_batch_size=100, max_batch_size=50000,
+                 min_interval=0.5, max_interval=60.0, min_commit_rows=0, max_commit_delay=30.0):
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.base_interval = min(max(interval, min_interval), max_interval)
+        self.min_commit_rows = min_commit_rows
+        self.max_commit_delay = max_commit_delay
+        self.batch_size = min(max(batch_size, min_batch_size), max_batch_size)
+        self.interval = self.base_interval
+        self.pending_since = None
+
+    def commit_threshold(self):
+        """Minimum pending records for the next cycle to commit"""
+        if self.pending_since is not None and time.monotonic() - self.pending_since >= self.max_commit_delay:
+            return 0
+        return self.min_commit_rows
+
+    def update(self, result):
+        """Pick the batch size and sleep interval for the next cycle"""
+        now = time.monotonic()
+        if result.pending_records == 0:
+            # Idle topic: back off exponentially
+            self.pending_since = None
+            self.interval = min(self.max_interval, max(self.interval, self.base_interval) * 2)
+        elif result.rows_inserted == 0:
+            # Commit deferred: come back once the delay budget is spent at the latest
+            if self.pending_since is None:
+                self.pending_since = now
+            remaining = self.max_commit_delay - (now - self.pending_since)
+            self.interval = max(self.min_interval, min(self.base_interval, remaining))
+        elif result.lag > 0:
+            # Falling behind: bigger batches, no pause between cycles
+            self.pending_since = now
+            if result.max_partition_lag > self.batch_size:
+                self.batch_size = min(self.max_batch_size, self.batch_size * 2)
+            self.interval = self.min_interval
+        else:
+            # Caught up: settle back towards the base interval and a smaller batch
+            self.pending_since = None
+            if result.rows_inserted < self.batch_size // 4:
+                self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+            self.interval = self.base_interval
+        return self.batch_size, self.interval
+
+def maintenance_tables(args):
+    """Tables covered by maintenance: the target, its rollups, the offset table and any extras"""
+    tables = [args.target_table]
+    tables.extend(rollup_table_name(args.target_table, rollup_dimensions(args), grain) for grain in args.rollup or [])
+    if args.offset_store == 'trino':
+        tables.append(args.offset_table)
+    tables.extend(table.strip() for table in args.maintenance_tables.split(',') if table.strip())
+    return tables
+
+def maintain_tables(cursor, args, tables=None):
+    """Run compaction and snapshot/orphan cleanup on every maintained table; returns the number that failed
+
+    Each table's failure (e.g. a commit conflict with ingestion) is logged and
+    never raised, so maintenance can't fail an ingest cycle.
+    """
+    failed = 0
+    for table in maintenance_tables(args) if tables is None else tables:
+        try:
+            run_maintenance(
+                cursor, table,
+                min_files=args.optimize_min_files,
+                target_file_mb=args.optimize_target_file_mb,
+                snapshot_retention=args.snapshot_retention,
+                orphan_retention=args.orphan_retention,
+            )
+        except Exception as e:
+            logger.error(f"Error running maintenance on {table}: {str(e)}")
+            failed += 1
+    return failed
+
+def table_layout(args):
+    """Target table layout from the command line; tables are unpartitioned unless --partition-by is given"""
+    return TableLayout(
+        partitioning=[transform for transform in args.partition_by or [] if transform != 'none'],
+        sorted_by=args.sort_by or [],
+        bloom_filter_columns=args.bloom_filter_column or [],
+    )
+
+def offset_store_for(args, cursor, consumer, lock=None):
+    """Offset store of one consumer (a target or rollup table), without creating the table"""
+    if args.offset_store == 'file':
+        return FileOffsetStore(args.offset_file, consumer=consumer, lock=lock)
+    return TrinoOffsetStore(cursor, args.offset_table, consumer=consumer)
+
+def create_offset_store(args, cursor):
+    """Create the offset checkpoint store selected on the command line"""
+    store = offset_store_for(args, cursor, args.target_table)
+    if args.offset_store == 'trino':
+        store.ensure_table()
+    return store
+
+def rollup_dimensions(args):
+    return args.rollup_dimension or ['name']
+
+def refresh_rollups(cursor, refresher, offset_store, store_for):
+    """Bring a table's rollups up to its committed offsets when due; failures are retried next cycle"""
+    if not refresher.due():
+        return
+    try:
+        refresher.refresh(cursor, offset_store.load(refresher.topic), store_for)
+    except Exception as e:
+        logger.error(f"Error refreshing the rollups of {refresher.source_table}: {str(e)}")
+
+def run_pipelines(args):
+    """Daemon mode: serve every pipeline of --pipeline-config from one process
+
+    All pipelines share one Trino connection pool and ``--workers`` threads.
+    Each pipeline keeps its own adaptive scheduler, offset checkpoints and
+    recovery state, created on its first cycle.
+    """
+    pipelines = load_pipeline_config(args.pipeline_config, {key: getattr(args, key) for key in PIPELINE_SETTINGS})
+    # The cycle itself holds one connection; partition groups take up to `parallelism` more
+    max_parallelism = max(pipeline.settings['parallelism'] for pipeline in pipelines)
+    pool = TrinoConnectionPool(
+        lambda: get_trino_connection(
+            host=args.host, port=args.port, user=args.user, catalog=args.catalog, schema=args.schema
+        ),
+        max_size=args.workers * (1 + (max_parallelism if max_parallelism > 1 else 0)),
+    )
+    file_lock = threading.Lock()
+
+    def run_cycle(pipeline):
+        settings, state = pipeline.settings, pipeline.state
+        conn = pool.acquire()
+        if conn is None:
+            raise Exception("Could not get a Trino connection from the pool")
+        discard = True
+        try:
+            with conn.cursor() as cursor:
+                if not state:
+                    create_target_table_if_not_exists(cursor, pipeline.target_table, pipeline.layout, pipeline.columns)
+                    state['scheduler'] = AdaptiveScheduler(
+                        settings['batch_size'], settings['interval'],
+                        min_batch_size=settings['min_batch_size'], max_batch_size=settings['max_batch_size'],
+                        min_interval=settings['min_interval'], max_interval=settings['max_interval'],
+                        min_commit_rows=settings['min_commit_rows'], max_commit_delay=settings['max_commit_delay'],
+                    )
+                    state['recover'] = True
+                    state['last_maintenance'] = time.time()
+                    if pipeline.rollups:
+                        state['rollups'] = RollupRefresher(
+                            pipeline.target_table, pipeline.topic, pipeline.rollups, pipeline.rollup_dimensions,
+                            pipeline.columns, interval=args.rollup_interval,
+                        )
+                        state['rollups'].ensure_tables(cursor)
+                scheduler = state['scheduler']
+                offset_store = offset_store_for(args, cursor, pipeline.target_table, file_lock)
+                # Until the cycle completes, the next one must check for an unrecorded INSERT
+                recover, state['recover'] = state['recover'], True
+                result = ingest_from_kafka(
+                    cursor, pipeline.topic, pipeline.target_table, offset_store, scheduler.batch_size, pool,
+                    settings['parallelism'], min_commit_rows=scheduler.commit_threshold(), columns=pipeline.columns,
+                    track_freshness=bool(args.metrics_port), recover=recover
+                )
+                state['recover'] = result.needs_recovery
+                _, interval = scheduler.update(result)
+                refresher = state.get('rollups')
+                if refresher:
+                    if result.rows_inserted:
+                        refresher.mark_dirty()
+                    refresh_rollups(
+                        cursor, refresher, offset_store,
+                        lambda consumer: offset_store_for(args, cursor, consumer, file_lock),
+                    )
+                if args.maintenance_interval > 0 and time.time() - state['last_maintenance'] >= args.maintenance_interval:
+                    # Failures wait for the next interval rather than being retried (and backed off) every cycle
+                    state['last_maintenance'] = time.time()
+                    tables = [pipeline.target_table]
+                    if refresher:
+                        tables.extend(rollup.table for rollup in refresher.rollups)
+                    maintain_tables(cursor, args, tables)
+            discard = False
+            return interval
+        finally:
+            pool.release(conn, discard=discard)
+
+    conn = pool.acquire()
+    if conn is None:
+        logger.error("Failed to connect to Trino. Exiting.")
+        return 1
+    try:
+        if args.offset_store == 'trino':
+            with conn.cursor() as cursor:
+                TrinoOffsetStore(cursor, args.offset_table, consumer=None).ensure_table()
+    finally:
+        pool.release(conn)
+
+    daemon = PipelineDaemon(pipelines, run_cycle, workers=args.workers)
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    runner = threading.Thread(target=daemon.run, name='pipeline-daemon')
+    runner.start()
+    try:
+        while runner.is_alive():
+            runner.join(1.0)
+    except KeyboardInterrupt:
+        logger.info("Process interrupted by user")
+        daemon.stop()
+        runner.join()
+    finally:
+        pool.close()
+    return 0
+
+def native_catalog_properties(args):
+    """Iceberg catalog settings for the native engine (same metastore and object store as Trino)"""
+    return {
+        'type': 'hive',
+        'uri': args.iceberg_catalog_uri,
+        's3.endpoint': os.environ.get('S3_ENDPOINT', 'http://localhost:9000'),
+        's3.access-key-id': os.environ.get('S3_ACCESS_KEY', 'minioadmin'),
+        's3.secret-access-key': os.environ.get('S3_SECRET_KEY', 'minioadmin'),
+        's3.path-style-access': 'true',
+    }
+
+def run_native_engine(args, columns=EVENT_COLUMNS):
+    """Consume Kafka directly and append Parquet files to the target table, decoding messages with ``columns``"""
+    if not NATIVE_ENGINE_AVAILABLE:
+        logger.error("The native engine requires confluent-kafka, pyarrow and pyiceberg. Exiting.")
+        return 1
+    # pyiceberg addresses tables as <schema>.<table>, without the Trino catalog
+    table_name = '.'.join(args.target_table.split('.')[-2:])
+    ingestor = NativeKafkaIngestor(
+        args.kafka_bootstrap_servers, args.kafka_topic, table_name, native_catalog_properties(args),
+        group_id=args.consumer_group, batch_size=args.batch_size, columns=columns,
+    )
+    mode = f"continuous mode with {args.interval}s interval" if args.continuous else "one-time execution mode"
+    logger.info(f"Native engine consuming {args.kafka_topic} as group {args.consumer_group} in {mode}")
+    try:
+        rows = ingestor.run(continuous=args.continuous, interval=args.interval)
+        logger.info(f"Ingested {rows} new records in {mode}")
+    except KeyboardInterrupt:
+        logger.info("Process interrupted by user")
+    return 0
 
 def main(args):
     """Main function to run the Kafka to Iceberg ingestion"""
     logger.info(f"Starting Kafka to Iceberg ingestion job")
     logger.info(f"Parameters: host={args.host}, port={args.port}, user={args.user}")
-    logger.info(f"Source: kafka.default.{args.kafka_topic}, Target: {args.target_table}")
+    if not args.pipeline_config:
+        logger.info(f"Source: kafka.default.{args.kafka_topic}, Target: {args.target_table}")
+    if args.metrics_port:
+        start_http_server(args.metrics_port)
+        logger.info(f"Serving Prometheus metrics on port {args.metrics_port} at /metrics")
+    if args.pipeline_config:
+        return run_pipelines(args)
     
     conn = get_trino_connection(
         host=args.host,
@@ -111,33 +625,107 @@ def main(args):
         logger.error("Failed to connect to Trino. Exiting.")
         return 1
     
+    pool = None
     try:
         with conn.cursor() as cursor:
             # Create target table if it doesn't exist
-            create_target_table_if_not_exists(cursor, args.target_table)
+            columns = load_topic_columns(args.topic_description) if args.topic_description else EVENT_COLUMNS
+            layout = table_layout(args)
+            create_target_table_if_not_exists(cursor, args.target_table, layout, columns)
+            if args.migrate_layout:
+                # Existing tables keep their layout until migrated; ingestion may keep running meanwhile
+                migrate_table_layout(cursor, args.target_table, layout, rewrite=not args.no_rewrite_files)
+                return 0
+            if args.engine == 'native':
+                # Trino is only needed for the DDL; the native engine writes the table itself
+                return run_native_engine(args, columns)
+            offset_store = create_offset_store(args, cursor)
+
+            # Extra connections for inserting partition groups concurrently
+            if args.parallelism > 1:
+                pool = TrinoConnectionPool(
+                    lambda: get_trino_connection(
+                        host=args.host, port=args.port, user=args.user,
+                        catalog=args.catalog, schema=args.schema
+                    ),
+                    max_size=args.parallelism,
+                )
             
+            if args.maintenance:
+                # Maintenance only: compact, expire snapshots, remove orphans and exit
+                return 1 if maintain_tables(cursor, args) else 0
+
+            # Pre-aggregated rollups, refreshed for the time buckets each cycle's offsets touched
+            refresher = None
+            if args.rollup:
+                refresher = RollupRefresher(
+                    args.target_table, args.kafka_topic, args.rollup, rollup_dimensions(args), columns,
+                    interval=args.rollup_interval,
+                )
+                refresher.ensure_tables(cursor)
+            store_for = lambda consumer: offset_store_for(args, cursor, consumer)
+
             # Run in continuous mode if requested
             if args.continuous:
-                logger.info(f"Running in continuous mode with {args.interval}s interval")
+                scheduler = None
+                if args.adaptive:
+                    scheduler = AdaptiveScheduler(
+                        args.batch_size, args.interval,
+                        min_batch_size=args.min_batch_size, max_batch_size=args.max_batch_size,
+                        min_interval=args.min_interval, max_interval=args.max_interval,
+                        min_commit_rows=args.min_commit_rows, max_commit_delay=args.max_commit_delay,
+                    )
+                    logger.info("Running in continuous mode with adaptive batch size and interval")
+                else:
+                    logger.info(f"Running in continuous mode with {args.interval}s interval")
+                batch_size, interval = args.batch_size, args.interval
+                last_maintenance = time.time()
+                # A previous run may have crashed between an INSERT and its checkpoint
+                recover = True
                 while True:
                     start_time = time.time()
-                    rows = ingest_from_kafka(cursor, args.kafka_topic, args.target_table, args.batch_size)
+                    result = ingest_from_kafka(
+                        cursor, args.kafka_topic, args.target_table, offset_store, batch_size, pool, args.parallelism,
+                        min_commit_rows=scheduler.commit_threshold() if scheduler else 0, columns=columns,
+                        track_freshness=bool(args.metrics_port), recover=recover
+                    )
+                    recover = result.needs_recovery
+                    if refresher:
+                        if result.rows_inserted:
+                            refresher.mark_dirty()
+                        refresh_rollups(cursor, refresher, offset_store, store_for)
                     
                     # If running as a service, log in a rotating manner
-                    if rows > 0:
-                        logger.info(f"{datetime.now().strftime('%H:%M:%S')} - Ingested {rows} new records")
+                    if result.rows_inserted > 0:
+                        logger.info(f"{datetime.now().strftime('%H:%M:%S')} - Ingested {result.rows_inserted} new records")
+
+                    if scheduler:
+                        batch_size, interval = scheduler.update(result)
+                        logger.info(f"Next cycle: batch size {batch_size}, interval {interval:.2f}s (lag {result.lag})")
+                    
+                    # Periodic compaction keeps the per-cycle snapshots from piling up as tiny files
+                    if args.maintenance_interval > 0 and time.time() - last_maintenance >= args.maintenance_interval:
+                        last_maintenance = time.time()
+                        maintain_tables(cursor, args)
                     
                     # Calculate sleep time to maintain the interval
                     elapsed = time.time() - start_time
-                    sleep_time = max(0.1, args.interval - elapsed)
+                    sleep_time = max(0.1 if not scheduler else 0.0, interval - elapsed)
                     time.sleep(sleep_time)
             else:
                 # One-time execution
-                rows = ingest_from_kafka(cursor, args.kafka_topic, args.target_table, args.batch_size)
-                logger.info(f"Ingested {rows} new records in one-time execution mode")
+                result = ingest_from_kafka(
+                    cursor, args.kafka_topic, args.target_table, offset_store, args.batch_size, pool, args.parallelism,
+                    columns=columns, track_freshness=bool(args.metrics_port), recover=True
+                )
+                logger.info(f"Ingested {result.rows_inserted} new records in one-time execution mode")
+                if refresher:
+                    refresh_rollups(cursor, refresher, offset_store, store_for)
     except KeyboardInterrupt:
         logger.info("Process interrupted by user")
     finally:
+        if pool:
+            pool.close()
         if conn:
             conn.close()
     
@@ -151,10 +739,44 @@ if __name__ == "__main__":
     parser.add_argument("--catalog", default=os.environ.get("TRINO_CATALOG", "iceberg"), help="Trino catalog")
     parser.add_argument("--schema", default=os.environ.get("TRINO_SCHEMA", "default"), help="Trino schema")
     parser.add_argument("--kafka-topic", default="events_topic", help="Kafka topic name")
+    parser.add_argument("--pipeline-config", help="YAML/JSON config of many topic -> table pipelines, served by one daemon process (overrides --kafka-topic/--target-table)")
+    parser.add_argument("--workers", type=int, default=4, help="Pipeline cycles run concurrently (with --pipeline-config)")
+    parser.add_argument("--engine", choices=["trino", "native"], default="trino", help="Ingest through Trino's Kafka connector or consume Kafka directly")
+    parser.add_argument("--kafka-bootstrap-servers", default=os.environ.get("KAFKA_BOOTSTRAP_SERVERS", "localhost:9092"), help="Kafka brokers (native engine)")
+    parser.add_argument("--consumer-group", default="kafka_to_iceberg", help="Kafka consumer group (native engine)")
+    parser.add_argument("--iceberg-catalog-uri", default=os.environ.get("ICEBERG_CATALOG_URI", "thrift://localhost:9083"), help="Hive metastore URI (native engine)")
+    parser.add_argument("--topic-description", help="Trino Kafka topic description whose message fields map to target columns (default: id, name, timestamp)")
     parser.add_argument("--target-table", default="iceberg.default.events_streaming", help="Target Iceberg table name")
-    parser.add_argument("--batch-size", type=int, default=1000, help="Number of records to process in a batch")
+    parser.add_argument("--partition-by", action="append", help="Partition transform of the target table, repeatable, e.g. 'hour(timestamp)' or 'bucket(id, 16)' (default: unpartitioned)")
+    parser.add_argument("--sort-by", action="append", help="Sort data files of the target table by this column, repeatable, e.g. partition_id then offset (needs a Trino release with Iceberg sorted_by)")
+    parser.add_argument("--bloom-filter-column", action="append", help="Write Parquet bloom filters for this column, repeatable, e.g. id (needs a Trino release with parquet_bloom_filter_columns)")
+    parser.add_argument("--migrate-layout", action="store_true", help="Apply the layout options to the existing target table, rewrite its files and exit")
+    parser.add_argument("--no-rewrite-files", action="store_true", help="With --migrate-layout, only change the table properties (new files use the layout)")
+    parser.add_argument("--rollup", action="append", choices=["minute", "hour", "day"], help="Keep a rollup table of row counts per time bucket at this grain, repeatable (e.g. --rollup minute --rollup hour)")
+    parser.add_argument("--rollup-dimension", action="append", help="Column the rollups count by, repeatable (default: name)")
+    parser.add_argument("--rollup-interval", type=float, default=0, help="Refresh the rollups at most every N seconds (0: after every cycle that inserted rows)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Number of records to process per partition in a batch")
     parser.add_argument("--continuous", action="store_true", help="Run in continuous mode")
     parser.add_argument("--interval", type=float, default=5.0, help="Polling interval in seconds (for continuous mode)")
+    parser.add_argument("--adaptive", action="store_true", help="Adapt batch size and interval to consumer lag (continuous mode)")
+    parser.add_argument("--min-batch-size", type=int, default=100, help="Smallest per-partition batch (adaptive mode)")
+    parser.add_argument("--max-batch-size", type=int, default=50000, help="Largest per-partition batch (adaptive mode)")
+    parser.add_argument("--min-interval", type=float, default=0.5, help="Shortest pause between cycles in seconds (adaptive mode)")
+    parser.add_argument("--max-interval", type=float, default=60.0, help="Longest idle back-off in seconds (adaptive mode)")
+    parser.add_argument("--min-commit-rows", type=int, default=0, help="Defer commits smaller than this many records (adaptive mode)")
+    parser.add_argument("--max-commit-delay", type=float, default=30.0, help="Longest a small commit may be deferred in seconds (adaptive mode)")
+    parser.add_argument("--parallelism", type=int, default=4, help="Number of partition groups inserted concurrently")
+    parser.add_argument("--maintenance", action="store_true", help="Run table maintenance once and exit")
+    parser.add_argument("--maintenance-interval", type=float, default=0, help="Run table maintenance every N seconds in continuous mode (0 disables)")
+    parser.add_argument("--maintenance-tables", default="", help="Extra comma-separated Iceberg tables to maintain (e.g. iceberg.default.raw_events_streaming)")
+    parser.add_argument("--optimize-min-files", type=int, default=50, help="Compact partitions with at least this many small files")
+    parser.add_argument("--optimize-target-file-mb", type=int, default=128, help="Files smaller than this are rewritten by optimize")
+    parser.add_argument("--snapshot-retention", default="7d", help="expire_snapshots retention threshold")
+    parser.add_argument("--orphan-retention", default="7d", help="remove_orphan_files retention threshold")
+    parser.add_argument("--offset-store", choices=["trino", "file"], default="trino", help="Where committed Kafka offsets are checkpointed")
+    parser.add_argument("--offset-table", default="iceberg.default.kafka_offsets", help="Offset checkpoint table (for --offset-store trino)")
+    parser.add_argument("--metrics-port", type=int, default=int(os.environ.get("METRICS_PORT", 0)), help="Serve Prometheus metrics on this port (0 disables)")
+    parser.add_argument("--offset-file", default="kafka_offsets.json", help="Offset checkpoint file (for --offset-store file)")
     
     args = parser.parse_args()
     exit(main(args))
\ No newline at end of file
@@ -0,0 +1,57 @@
+import json
+
+# Columns extracted from each Kafka message, in the shape of the `fields` of a
+# Trino Kafka topic description: target column, JSON field and SQL type
+EVENT_COLUMNS = [
+    {'name': 'id', 'mapping': 'id', 'type': 'INTEGER'},
+    {'name': 'name', 'mapping': 'name', 'type': 'VARCHAR'},
+    {'name': 'timestamp', 'mapping': 'timestamp', 'type': 'TIMESTAMP(6)'},
+]
+
+
+def load_topic_columns(path):
+    """Column mapping from the message fields of a Trino Kafka topic description file"""
+    with open(path) as f:
+        description = json.load(f)
+    fields = description.get('message', {}).get('fields', [])
+    if not fields:
+        raise ValueError(f"{path} defines no message fields")
+    return [
+        {'name': field['name'], 'mapping': field.get('mapping', field['name']), 'type': field['type']}
+        for field in fields
+    ]
+
+
+def message_field(column):
+    """JSON field a column is read from; only top-level fields are supported"""
+    if '/' in column['mapping']:
+        raise ValueError(f"Nested mapping {column['mapping']!r} is not supported")
+    return column['mapping']
+
+
+def quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def parsed_message_sql(message_column, columns):
+    """SQL that parses a JSON message once into a ROW holding every mapped field
+
+    Fields are kept as JSON and read by ``message_fields_sql``. A message that
+    is malformed or not an object gives a NULL row, so its fields are NULL
+    instead of failing the batch. Only top-level fields are supported.
+    """
+    fields = [f"{quote_identifier(message_field(column))} JSON" for column in columns]
+    return f"TRY(CAST(json_parse(CAST({message_column} AS VARCHAR)) AS ROW({', '.join(fields)})))"
+
+
+def message_fields_sql(columns, alias='event'):
+    """Typed select list reading each mapped field from the parsed message ROW
+
+    A field's scalar value is read as VARCHAR, like json_extract_scalar, so an
+    object or array gives NULL, and is then cast to the column type.
+    """
+    return ",\n        ".join(
+        f"CAST(TRY(CAST({alias}.{quote_identifier(column['mapping'])} AS VARCHAR)) AS {column['type']}) "
+        f"AS {quote_identifier(column['name'])}"
+        for column in columns
+    )
@@ -0,0 +1,127 @@
+import re
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+# Statements that can change what the catalog/schema/table/column listings return
+DDL_PATTERN = re.compile(r'^\s*(CREATE|DROP|ALTER|COMMENT|GRANT|REVOKE)\b', re.IGNORECASE)
+
+
+def is_ddl(query):
+    return bool(DDL_PATTERN.match(query or ''))
+
+
+class _Flight:
+    """A load in progress that concurrent misses for the same key wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class MetadataCache:
+    """In-process cache for catalog, schema, table and column listings
+
+    Entries are fresh for ``ttl`` seconds. After that they are still served for
+    up to ``stale_ttl`` more seconds while a background thread reloads them, so
+    callers only wait on Trino for keys that were never loaded (or long expired).
+    Concurrent misses for the same key share a single load, and the least
+    recently used entries are evicted beyond ``max_entries``.
+    """
+
+    def __init__(self, ttl=60.0, stale_ttl=600.0, max_entries=1024):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._generation = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def get(self, key, load):
+        """Return the cached value for ``key``, calling ``load()`` on a miss"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, loaded_at = entry
+                age = now - loaded_at
+                if age <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                if age <= self.ttl + self.stale_ttl:
+                    self._entries.move_to_end(key)
+                    self.stale_hits += 1
+                    if key not in self._flights:
+                        self._flights[key] = _Flight()
+                        threading.Thread(
+                            target=self._load, args=(key, load, self._flights[key], self._generation),
+                            name='metadata-refresh', daemon=True
+                        ).start()
+                    return value
+            self.misses += 1
+            flight = self._flights.get(key)
+            owner = flight is None
+            if owner:
+                flight = self._flights[key] = _Flight()
+            generation = self._generation
+
+        if owner:
+            self._load(key, load, flight, generation)
+        else:
+            flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    def invalidate(self, *prefix):
+        """Drop every entry whose key starts with ``prefix`` (everything if empty)"""
+        with self._lock:
+            if not prefix:
+                self._entries.clear()
+                # Loads already in flight started before the change; don't let them repopulate
+                self._generation += 1
+                return
+            for key in [k for k in self._entries if k[:len(prefix)] == prefix]:
+                del self._entries[key]
+            self._generation += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'stale_ttl_seconds': self.stale_ttl,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'loads': self.loads,
+                'evictions': self.evictions,
+                'loads_in_flight': len(self._flights),
+            }
+
+    def _load(self, key, load, flight, generation):
+        try:
+            flight.value = load()
+        except Exception as e:
+            flight.error = e
+            traceback.print_exc()
+        with self._lock:
+            self.loads += 1
+            self._flights.pop(key, None)
+            if flight.error is None and generation == self._generation:
+                self._entries[key] = (flight.value, time.monotonic())
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        flight.done.set()
@@ -0,0 +1,230 @@
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; covers sub-millisecond Kafka deliveries up to multi-minute Trino queries
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+ROW_BUCKETS = (0, 10, 100, 1000, 10000, 100000, 1000000, 10000000)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        f'{name}="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for name, value in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+class _Metric:
+    """A metric family: one value (or histogram) per combination of label values"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            samples = sorted(self._values.items())
+            if not samples and not self.labelnames:
+                samples = [((), self._empty())]
+            for key, value in samples:
+                lines.extend(self._render_sample(key, value))
+        return '\n'.join(lines)
+
+    def _empty(self):
+        return 0.0
+
+    def _render_sample(self, key, value):
+        yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or self._empty()
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def _empty(self):
+        # One count per bucket plus the +Inf overflow
+        return [0] * (len(self.buckets) + 1), 0.0
+
+    def _render_sample(self, key, value):
+        counts, total = value
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+            yield f"{self.name}_bucket{labels} {cumulative}"
+        labels = _format_labels(self.labelnames, key)
+        yield f"{self.name}_sum{labels} {_format_value(total)}"
+        yield f"{self.name}_count{labels} {cumulative}"
+
+
+class MetricsRegistry:
+    """Process-wide set of metrics rendered in the Prometheus text format
+
+    Asking for a metric that is already registered returns the existing one, so
+    modules can declare their metrics at import time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+    def _register(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric {name} is already registered with a different type or labels")
+            return metric
+
+
+REGISTRY = MetricsRegistry()
+
+# Trino queries (webapp requests, query jobs and ingestion inserts), from the cursor's final stats
+TRINO_QUERIES = REGISTRY.counter(
+    'trino_queries_total', 'Trino queries completed', ['source'])
+TRINO_QUERY_ELAPSED = REGISTRY.histogram(
+    'trino_query_elapsed_seconds', 'Trino query wall-clock time, queueing included', ['source'])
+TRINO_QUERY_QUEUED = REGISTRY.histogram(
+    'trino_query_queued_seconds', 'Time Trino queries spent queued', ['source'])
+TRINO_QUERY_CPU = REGISTRY.histogram(
+    'trino_query_cpu_seconds', 'CPU time Trino spent on each query', ['source'])
+TRINO_QUERY_ROWS = REGISTRY.counter(
+    'trino_query_processed_rows_total', 'Rows read by Trino queries', ['source'])
+TRINO_QUERY_BYTES = REGISTRY.counter(
+    'trino_query_processed_bytes_total', 'Bytes read by Trino queries', ['source'])
+
+# Kafka producer (webapp /send_event, /send_events)
+KAFKA_PRODUCE_LATENCY = REGISTRY.histogram(
+    'kafka_produce_latency_seconds', 'Time from queueing a message to its delivery report', ['result'])
+KAFKA_PRODUCE_REQUEST = REGISTRY.histogram(
+    'kafka_produce_request_seconds', 'Time spent queueing (and optionally flushing) one request\'s events')
+KAFKA_PRODUCED_BYTES = REGISTRY.counter(
+    'kafka_produced_bytes_total', 'Bytes of event JSON queued for Kafka')
+
+# Kafka -> Iceberg ingestion (kafka_to_iceberg.py, both engines)
+INGEST_CYCLES = REGISTRY.counter(
+    'ingest_cycles_total', 'Ingestion cycles run', ['table'])
+INGEST_CYCLE_DURATION = REGISTRY.histogram(
+    'ingest_cycle_duration_seconds', 'Duration of one ingestion cycle', ['table'])
+INGEST_ROWS = REGISTRY.counter(
+    'ingest_rows_total', 'Rows appended to the Iceberg table', ['table'])
+INGEST_CYCLE_ROWS = REGISTRY.histogram(
+    'ingest_cycle_rows', 'Rows appended per ingestion cycle', ['table'], buckets=ROW_BUCKETS)
+INGEST_BYTES = REGISTRY.counter(
+    'ingest_bytes_total', 'Kafka message bytes read for ingestion', ['table'])
+INGEST_COMMIT_DURATION = REGISTRY.histogram(
+    'ingest_commit_duration_seconds', 'Time to commit data (Iceberg snapshot) and offsets', ['table', 'stage'])
+INGEST_LAG_RECORDS = REGISTRY.gauge(
+    'ingest_lag_records', 'Kafka records not yet ingested after the last cycle', ['table'])
+INGEST_FRESHNESS_LAG = REGISTRY.gauge(
+    'ingest_freshness_lag_seconds', 'Now minus the newest event timestamp ingested, at the last commit', ['table'])
+INGEST_SCHEDULE_DELAY = REGISTRY.histogram(
+    'ingest_schedule_delay_seconds', 'Time a due pipeline waited for a free worker (daemon mode)', ['table'])
+INGEST_ROLLUP_DURATION = REGISTRY.histogram(
+    'ingest_rollup_refresh_seconds', 'Time to bring the rollups of a table up to its committed offsets', ['table'])
+
+
+def record_trino_query(source, stats):
+    """Record the final cursor.stats of a Trino query"""
+    if not stats:
+        return
+    TRINO_QUERIES.inc(source=source)
+    TRINO_QUERY_ELAPSED.observe(stats.get('elapsedTimeMillis', 0) / 1000, source=source)
+    TRINO_QUERY_QUEUED.observe(stats.get('queuedTimeMillis', 0) / 1000, source=source)
+    TRINO_QUERY_CPU.observe(stats.get('cpuTimeMillis', 0) / 1000, source=source)
+    TRINO_QUERY_ROWS.inc(stats.get('processedRows', 0), source=source)
+    TRINO_QUERY_BYTES.inc(stats.get('processedBytes', 0), source=source)
+
+
+def start_http_server(port, addr='0.0.0.0', registry=REGISTRY):
+    """Serve ``registry`` at http://addr:port/metrics from a daemon thread"""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Scrapes every few seconds would drown the ingestion log
+            pass
+
+    server = ThreadingHTTPServer((addr, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
@@ -0,0 +1,311 @@
+import json
+import logging
+import time
+from datetime import date, datetime
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+from message_columns import EVENT_COLUMNS, message_field
+from metrics import (INGEST_BYTES, INGEST_COMMIT_DURATION, INGEST_CYCLE_DURATION, INGEST_CYCLE_ROWS, INGEST_CYCLES,
+                     INGEST_FRESHNESS_LAG, INGEST_ROWS)
+from result_formats import arrow_type
+from table_layout import event_time_column
+
+# The native engine needs a Kafka client, Arrow and an Iceberg client; all are optional
+try:
+    import pyarrow as pa
+    ARROW_AVAILABLE = True
+except ImportError:
+    ARROW_AVAILABLE = False
+
+try:
+    from confluent_kafka import Consumer, TopicPartition, OFFSET_INVALID
+    from pyiceberg.catalog import load_catalog
+    NATIVE_ENGINE_AVAILABLE = ARROW_AVAILABLE
+except ImportError:
+    NATIVE_ENGINE_AVAILABLE = False
+
+# orjson is several times faster than the stdlib for batch decoding, but optional
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+logger = logging.getLogger('kafka_to_iceberg')
+
+# Snapshot property holding the Kafka offsets committed with each Iceberg snapshot
+OFFSETS_PROPERTY = 'kafka.offsets'
+
+
+def parse_timestamp(value):
+    """Parse an ISO-8601 event timestamp, returning None if it is missing or invalid"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        return parsed.replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+def parse_int(value):
+    if isinstance(value, float) and not value.is_integer():
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def int_parser(bits):
+    """parse_int limited to a signed integer type of ``bits`` bits"""
+    low, high = -2 ** (bits - 1), 2 ** (bits - 1) - 1
+
+    def parse(value):
+        parsed = parse_int(value)
+        return parsed if parsed is not None and low <= parsed <= high else None
+    return parse
+
+
+def parse_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def decimal_parser(precision, scale):
+    """Decimal conversion rounded to ``scale`` digits, like CAST; None if it needs more than ``precision`` digits"""
+    quantum = Decimal(1).scaleb(-scale)
+    limit = Decimal(10) ** (precision - scale)
+
+    def parse(value):
+        if value is None or isinstance(value, (bool, dict, list)):
+            return None
+        try:
+            parsed = Decimal(str(value)).quantize(quantum, rounding=ROUND_HALF_UP)
+        except InvalidOperation:
+            return None
+        return parsed if parsed.is_finite() and abs(parsed) < limit else None
+    return parse
+
+
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return {'true': True, 'false': False}.get(str(value).lower()) if isinstance(value, str) else None
+
+
+def parse_date(value):
+    if not value or not isinstance(value, str):
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def parse_text(value):
+    # Objects and arrays have no scalar value, as with json_extract_scalar
+    if value is None or isinstance(value, (dict, list)):
+        return None
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+
+PARSERS = {
+    'tinyint': int_parser(8), 'smallint': int_parser(16), 'integer': int_parser(32), 'bigint': int_parser(64),
+    'real': parse_float, 'double': parse_float, 'boolean': parse_bool, 'date': parse_date,
+    'timestamp': parse_timestamp,
+}
+
+
+def field_parser(sql_type):
+    """Python conversion of a JSON field to a column's SQL type
+
+    Values that don't convert, or don't fit the type, become None, so one bad
+    event can't fail the Arrow conversion of its whole batch.
+    """
+    base, _, parameters = sql_type.lower().partition('(')
+    base = base.strip()
+    if base == 'decimal':
+        # DECIMAL without parameters is DECIMAL(38, 0)
+        precision, _, scale = parameters.rstrip(')').partition(',')
+        return decimal_parser(int(precision or 38), int(scale or 0))
+    return PARSERS.get(base, parse_text)
+
+
+def arrow_schema(columns):
+    """Arrow schema of the target table for a message column mapping"""
+    fields = [(column['name'], arrow_type(column['type'])) for column in columns]
+    return pa.schema(fields + [
+        ('offset', pa.int64()),
+        ('partition_id', pa.int64()),
+        ('ingest_time', pa.timestamp('us')),
+    ])
+
+
+def decode_batch(messages, ingest_time, columns=EVENT_COLUMNS):
+    """Decode a batch of Kafka messages into the target table's columns
+
+    ``columns`` is the message column mapping the table was created from.
+    Returns (values, offsets, invalid) where ``values`` maps each column name
+    to its list of values and ``offsets`` each partition to the highest offset
+    seen in the batch.
+    """
+    fields = [(column['name'], message_field(column), field_parser(column['type'])) for column in columns]
+    values = {name: [] for name, _, _ in fields}
+    offset_column, partitions = [], []
+    offsets = {}
+    invalid = 0
+    for message in messages:
+        partition, offset = message.partition(), message.offset()
+        offsets[partition] = max(offset, offsets.get(partition, -1))
+        if message.value() is None:
+            # Tombstones and null-valued records carry no event
+            continue
+        try:
+            event = json_loads(message.value())
+        except (TypeError, ValueError):
+            invalid += 1
+            continue
+        if not isinstance(event, dict):
+            invalid += 1
+            continue
+        for name, field, parse in fields:
+            values[name].append(parse(event.get(field)))
+        offset_column.append(offset)
+        partitions.append(partition)
+
+    values['offset'] = offset_column
+    values['partition_id'] = partitions
+    values['ingest_time'] = [ingest_time] * len(offset_column)
+    return values, offsets, invalid
+
+
+def to_arrow(values, columns=EVENT_COLUMNS):
+    """Build an Arrow table of decoded values with the target table's column types"""
+    return pa.Table.from_pydict(values, schema=arrow_schema(columns))
+
+
+class NativeKafkaIngestor:
+    """Consumes Kafka directly and appends Parquet files to the Iceberg table
+
+    Records are decoded in batches into Arrow tables and appended through the
+    Iceberg client, which writes the Parquet files and commits one snapshot per
+    batch. The batch's offsets are stored as a snapshot property and only then
+    committed to the consumer group, so a crash between the two is recovered
+    from the table itself and no batch is appended twice.
+    """
+
+    def __init__(self, bootstrap_servers, topic, table_name, catalog_properties, group_id='kafka_to_iceberg',
+                 batch_size=10000, batch_timeout=1.0, columns=EVENT_COLUMNS):
+        if not NATIVE_ENGINE_AVAILABLE:
+            raise RuntimeError("The native engine requires confluent-kafka, pyarrow and pyiceberg")
+        self.topic = topic
+        self.columns = columns
+        self.time_column = event_time_column(columns)
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.catalog = load_catalog('kafka_to_iceberg', **catalog_properties)
+        self.table_name = table_name
+        self.table = self.catalog.load_table(table_name)
+        self.consumer = Consumer({
+            'bootstrap.servers': bootstrap_servers,
+            'group.id': group_id,
+            'enable.auto.commit': False,
+            'auto.offset.reset': 'earliest',
+            'fetch.min.bytes': 1024 * 1024,
+            'fetch.wait.max.ms': int(batch_timeout * 1000),
+        })
+        self.consumer.subscribe([topic], on_assign=self._on_assign)
+
+    def table_offsets(self):
+        """Offsets recorded with the most recent snapshot that carries them"""
+        self.table.refresh()
+        snapshot = self.table.current_snapshot()
+        while snapshot is not None:
+            summary = snapshot.summary.additional_properties if snapshot.summary else {}
+            if OFFSETS_PROPERTY in summary:
+                recorded = json.loads(summary[OFFSETS_PROPERTY])
+                if recorded.get('topic') == self.topic:
+                    return {int(p): o for p, o in recorded['offsets'].items()}
+            if snapshot.parent_snapshot_id is None:
+                break
+            snapshot = self.table.snapshot_by_id(snapshot.parent_snapshot_id)
+        return {}
+
+    def ingest_batch(self):
+        """Consume, decode and commit one batch; returns the number of rows appended"""
+        start_time = time.monotonic()
+        messages = self.consumer.consume(num_messages=self.batch_size, timeout=self.batch_timeout)
+        messages = [m for m in messages if m.error() is None]
+        if not messages:
+            return 0
+
+        values, offsets, invalid = decode_batch(messages, datetime.now(), self.columns)
+        if invalid:
+            logger.warning(f"Skipped {invalid} undecodable messages")
+        arrow_table = to_arrow(values, self.columns)
+
+        if arrow_table.num_rows:
+            # Offsets travel with the snapshot, so the table commit is the source of truth
+            recorded = json.dumps({'topic': self.topic, 'offsets': {str(p): o for p, o in offsets.items()}})
+            append_start = time.monotonic()
+            self.table.append(arrow_table, snapshot_properties={OFFSETS_PROPERTY: recorded})
+            INGEST_COMMIT_DURATION.observe(time.monotonic() - append_start, table=self.table_name, stage='data')
+            newest = max((ts for ts in values[self.time_column] if ts is not None), default=None) if self.time_column else None
+            if newest is not None:
+                INGEST_FRESHNESS_LAG.set((datetime.now() - newest).total_seconds(), table=self.table_name)
+
+        # Only now is it safe to move the consumer group forward
+        commit_start = time.monotonic()
+        self.consumer.commit(
+            offsets=[TopicPartition(self.topic, partition, offset + 1) for partition, offset in offsets.items()],
+            asynchronous=False,
+        )
+        INGEST_COMMIT_DURATION.observe(time.monotonic() - commit_start, table=self.table_name, stage='offsets')
+        elapsed = time.monotonic() - start_time
+        INGEST_CYCLES.inc(table=self.table_name)
+        INGEST_CYCLE_DURATION.observe(elapsed, table=self.table_name)
+        INGEST_ROWS.inc(arrow_table.num_rows, table=self.table_name)
+        INGEST_CYCLE_ROWS.observe(arrow_table.num_rows, table=self.table_name)
+        INGEST_BYTES.inc(sum(len(m.value() or b'') for m in messages), table=self.table_name)
+        logger.info("ingest_metrics " + json.dumps({
+            'engine': 'native',
+            'topic': self.topic,
+            'target_table': self.table_name,
+            'rows_inserted': arrow_table.num_rows,
+            'invalid_messages': invalid,
+            'partitions': len(offsets),
+            'duration_ms': round(elapsed * 1000, 1),
+            'rows_per_second': round(arrow_table.num_rows / elapsed, 1) if elapsed > 0 else None,
+        }, sort_keys=True))
+        return arrow_table.num_rows
+
+    def run(self, continuous=False, interval=0.0):
+        """Ingest once, or keep ingesting until interrupted; returns the number of rows appended"""
+        try:
+            rows = total = self.ingest_batch()
+            while continuous:
+                if rows == 0 and interval:
+                    time.sleep(interval)
+                rows = self.ingest_batch()
+                total += rows
+            return total
+        finally:
+            self.consumer.close()
+
+    def _on_assign(self, consumer, partitions):
+        # If we crashed after the table commit but before the group commit,
+        # resume from the offsets recorded in the table instead of re-appending
+        recorded = self.table_offsets()
+        committed = {tp.partition: tp.offset for tp in consumer.committed(partitions)}
+        for tp in partitions:
+            table_next = recorded.get(tp.partition, -1) + 1
+            group_next = committed.get(tp.partition, OFFSET_INVALID)
+            if table_next > 0 and (group_next == OFFSET_INVALID or group_next < table_next):
+                logger.info(f"Partition {tp.partition}: resuming from table offset {table_next} (group had {group_next})")
+                tp.offset = table_next
+        consumer.assign(partitions)
@@ -0,0 +1,118 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+
+logger = logging.getLogger('kafka_to_iceberg')
+
+
+def sql_literal(value):
+    """Render a Python string as a quoted SQL literal"""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def offset_ranges_predicate(ranges, partition_column, offset_column):
+    """WHERE clause selecting the (start, end] offset range of each partition
+
+    The ranges' overall bounds lead as plain conjuncts, so the Kafka connector
+    (and Iceberg file stats) can push them down.
+    """
+    clauses = " OR ".join(
+        f"({partition_column} = {partition} AND {offset_column} > {start} AND {offset_column} <= {end})"
+        for partition, (start, end) in sorted(ranges.items())
+    )
+    low = min(start for start, _ in ranges.values())
+    high = max(end for _, end in ranges.values())
+    return f"{offset_column} > {low} AND {offset_column} <= {high} AND ({clauses})"
+
+
+class FileOffsetStore:
+    """Committed Kafka offsets kept in a local JSON file (tests and local runs)"""
+
+    def __init__(self, path, consumer, lock=None):
+        self.path = path
+        self.consumer = consumer
+        # Stores of several consumers writing one file must share a lock
+        self._lock = lock or threading.Lock()
+
+    def load(self, topic):
+        """Return {partition: committed_offset} for a topic"""
+        with self._lock:
+            data = self._read()
+        offsets = data.get(self.consumer, {}).get(topic, {})
+        return {int(partition): offset for partition, offset in offsets.items()}
+
+    def commit(self, topic, offsets):
+        """Record the committed offset of each partition in ``offsets``"""
+        if not offsets:
+            return
+        with self._lock:
+            data = self._read()
+            committed = data.setdefault(self.consumer, {}).setdefault(topic, {})
+            for partition, offset in offsets.items():
+                committed[str(partition)] = offset
+            # Write to a temp file and rename so a crash never leaves a torn file
+            directory = os.path.dirname(os.path.abspath(self.path))
+            with tempfile.NamedTemporaryFile('w', dir=directory, delete=False) as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(f.name, self.path)
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+
+class TrinoOffsetStore:
+    """Committed Kafka offsets kept in a small Iceberg table, one row per partition"""
+
+    def __init__(self, cursor, table, consumer):
+        self.cursor = cursor
+        self.table = table
+        self.consumer = consumer
+
+    def ensure_table(self):
+        self.cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {self.table} (
+            consumer VARCHAR,
+            topic VARCHAR,
+            partition_id BIGINT,
+            committed_offset BIGINT,
+            updated_at TIMESTAMP(6)
+        )
+        """)
+        self.cursor.fetchall()
+        logger.info(f"Ensured offset checkpoint table {self.table} exists")
+
+    def load(self, topic):
+        """Return {partition: committed_offset} for a topic"""
+        self.cursor.execute(f"""
+        SELECT partition_id, committed_offset
+        FROM {self.table}
+        WHERE consumer = {sql_literal(self.consumer)} AND topic = {sql_literal(topic)}
+        """)
+        return {partition: offset for partition, offset in self.cursor.fetchall()}
+
+    def commit(self, topic, offsets):
+        """Upsert the committed offset of each partition in ``offsets``"""
+        if not offsets:
+            return
+        values = ", ".join(
+            f"({sql_literal(self.consumer)}, {sql_literal(topic)}, {int(partition)}, {int(offset)})"
+            for partition, offset in sorted(offsets.items())
+        )
+        self.cursor.execute(f"""
+        MERGE INTO {self.table} t
+        USING (VALUES {values}) AS s (consumer, topic, partition_id, committed_offset)
+        ON t.consumer = s.consumer AND t.topic = s.topic AND t.partition_id = s.partition_id
+        WHEN MATCHED THEN
+            UPDATE SET committed_offset = s.committed_offset, updated_at = CURRENT_TIMESTAMP
+        WHEN NOT MATCHED THEN
+            INSERT (consumer, topic, partition_id, committed_offset, updated_at)
+            VALUES (s.consumer, s.topic, s.partition_id, s.committed_offset, CURRENT_TIMESTAMP)
+        """)
+        self.cursor.fetchall()
@@ -0,0 +1,139 @@
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+
+
+class OpenCursor:
+    """A Trino cursor kept open between page requests
+
+    ``encoded`` cursors (CachedRows) return rows that are already JSON.
+    """
+
+    def __init__(self, conn, cursor, columns, query=None, encoded=False):
+        self.conn = conn
+        self.cursor = cursor
+        self.query = query
+        self.encoded = encoded
+        self.columns = columns
+        self.lookahead = deque()
+        self.rows_sent = 0
+        self.bytes_sent = 0
+        self.last_used = time.monotonic()
+
+
+class CachedRows:
+    """Cursor stand-in that pages through the encoded rows of a cached result"""
+
+    stats = None
+
+    def __init__(self, rows):
+        self._rows = deque(rows)
+
+    def fetchmany(self, size):
+        return [self._rows.popleft() for _ in range(min(size, len(self._rows)))]
+
+    def cancel(self):
+        pass
+
+
+class CursorRegistry:
+    """Server-side cursors that clients page through with a ``next_token``
+
+    Each open cursor keeps its pooled connection checked out, so the registry is
+    bounded by ``max_open`` (oldest cursors are closed first; keep it below the
+    pool size) and cursors not touched for ``ttl`` seconds are cancelled by a
+    background reaper, even when no request comes in to trigger it.
+    ``evict_oldest`` gives a connection back to a pool that has run dry.
+    ``release`` is called with the connection once a cursor is closed, after
+    ``on_close`` (if given) with the closed OpenCursor.
+    """
+
+    def __init__(self, release, ttl=300.0, max_open=16, on_close=None, reap_interval=None):
+        self._release = release
+        self._on_close = on_close
+        self.ttl = ttl
+        self.max_open = max(1, max_open)
+        self._lock = threading.Lock()
+        self._cursors = {}
+        self._stop = threading.Event()
+        self._reap_interval = reap_interval or max(1.0, min(ttl / 4, 30.0))
+        self._reaper = threading.Thread(target=self._reap, name='cursor-reaper', daemon=True)
+        self._reaper.start()
+
+    def register(self, entry):
+        """Store an open cursor and return the token for its next page"""
+        token = uuid.uuid4().hex
+        entry.last_used = time.monotonic()
+        with self._lock:
+            expired = self._expire_locked()
+            while len(self._cursors) >= self.max_open:
+                oldest = min(self._cursors, key=lambda t: self._cursors[t].last_used)
+                expired.append(self._cursors.pop(oldest))
+            self._cursors[token] = entry
+        for stale in expired:
+            self._close_entry(stale, cancel=True)
+        return token
+
+    def take(self, token):
+        """Remove and return the cursor for ``token`` (None if unknown or expired)"""
+        with self._lock:
+            expired = self._expire_locked()
+            entry = self._cursors.pop(token, None)
+        for stale in expired:
+            self._close_entry(stale, cancel=True)
+        return entry
+
+    def close(self, entry, cancel=False):
+        """Close a cursor previously returned by ``take``"""
+        self._close_entry(entry, cancel=cancel)
+
+    def evict_oldest(self):
+        """Cancel the least recently used cursor to free its connection; False if none is open"""
+        with self._lock:
+            # Cursors over cached rows hold no connection
+            holding = [t for t, e in self._cursors.items() if e.conn is not None]
+            if not holding:
+                return False
+            oldest = min(holding, key=lambda t: self._cursors[t].last_used)
+            entry = self._cursors.pop(oldest)
+        print("Closing the least recently used result cursor to free a Trino connection")
+        self._close_entry(entry, cancel=True)
+        return True
+
+    def close_all(self):
+        """Stop the reaper, cancel every open cursor and release its connection"""
+        self._stop.set()
+        with self._lock:
+            entries = list(self._cursors.values())
+            self._cursors.clear()
+        for entry in entries:
+            self._close_entry(entry, cancel=True)
+
+    def open_count(self):
+        with self._lock:
+            return len(self._cursors)
+
+    def _reap(self):
+        while not self._stop.wait(self._reap_interval):
+            with self._lock:
+                expired = self._expire_locked()
+            for stale in expired:
+                self._close_entry(stale, cancel=True)
+
+    def _expire_locked(self):
+        now = time.monotonic()
+        expired = [t for t, e in self._cursors.items() if now - e.last_used > self.ttl]
+        return [self._cursors.pop(t) for t in expired]
+
+    def _close_entry(self, entry, cancel):
+        try:
+            if cancel:
+                entry.cursor.cancel()
+            if self._on_close:
+                self._on_close(entry)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            self._release(entry.conn)
@@ -0,0 +1,128 @@
+import logging
+
+from metadata_cache import is_ddl
+from metrics import REGISTRY
+from result_cache import cacheable_tables, decode_result, encode_result
+
+ROLLUP_QUERIES = REGISTRY.counter(
+    'webapp_rollup_queries_total', 'Aggregate queries routed to a rollup table', ['rollup', 'outcome'])
+
+logger = logging.getLogger('webapp')
+
+
+class QueryRun:
+    """One execution of a query: the SQL actually run and where its result comes from"""
+
+    def __init__(self, query, sql, rollup=None):
+        self.query = query
+        self.sql = sql
+        self.rollup = rollup
+        self.query_key = None
+        self.cache_key = None
+        self.cache_hit = False
+        self.cursor = None
+
+    @property
+    def cache_status(self):
+        """'hit', 'miss' (the result may be stored) or 'bypass' (not cacheable)"""
+        if self.cache_hit:
+            return 'hit'
+        return 'miss' if self.cache_key else 'bypass'
+
+
+class QueryRunner:
+    """The steps every query takes, whether /execute_query or a job runs it
+
+    ``prepare`` points dashboard aggregates at a rollup table (``route``) and
+    keys the result of read-only Iceberg queries in the result cache
+    (``key``); ``cached`` returns a stored result; ``execute`` runs the SQL,
+    falling back to the original query if the rollup can't answer; ``store``
+    keeps a complete result and ``finished`` handles DDL. ``settings`` is the
+    (host, port, user, catalog, schema) of the connection the query runs on.
+    """
+
+    def __init__(self, result_cache, metadata_cache, rollup_router, cache_catalogs):
+        self.result_cache = result_cache
+        self.metadata_cache = metadata_cache
+        self.rollup_router = rollup_router
+        self.cache_catalogs = cache_catalogs
+
+    def prepare(self, cursor, query, settings, rollups=True, cache=True):
+        """A QueryRun for ``query``; ``cursor`` looks up the snapshots of cacheable queries"""
+        run = self.route(query, settings, rollups)
+        if cache:
+            self.key(run, cursor, settings)
+        return run
+
+    def route(self, query, settings, rollups=True):
+        """A QueryRun for ``query``, pointed at a rollup table when one can answer it"""
+        run = QueryRun(query, query)
+        # Dashboard aggregates over a rolled-up table read its pre-aggregated buckets instead of the raw rows
+        if rollups and self.rollup_router:
+            routed = self.rollup_router.route(query, settings[3], settings[4])
+            if routed:
+                run.sql, run.rollup = routed
+                logger.debug(f"Answering from rollup {run.rollup.table}: {run.sql}")
+        return run
+
+    def key(self, run, cursor, settings):
+        """Set the run's result cache key if its SQL is cacheable"""
+        if self.result_cache.max_bytes > 0:
+            sql, tables = cacheable_tables(run.sql, settings[3], settings[4], self.cache_catalogs)
+            if sql is not None:
+                run.query_key, run.cache_key = self.result_cache.key(cursor, settings, sql, tables)
+
+    def cached(self, run):
+        """(columns, encoded rows) stored for the run, or None"""
+        if not run.cache_key:
+            return None
+        body = self.result_cache.get(run.cache_key)
+        if body is None:
+            return None
+        logger.debug("Query result served from cache")
+        run.cache_hit = True
+        if run.rollup:
+            ROLLUP_QUERIES.inc(rollup=run.rollup.table, outcome='cached')
+        return decode_result(body)
+
+    def execute(self, conn, run, on_cursor=None):
+        """Run the query on a new cursor of ``conn`` and return it
+
+        ``on_cursor`` is called with each cursor before it executes, so a
+        caller can cancel it.
+        """
+        cursor = conn.cursor()
+        if on_cursor:
+            on_cursor(cursor)
+        try:
+            cursor.execute(run.sql)
+        except Exception as e:
+            if run.rollup is None:
+                raise
+            # e.g. the rollup table isn't created yet: answer from the raw table
+            logger.warning(f"Query on rollup {run.rollup.table} failed, running the original: {str(e)}")
+            ROLLUP_QUERIES.inc(rollup=run.rollup.table, outcome='fallback')
+            run.sql, run.rollup, run.cache_key = run.query, None, None
+            cursor = conn.cursor()
+            if on_cursor:
+                on_cursor(cursor)
+            cursor.execute(run.sql)
+        if run.rollup:
+            ROLLUP_QUERIES.inc(rollup=run.rollup.table, outcome='routed')
+        if is_ddl(run.sql):
+            self.metadata_cache.invalidate()
+            # Schema changes don't always create a snapshot
+            self.result_cache.clear()
+        run.cursor = cursor
+        return cursor
+
+    def store(self, run, columns, rows):
+        """Cache a complete (not truncated) result of encoded rows"""
+        if run.cache_key and not run.cache_hit:
+            self.result_cache.put(run.query_key, run.cache_key, encode_result(columns, rows))
+
+    def finished(self, run):
+        """Call once the statement has finished"""
+        if is_ddl(run.sql):
+            # Drop anything reloaded while the statement ran
+            self.metadata_cache.invalidate()
@@ -0,0 +1,271 @@
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+QUEUED, RUNNING, FINISHED, FAILED, CANCELLED = 'QUEUED', 'RUNNING', 'FINISHED', 'FAILED', 'CANCELLED'
+ACTIVE_STATES = (QUEUED, RUNNING)
+JOB_STATES = (QUEUED, RUNNING, FINISHED, FAILED, CANCELLED)
+
+
+class JobLimitError(Exception):
+    """Raised when a user (or the whole server) has too many active jobs"""
+
+
+class QueryJob:
+    """One submitted query: its state, Trino progress and the rows fetched so far"""
+
+    def __init__(self, query, user, settings):
+        self.id = uuid.uuid4().hex
+        self.query = query
+        self.user = user
+        self.settings = settings
+        self.run = None
+        self.state = QUEUED
+        self.error = None
+        self.columns = None
+        self.rows = []
+        self.bytes = 0
+        self.truncated = False
+        self.trino_stats = {}
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cursor = None
+        self.cancel_requested = False
+        self.lock = threading.Lock()
+
+    @property
+    def done(self):
+        return self.state not in ACTIVE_STATES
+
+    def status(self):
+        with self.lock:
+            if self.cursor is not None and self.state == RUNNING:
+                self.trino_stats = dict(self.cursor.stats or {})
+            stats = self.trino_stats
+            return {
+                'job_id': self.id,
+                'state': self.state,
+                'error': self.error,
+                'query_id': stats.get('queryId'),
+                'routed_to': self.run.rollup.table if self.run and self.run.rollup else None,
+                'result_cache': self.run.cache_status if self.run and self.state != QUEUED else None,
+                'columns': self.columns,
+                'rows_available': len(self.rows),
+                'truncated': self.truncated,
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+                'progress': {
+                    'trino_state': stats.get('state'),
+                    'total_splits': stats.get('totalSplits', 0),
+                    'queued_splits': stats.get('queuedSplits', 0),
+                    'running_splits': stats.get('runningSplits', 0),
+                    'completed_splits': stats.get('completedSplits', 0),
+                    'processed_rows': stats.get('processedRows', 0),
+                    'processed_bytes': stats.get('processedBytes', 0),
+                    'cpu_time_ms': stats.get('cpuTimeMillis', 0),
+                    'elapsed_time_ms': stats.get('elapsedTimeMillis', 0),
+                    'progress_percentage': stats.get('progressPercentage'),
+                },
+            }
+
+    def page(self, offset, limit):
+        """Rows [offset, offset + limit) fetched so far, and whether more may follow"""
+        with self.lock:
+            rows = self.rows[offset:offset + limit]
+            more = offset + len(rows) < len(self.rows) or not self.done
+            return list(rows), more
+
+
+class QueryJobManager:
+    """Runs queries on a bounded thread pool so requests never wait on Trino
+
+    ``acquire``/``release`` check connections out of the shared pool,
+    ``encode`` turns a row into JSON, ``runner`` (a QueryRunner) executes the
+    query the same way /execute_query does and ``on_finished`` is called with
+    each job that completes successfully. Each user may have ``max_per_user`` jobs
+    queued or running (``max_active`` across all users). Finished jobs keep
+    their rows, bounded by ``max_rows``/``max_bytes``, for ``ttl`` seconds.
+    """
+
+    def __init__(self, acquire, release, encode, runner, on_finished=None, max_workers=8, max_per_user=4, max_active=64,
+                 max_rows=100000, max_bytes=64 * 1024 * 1024, fetch_size=1000, ttl=300.0):
+        self._acquire = acquire
+        self._release = release
+        self._encode = encode
+        self._runner = runner
+        self._on_finished = on_finished
+        self.max_workers = max_workers
+        self.max_per_user = max_per_user
+        self.max_active = max_active
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.fetch_size = fetch_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='query-job')
+
+    def submit(self, query, user, settings, rollups=True):
+        """Queue a query, to run with the connection ``settings``, and return its job
+
+        Aggregates a rollup table can answer are pointed at it here (unless
+        ``rollups`` is false), so the status names the rollup from the start.
+        """
+        job = QueryJob(query, user, settings)
+        job.run = self._runner.route(query, settings, rollups)
+        with self._lock:
+            self._purge_locked()
+            active = [j for j in self._jobs.values() if not j.done]
+            if len(active) >= self.max_active:
+                raise JobLimitError(f"Too many active queries ({self.max_active}); try again later")
+            if sum(1 for j in active if j.user == user) >= self.max_per_user:
+                raise JobLimitError(f"At most {self.max_per_user} queries may run at once per user")
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            self._purge_locked()
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a job, stopping its query on Trino if it is running"""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        with job.lock:
+            if job.done:
+                return job
+            job.cancel_requested = True
+            cursor = job.cursor
+            if job.state == QUEUED:
+                self._finish_locked(job, CANCELLED)
+        if cursor is not None:
+            try:
+                cursor.cancel()
+            except Exception:
+                traceback.print_exc()
+        return job
+
+    def stats(self):
+        with self._lock:
+            states = {}
+            for job in self._jobs.values():
+                states[job.state] = states.get(job.state, 0) + 1
+            return {
+                'max_workers': self.max_workers,
+                'max_per_user': self.max_per_user,
+                'max_active': self.max_active,
+                'jobs': len(self._jobs),
+                'states': states,
+            }
+
+    def shutdown(self):
+        """Cancel every active job and stop the workers"""
+        with self._lock:
+            active = [job.id for job in self._jobs.values() if not job.done]
+        for job_id in active:
+            self.cancel(job_id)
+        self._executor.shutdown(wait=False)
+
+    def _run(self, job):
+        with job.lock:
+            if job.cancel_requested:
+                return
+            job.state = RUNNING
+            job.started_at = time.time()
+
+        conn = self._acquire()
+        if conn is None:
+            with job.lock:
+                job.error = 'Could not connect to Trino'
+                self._finish_locked(job, FAILED)
+            return
+
+        try:
+            with job.lock:
+                if job.cancel_requested:
+                    return
+            run = job.run
+            self._runner.key(run, conn.cursor(), job.settings)
+            cached = self._runner.cached(run)
+            if cached is not None:
+                with job.lock:
+                    job.columns, job.rows = cached
+                    job.bytes = sum(len(row) for row in job.rows)
+                    self._finish_locked(job, CANCELLED if job.cancel_requested else FINISHED)
+                if job.state == FINISHED and self._on_finished:
+                    self._on_finished(job)
+                return
+            cursor = self._runner.execute(conn, run, on_cursor=lambda cursor: self._track_cursor(job, cursor))
+            columns = [desc[0] for desc in cursor.description] if cursor.description else []
+            with job.lock:
+                job.columns = columns
+
+            while not job.cancel_requested:
+                batch = cursor.fetchmany(self.fetch_size)
+                if not batch:
+                    break
+                encoded = [self._encode(row) for row in batch]
+                with job.lock:
+                    for row in encoded:
+                        if len(job.rows) >= self.max_rows or job.bytes + len(row) > self.max_bytes:
+                            job.truncated = True
+                            break
+                        job.rows.append(row)
+                        job.bytes += len(row)
+                    job.trino_stats = dict(cursor.stats or {})
+                if job.truncated:
+                    cursor.cancel()
+                    break
+            if job.cancel_requested:
+                cursor.cancel()
+
+            with job.lock:
+                job.trino_stats = dict(cursor.stats or {})
+                self._finish_locked(job, CANCELLED if job.cancel_requested else FINISHED)
+            if job.state == FINISHED:
+                self._runner.finished(run)
+                if not job.truncated:
+                    self._runner.store(run, columns, job.rows)
+                if self._on_finished:
+                    self._on_finished(job)
+        except Exception as e:
+            with job.lock:
+                if job.cancel_requested:
+                    self._finish_locked(job, CANCELLED)
+                else:
+                    print(f"Query job {job.id} failed: {str(e)}")
+                    job.error = str(e)
+                    self._finish_locked(job, FAILED)
+        finally:
+            with job.lock:
+                job.cursor = None
+                if not job.done:
+                    self._finish_locked(job, CANCELLED)
+            self._release(conn)
+
+    @staticmethod
+    def _track_cursor(job, cursor):
+        """Make the cursor cancellable through the job before it executes"""
+        with job.lock:
+            job.cursor = cursor
+            if job.cancel_requested:
+                raise RuntimeError('Query job cancelled')
+
+    @staticmethod
+    def _finish_locked(job, state):
+        job.state = state
+        job.finished_at = time.time()
+
+    def _purge_locked(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.done and job.finished_at is not None and now - job.finished_at > self.ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
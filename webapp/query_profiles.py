@@ -0,0 +1,365 @@
+import hashlib
+import re
+import threading
+import time
+import traceback
+from collections import OrderedDict, deque
+
+import requests
+
+from iceberg_maintenance import metadata_table
+from result_cache import tokenize
+
+# Query ids Trino hands out, e.g. 20240101_120000_00001_abcde
+QUERY_ID_PATTERN = re.compile(r'^[A-Za-z0-9_.-]+$')
+
+# Operators that read splits from a connector (the first operator of a source pipeline)
+SCAN_OPERATORS = {'TableScanOperator', 'ScanFilterAndProjectOperator'}
+
+_DURATION_UNITS = {'ns': 1e-6, 'us': 1e-3, 'ms': 1.0, 's': 1e3, 'm': 60e3, 'h': 3600e3, 'd': 86400e3}
+_DATA_SIZE_UNITS = {'B': 1, 'kB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'TB': 1024 ** 4, 'PB': 1024 ** 5}
+_UNIT_VALUE = re.compile(r'^\s*([\d.]+)\s*([A-Za-z]*)\s*$')
+
+
+def fingerprint_sql(query):
+    """(fingerprint, id) of a query: its normalized text with literals replaced by ?
+
+    Queries that only differ in literal values, whitespace, comments or the
+    length of an IN list share a fingerprint; the id is a short hash of it.
+    """
+    parts = []
+    for kind, text in tokenize(query or ''):
+        if kind in ('string', 'number'):
+            text = '?'
+            # IN (?, ?, ?) -> IN (?)
+            if len(parts) >= 2 and parts[-1] == ',' and parts[-2] == '?':
+                parts.pop()
+                continue
+        parts.append(text)
+    fingerprint = ' '.join(parts)
+    return fingerprint, hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()[:16]
+
+
+def duration_ms(value):
+    """Milliseconds of a Trino duration such as '1.23s' (numbers are taken as ms)"""
+    return _parse_unit_value(value, _DURATION_UNITS, 'ms')
+
+
+def data_size_bytes(value):
+    """Bytes of a Trino data size such as '12.5MB' (numbers are taken as bytes)"""
+    return int(_parse_unit_value(value, _DATA_SIZE_UNITS, 'B'))
+
+
+def _parse_unit_value(value, units, default_unit):
+    if value is None:
+        return 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _UNIT_VALUE.match(str(value))
+    if not match:
+        return 0.0
+    number, unit = match.groups()
+    return float(number) * units.get(unit or default_unit, 0)
+
+
+def fetch_query_info(base_url, user, query_id, timeout=10.0, wait=2.0):
+    """Trino's query info JSON (/v1/query/<id>) for a query
+
+    Stage and task stats are only complete once Trino marks the info final, so
+    a query that just returned its last rows is polled for up to ``wait``
+    seconds. Returns None if Trino no longer knows the query.
+    """
+    if not QUERY_ID_PATTERN.match(query_id or ''):
+        raise ValueError(f"Invalid query id: {query_id!r}")
+    deadline = time.monotonic() + wait
+    while True:
+        response = requests.get(f"{base_url}/v1/query/{query_id}",
+                                headers={'X-Trino-User': user}, timeout=timeout)
+        if response.status_code in (404, 410):
+            return None
+        response.raise_for_status()
+        info = response.json()
+        if info.get('finalQueryInfo') or time.monotonic() >= deadline:
+            return info
+        time.sleep(0.1)
+
+
+def query_stages(info):
+    """Stage infos of a query, output stage first
+
+    Trino 395 nests sub stages under ``outputStage``; newer releases list them
+    flat under ``stages``.
+    """
+    flat = info.get('stages')
+    if isinstance(flat, dict):
+        return list(flat.get('stages') or [])
+    stages = []
+    pending = [info['outputStage']] if info.get('outputStage') else []
+    while pending:
+        stage = pending.pop(0)
+        stages.append(stage)
+        pending.extend(stage.get('subStages') or [])
+    return stages
+
+
+def _stage_number(stage_id):
+    """Fragment number of a stage id ('<query id>.3' or 3)"""
+    return int(str(stage_id).rpartition('.')[2])
+
+
+def _spread(values):
+    """min/max/mean of per-task values, and skew: the busiest task over the mean"""
+    if not values:
+        return {'min': 0, 'max': 0, 'mean': 0, 'skew': None}
+    mean = sum(values) / len(values)
+    return {
+        'min': min(values),
+        'max': max(values),
+        'mean': round(mean, 1),
+        'skew': round(max(values) / mean, 2) if mean else None,
+    }
+
+
+def stage_profile(stage, operators):
+    """Timing, rows, bytes, spill and task skew of one stage"""
+    stats = stage.get('stageStats') or {}
+    tasks = [task.get('stats') or {} for task in stage.get('tasks') or []]
+    task_rows = [task.get('processedInputPositions', task.get('rawInputPositions', 0)) for task in tasks]
+    task_wall = [duration_ms(task.get('elapsedTime')) for task in tasks]
+    operator_profiles = sorted(({
+        'operator': operator.get('operatorType'),
+        'plan_node_id': operator.get('planNodeId'),
+        'input_rows': operator.get('inputPositions', 0),
+        'output_rows': operator.get('outputPositions', 0),
+        'cpu_ms': sum(duration_ms(operator.get(key)) for key in ('addInputCpu', 'getOutputCpu', 'finishCpu')),
+        'wall_ms': sum(duration_ms(operator.get(key)) for key in ('addInputWall', 'getOutputWall', 'finishWall')),
+        'spilled_bytes': data_size_bytes(operator.get('spilledDataSize')),
+    } for operator in operators), key=lambda operator: operator['wall_ms'], reverse=True)
+    return {
+        'stage_id': _stage_number(stage.get('stageId', 0)),
+        'state': stage.get('state'),
+        'tasks': len(tasks) or stats.get('totalTasks', 0),
+        'splits': stats.get('totalDrivers', 0),
+        'wall_ms': max(task_wall, default=0),
+        'scheduled_ms': duration_ms(stats.get('totalScheduledTime')),
+        'cpu_ms': duration_ms(stats.get('totalCpuTime')),
+        'blocked_ms': duration_ms(stats.get('totalBlockedTime')),
+        'input_rows': stats.get('processedInputPositions', stats.get('rawInputPositions', 0)),
+        'input_bytes': data_size_bytes(stats.get('processedInputDataSize', stats.get('rawInputDataSize'))),
+        'physical_input_bytes': data_size_bytes(stats.get('physicalInputDataSize')),
+        'output_rows': stats.get('outputPositions', 0),
+        'output_bytes': data_size_bytes(stats.get('outputDataSize')),
+        'spilled_bytes': sum(operator['spilled_bytes'] for operator in operator_profiles),
+        'peak_memory_bytes': data_size_bytes(stats.get('peakUserMemoryReservation')),
+        'task_input_rows': _spread(task_rows),
+        'task_wall_ms': _spread(task_wall),
+        # The operators the stage spent the most time in
+        'operators': operator_profiles[:5],
+    }
+
+
+def table_scans(info, operators):
+    """Rows, bytes and splits each input table was read with
+
+    Scan operators are matched to the query's inputs by plan node, falling back
+    to the stage when it reads a single table (a filtered scan reports the
+    filter's plan node).
+    """
+    inputs = info.get('inputs') or []
+    by_node, by_fragment = {}, {}
+    for index, table_input in enumerate(inputs):
+        if table_input.get('planNodeId') is not None:
+            by_node[str(table_input['planNodeId'])] = index
+        if table_input.get('fragmentId') is not None:
+            by_fragment.setdefault(int(table_input['fragmentId']), []).append(index)
+
+    scans = [{
+        'table': '.'.join(str(part) for part in (
+            table_input.get('catalogName'), table_input.get('schema'), table_input.get('table'))),
+        'catalog': table_input.get('catalogName'),
+        'columns': [column.get('name', column) if isinstance(column, dict) else column
+                    for column in table_input.get('columns') or []],
+        'splits': 0,
+        'rows_read': 0,
+        'bytes_read': 0,
+    } for table_input in inputs]
+    for operator in operators:
+        if operator.get('operatorType') not in SCAN_OPERATORS:
+            continue
+        index = by_node.get(str(operator.get('planNodeId')))
+        if index is None:
+            candidates = by_fragment.get(int(operator.get('stageId', -1)), [])
+            if len(candidates) != 1:
+                continue
+            index = candidates[0]
+        scan = scans[index]
+        scan['splits'] += operator.get('totalDrivers', 0)
+        scan['rows_read'] += operator.get('physicalInputPositions', operator.get('inputPositions', 0))
+        scan['bytes_read'] += data_size_bytes(operator.get('physicalInputDataSize'))
+    return scans
+
+
+def build_query_profile(info):
+    """Structured profile of a Trino query info: query totals, stages and table scans"""
+    stats = info.get('queryStats') or {}
+    operators = stats.get('operatorSummaries') or []
+    stage_operators = {}
+    for operator in operators:
+        stage_operators.setdefault(int(operator.get('stageId', -1)), []).append(operator)
+
+    query = info.get('query') or ''
+    fingerprint, fingerprint_id = fingerprint_sql(query)
+    failure = info.get('failureInfo') or {}
+    stages = [stage_profile(stage, stage_operators.get(_stage_number(stage.get('stageId', 0)), []))
+              for stage in query_stages(info)]
+    return {
+        'query_id': info.get('queryId'),
+        'state': info.get('state'),
+        'error': failure.get('message'),
+        'query': query,
+        'fingerprint': fingerprint,
+        'fingerprint_id': fingerprint_id,
+        'final': bool(info.get('finalQueryInfo')),
+        'summary': {
+            'elapsed_ms': duration_ms(stats.get('elapsedTime')),
+            'queued_ms': duration_ms(stats.get('queuedTime')),
+            'planning_ms': duration_ms(stats.get('planningTime')),
+            'execution_ms': duration_ms(stats.get('executionTime')),
+            'cpu_ms': duration_ms(stats.get('totalCpuTime')),
+            'scheduled_ms': duration_ms(stats.get('totalScheduledTime')),
+            'blocked_ms': duration_ms(stats.get('totalBlockedTime')),
+            'splits': stats.get('totalDrivers', 0),
+            'processed_rows': stats.get('processedInputPositions', stats.get('rawInputPositions', 0)),
+            'processed_bytes': data_size_bytes(stats.get('processedInputDataSize', stats.get('rawInputDataSize'))),
+            'physical_input_bytes': data_size_bytes(stats.get('physicalInputDataSize')),
+            'output_rows': stats.get('outputPositions', 0),
+            'peak_memory_bytes': data_size_bytes(stats.get('peakUserMemoryReservation')),
+            'spilled_bytes': data_size_bytes(stats.get('spilledDataSize')),
+        },
+        'stages': sorted(stages, key=lambda stage: stage['stage_id']),
+        'scans': table_scans(info, operators),
+    }
+
+
+def add_iceberg_pruning(cursor, scans):
+    """Compare each table scan with its Iceberg table's files and partitions
+
+    Trino 395 doesn't report which files a scan opened, so ``files_scanned`` is
+    estimated from the scan's splits (one per data file, unless files are
+    larger than the split size). Totals are those of the table's current
+    snapshot. ``full_scan`` flags a partitioned table read without any
+    partition pruning. Tables without Iceberg metadata are left unchanged.
+    """
+    for scan in scans:
+        try:
+            cursor.execute(f"""
+            SELECT COUNT(*), COALESCE(SUM(record_count), 0), COALESCE(SUM(file_size_in_bytes), 0)
+            FROM {metadata_table(scan['table'], 'files')}
+            WHERE content = 0
+            """)
+            files, rows, total_bytes = cursor.fetchone()
+            cursor.execute(f"SELECT * FROM {metadata_table(scan['table'], 'partitions')}")
+            partitioned = any(column[0] == 'partition' for column in cursor.description or [])
+            partitions = len(cursor.fetchall()) if partitioned else 0
+        except Exception as e:
+            # Not an Iceberg table (or no longer there)
+            print(f"No Iceberg metadata for {scan['table']}: {str(e)}")
+            continue
+        files_scanned = min(scan['splits'], files)
+        full_scan = files > 0 and files_scanned >= files
+        scan.update({
+            'iceberg': True,
+            'files_total': files,
+            'files_scanned': files_scanned,
+            'files_pruned': files - files_scanned,
+            'partitions_total': partitions,
+            # Only known when the scan skipped every file or none of them
+            'partitions_scanned': partitions if full_scan else (0 if files_scanned == 0 else None),
+            'rows_total': int(rows),
+            'bytes_total': int(total_bytes),
+            'full_scan': full_scan and partitions > 1,
+        })
+    return scans
+
+
+class QueryHistory:
+    """Finished query timings by SQL fingerprint, plus the slowest recent queries
+
+    Every recorded query updates its fingerprint's count, mean, max and last
+    elapsed time (the ``max_fingerprints`` most recently seen are kept).
+    Queries taking at least ``threshold_ms`` also go into a rolling list of the
+    last ``max_slow`` slow queries, each with its slowdown against the mean of
+    the fingerprint's earlier runs, so regressions stand out. Profiles fetched
+    later attach their table scans to the query's entry.
+    """
+
+    def __init__(self, threshold_ms=1000.0, max_slow=200, max_fingerprints=1000, sql_chars=2000):
+        self.threshold_ms = threshold_ms
+        self.max_fingerprints = max_fingerprints
+        self.sql_chars = sql_chars
+        self._lock = threading.Lock()
+        self._slow = deque(maxlen=max_slow)
+        self._fingerprints = OrderedDict()
+
+    def record(self, source, query, stats):
+        """Record a finished query from its SQL and final cursor.stats"""
+        if not query or not stats:
+            return
+        try:
+            fingerprint, fingerprint_id = fingerprint_sql(query)
+        except Exception:
+            traceback.print_exc()
+            return
+        elapsed = stats.get('elapsedTimeMillis', 0)
+        with self._lock:
+            entry = self._fingerprints.pop(fingerprint_id, None)
+            if entry is None:
+                entry = {'fingerprint_id': fingerprint_id, 'fingerprint': fingerprint[:self.sql_chars],
+                         'count': 0, 'total_ms': 0, 'max_ms': 0}
+            previous_mean = entry['total_ms'] / entry['count'] if entry['count'] else None
+            entry['count'] += 1
+            entry['total_ms'] += elapsed
+            entry['max_ms'] = max(entry['max_ms'], elapsed)
+            entry['last_ms'] = elapsed
+            entry['last_seen'] = time.time()
+            self._fingerprints[fingerprint_id] = entry
+            while len(self._fingerprints) > self.max_fingerprints:
+                self._fingerprints.popitem(last=False)
+
+            if elapsed >= self.threshold_ms:
+                self._slow.append({
+                    'query_id': stats.get('queryId'),
+                    'source': source,
+                    'state': stats.get('state'),
+                    'query': query[:self.sql_chars],
+                    'fingerprint_id': fingerprint_id,
+                    'elapsed_ms': elapsed,
+                    'queued_ms': stats.get('queuedTimeMillis', 0),
+                    'cpu_ms': stats.get('cpuTimeMillis', 0),
+                    'processed_rows': stats.get('processedRows', 0),
+                    'processed_bytes': stats.get('processedBytes', 0),
+                    'finished_at': time.time(),
+                    'slowdown': round(elapsed / previous_mean, 2) if previous_mean else None,
+                    'scans': None,
+                })
+
+    def attach_profile(self, query_id, scans):
+        """Keep a profiled query's table scans with its slow query entry, if it has one"""
+        with self._lock:
+            for entry in self._slow:
+                if entry['query_id'] == query_id:
+                    entry['scans'] = scans
+
+    def slowest(self, limit=50):
+        """The slowest queries of the rolling history, slowest first"""
+        with self._lock:
+            entries = [dict(entry) for entry in self._slow]
+        return sorted(entries, key=lambda entry: entry['elapsed_ms'], reverse=True)[:limit]
+
+    def fingerprints(self, limit=50):
+        """Fingerprints by total elapsed time, with their mean"""
+        with self._lock:
+            entries = [dict(entry) for entry in self._fingerprints.values()]
+        for entry in entries:
+            entry['mean_ms'] = round(entry['total_ms'] / entry['count'], 1)
+        return sorted(entries, key=lambda entry: entry['total_ms'], reverse=True)[:limit]
@@ -0,0 +1,384 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+from iceberg_maintenance import metadata_table
+
+# Comments, string literals, quoted identifiers, words and single punctuation characters
+TOKEN_PATTERN = re.compile(r"""
+    (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<quoted>"(?:[^"]|"")*")
+  | (?P<word>[A-Za-z_][A-Za-z0-9_$@]*)
+  | (?P<number>\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)
+  | (?P<space>\s+)
+  | (?P<other>.)
+""", re.VERBOSE | re.DOTALL)
+
+# Distinct queries whose latest cached snapshot state is remembered
+MAX_TRACKED_QUERIES = 10000
+
+# How long a table without snapshots (a view, a non-Iceberg table) is remembered as such
+NO_SNAPSHOTS_TTL = 60.0
+
+# Trino errors meaning a table has no Iceberg history; any other failure is not remembered
+NO_SNAPSHOTS_ERRORS = {'TABLE_NOT_FOUND', 'NOT_SUPPORTED'}
+
+# Results of queries using these functions change without any table changing
+NONDETERMINISTIC = {
+    'now', 'current_timestamp', 'current_date', 'current_time', 'localtime', 'localtimestamp',
+    'rand', 'random', 'uuid', 'shuffle', 'current_user',
+}
+
+# Words that end a table reference in FROM/JOIN (anything else after a table is its alias)
+CLAUSE_KEYWORDS = {
+    'where', 'join', 'left', 'right', 'inner', 'outer', 'full', 'cross', 'natural', 'on', 'using',
+    'group', 'order', 'having', 'limit', 'offset', 'fetch', 'union', 'intersect', 'except',
+    'window', 'tablesample', 'for', 'lateral', 'match_recognize',
+}
+
+
+def tokenize(query):
+    """Split SQL into tokens, dropping comments and whitespace"""
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(query):
+        kind = match.lastgroup
+        if kind in ('comment', 'space'):
+            continue
+        text = match.group()
+        if kind == 'word':
+            text = text.lower()
+        tokens.append((kind, text))
+    # A trailing semicolon doesn't change the statement
+    while tokens and tokens[-1][1] == ';':
+        tokens.pop()
+    return tokens
+
+
+def normalize_sql(tokens):
+    """Canonical text of a tokenized query: lowercased words, single spaces, no comments"""
+    return ' '.join(text for _, text in tokens)
+
+
+def _identifier(token):
+    kind, text = token
+    if kind == 'quoted':
+        return text[1:-1].replace('""', '"').lower()
+    if kind == 'word':
+        return text
+    return None
+
+
+def _skip_parentheses(tokens, i):
+    """Index just past the parenthesized group starting at ``tokens[i]``"""
+    depth = 0
+    while i < len(tokens):
+        if tokens[i][1] == '(':
+            depth += 1
+        elif tokens[i][1] == ')':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return i
+
+
+def referenced_tables(tokens, default_catalog, default_schema):
+    """Fully qualified (catalog, schema, table) names read by a query
+
+    Names defined by WITH clauses are excluded. Table functions (e.g. UNNEST)
+    are skipped, and subqueries are covered by their own FROM clauses.
+    """
+    ctes = set()
+    for i in range(len(tokens) - 2):
+        name = _identifier(tokens[i])
+        if name and tokens[i + 1][1] == 'as' and tokens[i + 2][1] == '(':
+            ctes.add(name)
+
+    tables = set()
+    for start, token in enumerate(tokens):
+        if token[0] != 'word' or token[1] not in ('from', 'join'):
+            continue
+        # Walk the relation list; subqueries are visited by this loop on their own
+        i = start + 1
+        while i < len(tokens):
+            parts = []
+            while i < len(tokens):
+                name = _identifier(tokens[i])
+                if name is None or (tokens[i][0] == 'word' and name in CLAUSE_KEYWORDS):
+                    break
+                parts.append(name)
+                i += 1
+                if i < len(tokens) and tokens[i][1] == '.':
+                    i += 1
+                    continue
+                break
+            if i < len(tokens) and tokens[i][1] == '(':
+                # A subquery or table function (UNNEST, TABLE(...)): skip past it
+                i = _skip_parentheses(tokens, i)
+            elif not parts:
+                break
+            elif len(parts) == 1 and parts[0] in ctes:
+                pass
+            elif len(parts) <= 3:
+                qualified = [default_catalog, default_schema][:3 - len(parts)] + parts
+                tables.add(tuple(qualified))
+            # Skip an alias, then continue a comma-separated FROM list
+            if i < len(tokens) and tokens[i][1] == 'as':
+                i += 2
+            elif i < len(tokens) and _identifier(tokens[i]) and tokens[i][1] not in CLAUSE_KEYWORDS:
+                i += 1
+            if i < len(tokens) and tokens[i][1] == '(':
+                # Column aliases, e.g. UNNEST(...) AS u(x)
+                i = _skip_parentheses(tokens, i)
+            if token[1] == 'from' and i < len(tokens) and tokens[i][1] == ',':
+                i += 1
+                continue
+            break
+    return tables
+
+
+def cacheable_tables(query, default_catalog, default_schema, catalogs):
+    """Normalized SQL and the tables whose snapshots key its result
+
+    Only read-only SELECT/WITH queries over tables in ``catalogs`` (Iceberg
+    catalogs, where every change produces a new snapshot) without
+    nondeterministic functions qualify; anything else returns (None, None).
+    """
+    tokens = tokenize(query)
+    if not tokens or tokens[0][1] not in ('select', 'with'):
+        return None, None
+    if any(kind == 'word' and text in NONDETERMINISTIC for kind, text in tokens):
+        return None, None
+    tables = referenced_tables(tokens, default_catalog, default_schema)
+    if any(catalog not in catalogs for catalog, _, _ in tables):
+        return None, None
+    return normalize_sql(tokens), tables
+
+
+def encode_result(columns, rows):
+    """Cache entry for a result: its columns, then each JSON-encoded row, one per line"""
+    return '\n'.join([json.dumps(columns)] + list(rows)).encode('utf-8')
+
+
+def decode_result(body):
+    """(columns, encoded rows) of a cache entry"""
+    lines = body.decode('utf-8').split('\n')
+    return json.loads(lines[0]), lines[1:]
+
+
+class ResultCache:
+    """Encoded query results (see encode_result), keyed by SQL and the snapshots of the tables it reads
+
+    A result is only reused while every referenced Iceberg table is still at the
+    snapshot it was computed from; a new commit changes the key, so the next
+    request misses and recomputes. Entries are evicted least-recently-used once
+    ``max_bytes`` is exceeded, into ``spill_dir`` (bounded by
+    ``spill_max_bytes``) when one is configured. Current snapshot IDs are
+    themselves reused for ``snapshot_ttl`` seconds so bursts of dashboard
+    queries share one lookup.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, spill_dir=None, spill_max_bytes=1024 * 1024 * 1024,
+                 snapshot_ttl=1.0):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.spill_max_bytes = spill_max_bytes
+        self.snapshot_ttl = snapshot_ttl
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._spilled = OrderedDict()
+        self._spilled_bytes = 0
+        self._pending_spill = []
+        self._latest = OrderedDict()
+        self._snapshots = {}
+        self.hits = 0
+        self.spill_hits = 0
+        self.misses = 0
+        self.snapshot_lookups = 0
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def key(self, cursor, settings, sql, tables):
+        """Cache key for ``sql`` at the tables' current snapshots, or None if unavailable"""
+        snapshots = self.snapshot_ids(cursor, tables)
+        if snapshots is None:
+            return None, None
+        query_key = hashlib.sha256(repr((settings, sql)).encode()).hexdigest()
+        state = repr(sorted(snapshots.items()))
+        return query_key, hashlib.sha256((query_key + state).encode()).hexdigest()
+
+    def snapshot_ids(self, cursor, tables):
+        """Current snapshot ID of each table ({table: id}), or None if one isn't an Iceberg table"""
+        now = time.monotonic()
+        result = {}
+        missing = []
+        with self._lock:
+            for table in tables:
+                cached = self._snapshots.get(table)
+                if cached and now - cached[1] <= (self.snapshot_ttl if cached[0] is not False else NO_SNAPSHOTS_TTL):
+                    if cached[0] is False:
+                        return None
+                    result[table] = cached[0]
+                else:
+                    missing.append(table)
+        if not missing:
+            return result
+
+        rows = self._lookup_snapshots(cursor, missing)
+        if rows is None:
+            return None
+        fetched_at = time.monotonic()
+        with self._lock:
+            self.snapshot_lookups += 1
+            for i, snapshot_id in rows:
+                self._snapshots[missing[i]] = (snapshot_id, fetched_at)
+                result[missing[i]] = snapshot_id
+        return result
+
+    def _lookup_snapshots(self, cursor, tables):
+        """Current snapshot ID per table as (index, id) rows, or None if a lookup fails
+
+        The current snapshot is the newest one made current in ``$history``,
+        not the newest committed: after a rollback they differ.
+        """
+        names = ['.'.join('"' + part.replace('"', '""') + '"' for part in table) for table in tables]
+        lookups = " UNION ALL ".join(
+            f"SELECT {i}, max_by(snapshot_id, made_current_at) FROM {metadata_table(name, 'history')} "
+            f"WHERE is_current_ancestor"
+            for i, name in enumerate(names)
+        )
+        try:
+            cursor.execute(lookups)
+            return cursor.fetchall()
+        except Exception as e:
+            if getattr(e, 'error_name', None) not in NO_SNAPSHOTS_ERRORS:
+                # e.g. a timeout: skip caching this query, but don't remember the tables as uncacheable
+                print(f"Snapshot lookup failed, not caching: {str(e)}")
+                return None
+            if len(tables) == 1:
+                # Views or non-Iceberg tables have no snapshots: remember and skip caching
+                with self._lock:
+                    self._snapshots[tables[0]] = (False, time.monotonic())
+            else:
+                # Find out which table has no snapshots so later lookups can skip it
+                for table in tables:
+                    self._lookup_snapshots(cursor, [table])
+            return None
+
+    def get(self, key):
+        with self._lock:
+            body = self._memory.get(key)
+            if body is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return body
+            size = self._spilled.pop(key, None)
+            if size is None:
+                self.misses += 1
+                return None
+            self._spilled_bytes -= size
+        try:
+            with open(self._spill_path(key), 'rb') as f:
+                body = f.read()
+            os.remove(self._spill_path(key))
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.spill_hits += 1
+            if key not in self._memory:
+                self._store_locked(key, body)
+        self._spill_evicted()
+        return body
+
+    def put(self, query_key, key, body):
+        """Store an encoded result, replacing the entry for the query's older snapshots"""
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._latest.get(query_key)
+            if previous and previous != key:
+                self._discard_locked(previous)
+            self._latest[query_key] = key
+            self._latest.move_to_end(query_key)
+            while len(self._latest) > MAX_TRACKED_QUERIES:
+                self._latest.popitem(last=False)
+            self._store_locked(key, body)
+        self._spill_evicted()
+
+    def clear(self):
+        """Drop every cached result (e.g. after DDL, which need not create a snapshot)"""
+        with self._lock:
+            keys = list(self._memory) + list(self._spilled)
+            for key in keys:
+                self._discard_locked(key)
+            self._latest.clear()
+            self._snapshots.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._memory),
+                'bytes': self._memory_bytes,
+                'max_bytes': self.max_bytes,
+                'spilled_entries': len(self._spilled),
+                'spilled_bytes': self._spilled_bytes,
+                'hits': self.hits,
+                'spill_hits': self.spill_hits,
+                'misses': self.misses,
+                'snapshot_lookups': self.snapshot_lookups,
+            }
+
+    def _store_locked(self, key, body):
+        self._memory[key] = body
+        self._memory_bytes += len(body)
+        while self._memory_bytes > self.max_bytes:
+            old_key, old_body = self._memory.popitem(last=False)
+            self._memory_bytes -= len(old_body)
+            if self.spill_dir:
+                self._pending_spill.append((old_key, old_body))
+
+    def _spill_evicted(self):
+        # Disk writes happen outside the lock
+        with self._lock:
+            pending, self._pending_spill = self._pending_spill, []
+        for key, body in pending:
+            try:
+                with open(self._spill_path(key), 'wb') as f:
+                    f.write(body)
+            except OSError:
+                traceback.print_exc()
+                continue
+            with self._lock:
+                self._spilled[key] = len(body)
+                self._spilled_bytes += len(body)
+                while self._spilled_bytes > self.spill_max_bytes:
+                    old_key, size = self._spilled.popitem(last=False)
+                    self._spilled_bytes -= size
+                    self._remove_spill_file(old_key)
+
+    def _discard_locked(self, key):
+        body = self._memory.pop(key, None)
+        if body is not None:
+            self._memory_bytes -= len(body)
+        size = self._spilled.pop(key, None)
+        if size is not None:
+            self._spilled_bytes -= size
+            self._remove_spill_file(key)
+
+    def _remove_spill_file(self, key):
+        try:
+            os.remove(self._spill_path(key))
+        except OSError:
+            pass
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, key + '.json')
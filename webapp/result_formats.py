@@ -0,0 +1,177 @@
+import gzip
+import json
+import re
+
+# Arrow IPC output needs pyarrow; it is optional
+try:
+    import pyarrow as pa
+    ARROW_AVAILABLE = True
+except ImportError:
+    ARROW_AVAILABLE = False
+
+# zstd response compression needs zstandard; gzip is always available
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+# orjson encodes column lists several times faster than the stdlib
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+ARROW_STREAM_MIMETYPE = 'application/vnd.apache.arrow.stream'
+COLUMNAR_JSON_MIMETYPE = 'application/json'
+
+_PARAMETERS = re.compile(r'\(.*\)')
+
+
+def negotiate_format(requested, accept):
+    """Pick 'arrow', 'columnar' or 'json' from a ``format`` field or the Accept header"""
+    if requested:
+        return requested
+    if accept and ARROW_STREAM_MIMETYPE in accept:
+        return 'arrow'
+    return 'json'
+
+
+def negotiate_encoding(accept_encoding):
+    """Best supported Content-Encoding for the Accept-Encoding header, or None"""
+    accepted = {part.split(';')[0].strip().lower() for part in (accept_encoding or '').split(',')}
+    if 'zstd' in accepted and ZSTD_AVAILABLE:
+        return 'zstd'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress(body, encoding):
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(body)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=5)
+    return body
+
+
+def arrow_type(trino_type):
+    """Arrow type for a Trino column type; types without a direct match become strings"""
+    base = _PARAMETERS.sub('', (trino_type or '').lower()).strip()
+    if base == 'boolean':
+        return pa.bool_()
+    if base in ('tinyint', 'smallint', 'integer', 'bigint'):
+        return {'tinyint': pa.int8(), 'smallint': pa.int16(), 'integer': pa.int32(), 'bigint': pa.int64()}[base]
+    if base == 'real':
+        return pa.float32()
+    if base == 'double':
+        return pa.float64()
+    if base == 'decimal':
+        # DECIMAL without parameters is DECIMAL(38, 0)
+        precision, _, scale = trino_type.partition('(')[2].rstrip(')').partition(',')
+        return pa.decimal128(int(precision or 38), int(scale or 0))
+    if base in ('varchar', 'char', 'json', 'uuid', 'ipaddress'):
+        return pa.string()
+    if base == 'varbinary':
+        return pa.binary()
+    if base == 'date':
+        return pa.date32()
+    if base == 'timestamp':
+        return pa.timestamp('us')
+    if base == 'timestamp with time zone':
+        return pa.timestamp('us', tz='UTC')
+    return pa.string()
+
+
+def _to_text(value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (list, dict, tuple)):
+        return json.dumps(value, default=str)
+    return str(value)
+
+
+class ColumnarResult:
+    """Reads an open cursor batch by batch straight into per-column lists
+
+    Rows are never materialized as a list of tuples: each ``fetchmany`` batch is
+    transposed into its columns, and reading stops once ``max_rows`` or
+    ``max_bytes`` (an estimate for the JSON forms) would be exceeded.
+    """
+
+    def __init__(self, cursor, fetch_size=10000, max_rows=None, max_bytes=None):
+        self.cursor = cursor
+        self.fetch_size = fetch_size
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.names = [desc[0] for desc in cursor.description] if cursor.description else []
+        self.types = [desc[1] for desc in cursor.description] if cursor.description else []
+        self.row_count = 0
+        self.truncated = False
+        self.exhausted = False
+
+    def batches(self):
+        """Yield each batch as a list of column lists"""
+        while True:
+            size = self.fetch_size
+            if self.max_rows is not None:
+                size = min(size, self.max_rows - self.row_count)
+                if size <= 0:
+                    # Cap reached: only truncated if the cursor still has rows
+                    self.truncated = bool(self.cursor.fetchmany(1))
+                    self.exhausted = not self.truncated
+                    return
+            batch = self.cursor.fetchmany(size)
+            if not batch:
+                self.exhausted = True
+                return
+            self.row_count += len(batch)
+            yield [list(column) for column in zip(*batch)]
+
+    def to_arrow(self, compression=None):
+        """Encode the result as an Arrow IPC stream (optionally LZ4/ZSTD-compressed buffers)"""
+        schema = pa.schema([(name, arrow_type(trino_type)) for name, trino_type in zip(self.names, self.types)])
+        string_columns = [i for i, field in enumerate(schema) if pa.types.is_string(field.type)]
+        sink = pa.BufferOutputStream()
+        options = pa.ipc.IpcWriteOptions(compression=compression)
+        with pa.ipc.new_stream(sink, schema, options=options) as writer:
+            for columns in self.batches():
+                for i in string_columns:
+                    columns[i] = [_to_text(value) for value in columns[i]]
+                batch = pa.record_batch(
+                    [pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema
+                )
+                writer.write_batch(batch)
+                if self.max_bytes is not None and sink.tell() > self.max_bytes:
+                    self.truncated = True
+                    break
+        return sink.getvalue()
+
+    def to_columnar_json(self):
+        """Encode the result as {"columns", "types", "data": [[column values]...]} JSON bytes"""
+        data = [[] for _ in self.names]
+        estimated = 0
+        for columns in self.batches():
+            for target, column in zip(data, columns):
+                target.extend(column)
+            if self.max_bytes is not None:
+                # Rough size from the first row of the batch, to bound memory like the row path
+                estimated += len(_dumps([column[0] for column in columns])) * len(columns[0]) if columns else 0
+                if estimated > self.max_bytes:
+                    self.truncated = True
+                    break
+        return _dumps({
+            'success': True,
+            'columns': self.names,
+            'types': self.types,
+            'data': data,
+            'rowCount': self.row_count,
+            'truncated': self.truncated,
+        })
+
+
+def _dumps(value):
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(value, default=str, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, default=str).encode('utf-8')
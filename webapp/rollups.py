@@ -0,0 +1,433 @@
+import json
+import logging
+import re
+import time
+from datetime import datetime, timedelta
+
+from message_columns import EVENT_COLUMNS, quote_identifier
+from metrics import INGEST_ROLLUP_DURATION
+from offset_store import offset_ranges_predicate
+from table_layout import TableLayout, event_time_column
+
+logger = logging.getLogger('kafka_to_iceberg')
+
+# Rollup bucket widths, finest first. Each rollup is aggregated from the next finer one.
+GRAINS = {'minute': timedelta(minutes=1), 'hour': timedelta(hours=1), 'day': timedelta(days=1)}
+# date_trunc units, finest first; a rollup answers date_trunc(unit) for its grain and any coarser unit
+TRUNC_UNITS = ('second', 'minute', 'hour', 'day', 'week', 'month', 'quarter', 'year')
+
+# Contiguous bucket ranges recomputed per MERGE statement
+MAX_RANGES_PER_STATEMENT = 100
+
+
+def rollup_table_name(source_table, dimensions, grain):
+    """Default rollup table of a source table, e.g. events_streaming_by_name_minute"""
+    return f"{source_table}_by_{'_'.join(dimensions)}_{grain}"
+
+
+def truncate(value, grain):
+    """Start of the ``grain`` bucket holding a datetime"""
+    if grain == 'minute':
+        return value.replace(second=0, microsecond=0)
+    if grain == 'hour':
+        return value.replace(minute=0, second=0, microsecond=0)
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def timestamp_literal(value):
+    return f"TIMESTAMP '{value:%Y-%m-%d %H:%M:%S.%f}'"
+
+
+def bucket_ranges(buckets, grain):
+    """Sorted bucket starts merged into contiguous [start, end) ranges"""
+    width = GRAINS[grain]
+    ranges = []
+    for bucket in sorted(set(buckets)):
+        if ranges and ranges[-1][1] == bucket:
+            ranges[-1][1] = bucket + width
+        else:
+            ranges.append([bucket, bucket + width])
+    return [tuple(bucket_range) for bucket_range in ranges]
+
+
+def time_ranges_predicate(column, ranges):
+    return " OR ".join(
+        f"({column} >= {timestamp_literal(start)} AND {column} < {timestamp_literal(end)})" for start, end in ranges
+    )
+
+
+class Rollup:
+    """Row counts of a source table per time bucket and dimension values
+
+    A rollup table holds one row per (``bucket_start``, dimensions) with the
+    ``event_count`` and the first and last event time in the bucket. Buckets are
+    ``grain`` wide over the source's ``time_column``.
+    """
+
+    def __init__(self, source_table, grain, dimensions=('name',), time_column='timestamp', table=None,
+                 dimension_types=None):
+        if grain not in GRAINS:
+            raise ValueError(f"Unsupported rollup grain {grain!r}; use one of {', '.join(GRAINS)}")
+        self.source_table = source_table
+        self.grain = grain
+        self.dimensions = list(dimensions)
+        self.time_column = time_column
+        self.table = table or rollup_table_name(source_table, self.dimensions, grain)
+        self.dimension_types = dimension_types or {}
+
+    def __repr__(self):
+        return f"Rollup({self.table!r}, {self.grain!r}, {self.dimensions!r})"
+
+    def create_table(self, cursor):
+        dimension_columns = "".join(
+            f"{quote_identifier(name)} {self.dimension_types.get(name, 'VARCHAR')},\n            "
+            for name in self.dimensions
+        )
+        layout = TableLayout(['day(bucket_start)' if self.grain == 'minute' else 'month(bucket_start)'])
+        cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {self.table} (
+            bucket_start TIMESTAMP(6),
+            {dimension_columns}event_count BIGINT,
+            first_event_at TIMESTAMP(6),
+            last_event_at TIMESTAMP(6),
+            refreshed_at TIMESTAMP(6)
+        )
+        {layout.with_clause()}
+        """)
+        cursor.fetchall()
+
+    def merge_buckets(self, cursor, ranges, finer=None):
+        """Recompute the buckets in ``ranges`` from the source table, or from a ``finer`` rollup
+
+        The source is append-only, so a bucket's row only ever changes by being
+        recomputed whole; MERGE swaps it in one commit, so readers never see a
+        bucket missing or half counted.
+        """
+        dimensions = [quote_identifier(name) for name in self.dimensions]
+        bucket = f"date_trunc('{self.grain}', {{column}})"
+        if finer is None:
+            time_column = quote_identifier(self.time_column)
+            aggregates = f"COUNT(*), MIN({time_column}), MAX({time_column})"
+            source, column = self.source_table, time_column
+        else:
+            aggregates = "SUM(event_count), MIN(first_event_at), MAX(last_event_at)"
+            source, column = finer.table, 'bucket_start'
+        group_by = ", ".join(str(position) for position in range(1, len(dimensions) + 2))
+        columns = ['bucket_start'] + dimensions + ['event_count', 'first_event_at', 'last_event_at']
+        matches = "".join(f" AND t.{name} IS NOT DISTINCT FROM s.{name}" for name in dimensions)
+        for index in range(0, len(ranges), MAX_RANGES_PER_STATEMENT):
+            chunk = ranges[index:index + MAX_RANGES_PER_STATEMENT]
+            cursor.execute(f"""
+            MERGE INTO {self.table} t
+            USING (
+                SELECT {", ".join([bucket.format(column=column)] + dimensions + [aggregates])}
+                FROM {source}
+                WHERE {time_ranges_predicate(column, chunk)}
+                GROUP BY {group_by}
+            ) AS s ({", ".join(columns)})
+            ON t.bucket_start = s.bucket_start{matches}
+            WHEN MATCHED THEN
+                UPDATE SET event_count = s.event_count, first_event_at = s.first_event_at,
+                    last_event_at = s.last_event_at, refreshed_at = CURRENT_TIMESTAMP
+            WHEN NOT MATCHED THEN
+                INSERT ({", ".join(columns)}, refreshed_at)
+                VALUES ({", ".join("s." + name for name in columns)}, CURRENT_TIMESTAMP)
+            """)
+            cursor.fetchall()
+
+
+class RollupRefresher:
+    """Keeps the rollups of one ingested table in step with its committed offsets
+
+    Each rollup checkpoints the source offsets it covers in the offset store,
+    under its own table name. A refresh reads which time buckets the rows
+    between a rollup's checkpoints and the source's fall in, recomputes just
+    those buckets and then advances the checkpoints, so a failed or interrupted
+    refresh is redone by the next one. The finest rollup is aggregated from the
+    source table and each coarser one from the rollup before it, so refresh
+    cost follows the new data rather than the table size.
+    """
+
+    def __init__(self, source_table, topic, grains, dimensions=('name',), columns=EVENT_COLUMNS, interval=0.0):
+        time_column = event_time_column(columns)
+        if time_column is None:
+            raise ValueError(f"{source_table} has no timestamp column to roll up by")
+        types = {column['name']: column['type'] for column in columns}
+        unknown = [name for name in dimensions if name not in types]
+        if unknown:
+            raise ValueError(f"Rollup dimensions {', '.join(unknown)} are not columns of {source_table}")
+        self.source_table = source_table
+        self.topic = topic
+        self.rollups = [
+            Rollup(source_table, grain, dimensions, time_column, dimension_types=types)
+            for grain in sorted(set(grains), key=list(GRAINS).index)
+        ]
+        self.interval = interval
+        self._dirty = True
+        self._last_refresh = 0.0
+
+    def ensure_tables(self, cursor):
+        for rollup in self.rollups:
+            rollup.create_table(cursor)
+            logger.info(f"Ensured rollup table {rollup.table} exists")
+
+    def mark_dirty(self):
+        """Note that the source has new rows; refreshes wait for new data or a failed refresh"""
+        self._dirty = True
+
+    def due(self):
+        return self._dirty and time.monotonic() - self._last_refresh >= self.interval
+
+    def refresh(self, cursor, source_offsets, offset_store_for):
+        """Bring every rollup up to the source's committed ``source_offsets``
+
+        ``offset_store_for(consumer)`` returns the offset store holding a
+        rollup's checkpoints. Returns the number of buckets recomputed.
+        """
+        start_time = time.monotonic()
+        self._last_refresh = start_time
+        self._dirty = True
+        touched = {}
+        recomputed = 0
+        finer = None
+        for rollup in self.rollups:
+            store = offset_store_for(rollup.table)
+            checkpoints = store.load(self.topic)
+            ranges = {
+                partition: (checkpoints.get(partition, -1), offset)
+                for partition, offset in source_offsets.items()
+                if offset > checkpoints.get(partition, -1)
+            }
+            if ranges:
+                key = tuple(sorted(ranges.items()))
+                if key not in touched:
+                    touched[key] = self._touched_buckets(cursor, ranges)
+                buckets = bucket_ranges({truncate(bucket, rollup.grain) for bucket in touched[key]}, rollup.grain)
+                if buckets:
+                    rollup.merge_buckets(cursor, buckets, finer)
+                    recomputed += len(buckets)
+                store.commit(self.topic, {partition: offset for partition, (_, offset) in ranges.items()})
+            finer = rollup
+        self._dirty = False
+        duration = time.monotonic() - start_time
+        INGEST_ROLLUP_DURATION.observe(duration, table=self.source_table)
+        if recomputed:
+            logger.info(f"Refreshed {recomputed} bucket ranges of the rollups of {self.source_table} "
+                        f"in {duration * 1000:.0f} ms")
+        return recomputed
+
+    def _touched_buckets(self, cursor, ranges):
+        """Finest-grain buckets of the source rows in the given offset ranges"""
+        grain = self.rollups[0].grain
+        cursor.execute(f"""
+        SELECT DISTINCT date_trunc('{grain}', {quote_identifier(self.rollups[0].time_column)})
+        FROM {self.source_table}
+        WHERE {offset_ranges_predicate(ranges, 'partition_id', 'offset')}
+        """)
+        return [row[0].replace(tzinfo=None) for row in cursor.fetchall() if row[0] is not None]
+
+
+def load_rollups(config):
+    """Rollups the webapp may route queries to, from the QUERY_ROLLUPS JSON
+
+    A list of {source, time_column, dimensions, grains, tables}: ``tables``
+    maps a grain to its table when it isn't the default rollup_table_name.
+    """
+    rollups = []
+    for entry in json.loads(config) if config else []:
+        dimensions = entry.get('dimensions', ['name'])
+        tables = entry.get('tables', {})
+        for grain in entry.get('grains', tables.keys() or ['minute', 'hour']):
+            rollups.append(Rollup(
+                entry['source'], grain, dimensions, entry.get('time_column', 'timestamp'), table=tables.get(grain)
+            ))
+    return rollups
+
+
+_AGGREGATE_QUERY = re.compile(
+    r"^\s*SELECT\s+(?P<select>.+?)\s+FROM\s+(?P<table>[\w.\"]+)"
+    r"(?:\s+WHERE\s+(?P<where>.+?))?"
+    r"(?:\s+GROUP\s+BY\s+(?P<group>.+?))?"
+    r"(?:\s+ORDER\s+BY\s+(?P<order>.+?))?"
+    r"(?:\s+LIMIT\s+(?P<limit>\d+))?\s*;?\s*$",
+    re.I | re.S,
+)
+_ALIASED = re.compile(r'^(?P<expr>.+?)(?:\s+(?:AS\s+)?(?P<alias>"[^"]+"|\w+))?$', re.I | re.S)
+_COLUMN = re.compile(r'^"?(\w+)"?$')
+_COUNT = re.compile(r'^count\(\s*(?:\*|1)\s*\)$', re.I)
+_MIN_MAX = re.compile(r'^(min|max)\(\s*"?(\w+)"?\s*\)$', re.I)
+_DATE_TRUNC = re.compile(r"^date_trunc\(\s*'(\w+)'\s*,\s*\"?(\w+)\"?\s*\)$", re.I)
+_TIME_BOUND = re.compile(r"^\"?(\w+)\"?\s*(>=|<)\s*TIMESTAMP\s*'([^']+)'$", re.I)
+_LITERAL = r"(?:'(?:[^']|'')*'|-?\d+(?:\.\d+)?)"
+_DIMENSION_FILTER = re.compile(
+    rf"^\"?(\w+)\"?\s*(?:(?:=|<>|!=|(?:NOT\s+)?LIKE)\s*{_LITERAL}"
+    rf"|(?:NOT\s+)?IN\s*\(\s*{_LITERAL}(?:\s*,\s*{_LITERAL})*\s*\)|IS\s+(?:NOT\s+)?NULL)$",
+    re.I,
+)
+_ORDER_ITEM = re.compile(r'^(?P<expr>.+?)(?P<direction>(?:\s+(?:ASC|DESC))?(?:\s+NULLS\s+(?:FIRST|LAST))?)$', re.I | re.S)
+_KEYWORDS = {'asc', 'desc', 'nulls', 'first', 'last', 'from', 'where', 'group', 'order', 'limit'}
+
+
+def split_top_level(text, separator):
+    """Split on a separator regex outside parentheses and string literals"""
+    parts, depth, quote, start = [], 0, False, 0
+    pattern = re.compile(separator, re.I)
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char == "'":
+            quote = not quote
+        elif not quote and char == '(':
+            depth += 1
+        elif not quote and char == ')':
+            depth -= 1
+        elif not quote and depth == 0:
+            match = pattern.match(text, i)
+            if match and match.end() > i:
+                parts.append(text[start:i].strip())
+                start = i = match.end()
+                continue
+        i += 1
+    parts.append(text[start:].strip())
+    return parts
+
+
+class RollupRouter:
+    """Rewrites aggregate queries over a rolled-up table into queries over its rollup
+
+    Only queries of one shape are routed: SELECT of dimension columns,
+    ``date_trunc(unit, <time column>)``, ``COUNT(*)`` and MIN/MAX of the time
+    column FROM the source table, filtered by dimension values and by
+    ``>=``/``<`` bounds on the time column, with GROUP BY, ORDER BY and LIMIT.
+    The coarsest rollup whose buckets line up with every date_trunc unit and
+    time bound is used, so the answer is the same as the raw query's, as of the
+    rollup's last refresh. Anything else returns None.
+    """
+
+    def __init__(self, rollups):
+        # Coarsest first, so the smallest table that can answer wins
+        self.rollups = sorted(rollups, key=lambda rollup: -list(GRAINS).index(rollup.grain))
+
+    def __bool__(self):
+        return bool(self.rollups)
+
+    def route(self, query, default_catalog, default_schema):
+        """(rewritten SQL, Rollup) for a query a rollup can answer, else None"""
+        match = _AGGREGATE_QUERY.match(query)
+        if not match:
+            return None
+        parts = [part.strip('"').lower() for part in match.group('table').split('.')]
+        if not 1 <= len(parts) <= 3:
+            return None
+        table = '.'.join([default_catalog, default_schema][:3 - len(parts)] + parts).lower()
+        for rollup in self.rollups:
+            if rollup.source_table.lower() == table:
+                sql = self._rewrite(match, rollup)
+                if sql is not None:
+                    return sql, rollup
+        return None
+
+    def _rewrite(self, match, rollup):
+        select, aliases = [], {}
+        aggregates_only = True
+        for item in split_top_level(match.group('select'), r',\s*'):
+            aliased = _ALIASED.match(item)
+            expression, alias = aliased.group('expr'), aliased.group('alias')
+            if alias and alias.lower() in _KEYWORDS:
+                return None
+            rewritten = self._expression(expression, rollup)
+            if rewritten is None:
+                # The alias pattern may have split an unaliased expression; try it whole
+                expression, alias = item, None
+                rewritten = self._expression(expression, rollup)
+                if rewritten is None:
+                    return None
+            sql, aggregate = rewritten
+            aggregates_only = aggregates_only and aggregate
+            if alias:
+                aliases[alias.strip('"').lower()] = aggregate
+                sql += f" AS {alias}"
+            select.append((sql, aggregate))
+
+        where = []
+        if match.group('where'):
+            for condition in split_top_level(match.group('where'), r'\s+AND\s+'):
+                bound = _TIME_BOUND.match(condition)
+                if bound:
+                    if bound.group(1).lower() != rollup.time_column.lower():
+                        return None
+                    try:
+                        value = datetime.fromisoformat(bound.group(3).strip())
+                    except ValueError:
+                        return None
+                    if truncate(value, rollup.grain) != value:
+                        return None
+                    where.append(f"bucket_start {bound.group(2)} {timestamp_literal(value)}")
+                    continue
+                dimension = _DIMENSION_FILTER.match(condition)
+                if not dimension or not self._is_dimension(dimension.group(1), rollup):
+                    return None
+                where.append(condition)
+
+        group_by = []
+        if match.group('group'):
+            for item in split_top_level(match.group('group'), r',\s*'):
+                if item.isdigit():
+                    position = int(item)
+                    if not 1 <= position <= len(select) or select[position - 1][1]:
+                        return None
+                    group_by.append(item)
+                    continue
+                rewritten = self._expression(item, rollup)
+                if rewritten is None or rewritten[1]:
+                    return None
+                group_by.append(rewritten[0])
+        elif not aggregates_only:
+            return None
+
+        order_by = []
+        if match.group('order'):
+            for item in split_top_level(match.group('order'), r',\s*'):
+                ordered = _ORDER_ITEM.match(item)
+                expression, direction = ordered.group('expr'), ordered.group('direction')
+                if expression.isdigit() or expression.strip('"').lower() in aliases:
+                    order_by.append(item)
+                    continue
+                rewritten = self._expression(expression, rollup)
+                if rewritten is None:
+                    return None
+                order_by.append(rewritten[0] + direction)
+
+        sql = f"SELECT {', '.join(sql for sql, _ in select)} FROM {rollup.table}"
+        if where:
+            sql += f" WHERE {' AND '.join(where)}"
+        if group_by:
+            sql += f" GROUP BY {', '.join(group_by)}"
+        if order_by:
+            sql += f" ORDER BY {', '.join(order_by)}"
+        if match.group('limit'):
+            sql += f" LIMIT {match.group('limit')}"
+        return sql
+
+    def _expression(self, expression, rollup):
+        """(rollup SQL, is aggregate) for one select/group/order expression, or None"""
+        expression = ' '.join(expression.split())
+        column = _COLUMN.match(expression)
+        if column:
+            return (expression, False) if self._is_dimension(column.group(1), rollup) else None
+        if _COUNT.match(expression):
+            return "SUM(event_count)", True
+        min_max = _MIN_MAX.match(expression)
+        if min_max and min_max.group(2).lower() == rollup.time_column.lower():
+            if min_max.group(1).lower() == 'min':
+                return "MIN(first_event_at)", True
+            return "MAX(last_event_at)", True
+        date_trunc = _DATE_TRUNC.match(expression)
+        if date_trunc and date_trunc.group(2).lower() == rollup.time_column.lower():
+            unit = date_trunc.group(1).lower()
+            if unit in TRUNC_UNITS and TRUNC_UNITS.index(unit) >= TRUNC_UNITS.index(rollup.grain):
+                return f"date_trunc('{unit}', bucket_start)", False
+        return None
+
+    def _is_dimension(self, name, rollup):
+        return name.lower() in (dimension.lower() for dimension in rollup.dimensions)
@@ -1,7 +1,7 @@
 #!/bin/bash
 
 echo "Installing required dependencies..."
-pip install flask==2.0.1 trino==0.319.0 python-dateutil==2.8.2 requests==2.28.1 werkzeug==2.0.3
+pip install flask==2.0.1 trino==0.319.0 python-dateutil==2.8.2 requests==2.28.1 werkzeug==2.0.3 gunicorn==20.1.0
 
 echo "Attempting to install Kafka dependencies (optional)..."
 # Try multiple approaches to install confluent-kafka
@@ -23,7 +23,12 @@ pip install confluent-kafka || {
     }
 }
 
-echo "Starting the Flask application..."
-export FLASK_APP=app.py
-export FLASK_ENV=development
-flask run --host=0.0.0.0
\ No newline at end of file
+if [ "${FLASK_DEBUG}" = "1" ]; then
+    echo "Starting the Flask development server (debug reloader)..."
+    export FLASK_APP=app.py
+    export FLASK_ENV=development
+    flask run --host=0.0.0.0
+else
+    echo "Starting the Flask application with gunicorn..."
+    exec gunicorn -c gunicorn.conf.py 'app:create_app()'
+fi
\ No newline at end of file
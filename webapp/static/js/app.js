@@ -1,3 +1,6 @@
+// Number of rows fetched per page of query results
+const QUERY_PAGE_SIZE = 500;
+
 // Initialize when document is ready
 $(document).ready(function() {
     // Load connection settings from localStorage if available
@@ -36,6 +39,7 @@ $(document).ready(function() {
 
     // Button click handlers
     $('#execute-query').click(executeQuery);
+    $('#show-slow-queries').click(showSlowQueries);
     $('#clear-editor').click(() => {
         sqlEditor.setValue('');
         sqlEditor.focus();
@@ -65,6 +69,9 @@ $(document).ready(function() {
         eventEditor.focus();
     });
 
+    // Job id of the query currently shown in the results area
+    let activeJobId = null;
+
     // Function to execute SQL query
     function executeQuery() {
         const query = sqlEditor.getValue().trim();
@@ -74,42 +81,103 @@ $(document).ready(function() {
             return;
         }
         
-        // Show loading indicator
-        $('#results-area').html('<div class="text-center my-5"><div class="spinner-border text-primary" role="status"></div><p class="mt-2">Executing query...</p></div>');
+        // Show loading indicator with a cancel button
+        $('#results-area').html('<div class="text-center my-5"><div class="spinner-border text-primary" role="status"></div><p class="mt-2" id="query-progress">Submitting query...</p><button class="btn btn-sm btn-outline-danger" id="cancel-query">Cancel</button></div>');
         
         // Hide any previous error
         $('#query-error').addClass('d-none');
         
-        // Execute query via AJAX
+        // Queries run as background jobs; poll for progress, then fetch the results
         $.ajax({
-            url: '/execute_query',
+            url: '/jobs',
             type: 'POST',
             contentType: 'application/json',
             data: JSON.stringify({ query: query }),
-            success: function(response) {
-                displayQueryResults(response);
+            success: function(job) {
+                activeJobId = job.job_id;
+                pollQueryJob(job.job_id);
             },
-            error: function(xhr) {
-                let errorMessage = 'An error occurred while executing the query.';
-                try {
-                    const response = JSON.parse(xhr.responseText);
-                    if (response.error) {
-                        errorMessage = response.error;
-                    }
-                    if (response.traceback) {
-                        errorMessage += '\n\n' + response.traceback;
-                    }
-                } catch (e) {
-                    console.error('Error parsing error response:', e);
+            error: showQueryFailure
+        });
+    }
+
+    // Function to poll a query job until it completes
+    function pollQueryJob(jobId) {
+        $.ajax({
+            url: `/jobs/${jobId}`,
+            type: 'GET',
+            success: function(job) {
+                if (jobId !== activeJobId) {
+                    return;
                 }
-                showQueryError(errorMessage);
-                
-                // Show empty results
-                $('#results-area').html('<div class="alert alert-warning">Query failed. See error details above.</div>');
-            }
+                if (job.state === 'QUEUED' || job.state === 'RUNNING') {
+                    $('#query-progress').text(describeJobProgress(job));
+                    setTimeout(() => pollQueryJob(jobId), 500);
+                } else if (job.state === 'FAILED') {
+                    showQueryError(job.error);
+                    $('#results-area').html('<div class="alert alert-warning">Query failed. See error details above.</div>');
+                } else if (job.state === 'CANCELLED') {
+                    $('#results-area').html('<div class="alert alert-info">Query cancelled.</div>');
+                } else {
+                    loadJobResults(jobId, 0, function(page) {
+                        displayQueryResults(page, jobId, job.query_id, job.routed_to);
+                    });
+                }
+            },
+            error: showQueryFailure
+        });
+    }
+
+    // Function to fetch one page of a job's results
+    function loadJobResults(jobId, offset, onSuccess, onError) {
+        $.ajax({
+            url: `/jobs/${jobId}/results`,
+            type: 'GET',
+            data: { offset: offset, limit: QUERY_PAGE_SIZE },
+            success: onSuccess,
+            error: onError || showQueryFailure
         });
     }
 
+    // Function to summarize a running job's progress from Trino's stats
+    function describeJobProgress(job) {
+        const progress = job.progress;
+        if (job.state === 'QUEUED' || !progress.total_splits) {
+            return job.state === 'QUEUED' ? 'Waiting for a free worker...' : 'Executing query...';
+        }
+        const megabytes = (progress.processed_bytes / (1024 * 1024)).toFixed(1);
+        return `${progress.completed_splits}/${progress.total_splits} splits, ` +
+            `${progress.processed_rows.toLocaleString()} rows (${megabytes} MB) processed`;
+    }
+
+    $(document).on('click', '#cancel-query', function() {
+        if (!activeJobId) {
+            return;
+        }
+        $(this).prop('disabled', true).text('Cancelling...');
+        $.ajax({ url: `/jobs/${activeJobId}`, type: 'DELETE' });
+    });
+
+    // Function to show a failed query request
+    function showQueryFailure(xhr) {
+        let errorMessage = 'An error occurred while executing the query.';
+        try {
+            const response = JSON.parse(xhr.responseText);
+            if (response.error) {
+                errorMessage = response.error;
+            }
+            if (response.traceback) {
+                errorMessage += '\n\n' + response.traceback;
+            }
+        } catch (e) {
+            console.error('Error parsing error response:', e);
+        }
+        showQueryError(errorMessage);
+        
+        // Show empty results
+        $('#results-area').html('<div class="alert alert-warning">Query failed. See error details above.</div>');
+    }
+
     // Function to send event to Kafka
     function sendEvent(useDockerMethod) {
         // If useDockerMethod parameter wasn't passed, use the checkbox value
@@ -376,16 +444,16 @@ $(document).ready(function() {
         const tableDetails = $('#table-details');
         tableDetails.html('<div class="text-center my-3"><div class="spinner-border text-primary" role="status"></div><p class="mt-2">Loading table details...</p></div>');
         
-        // Execute describe query
-        const query = `DESCRIBE ${catalog}.${schema}.${table}`;
-        
+        // Column listings are served from the server-side metadata cache
         $.ajax({
-            url: '/execute_query',
-            type: 'POST',
-            contentType: 'application/json',
-            data: JSON.stringify({ query: query }),
+            url: '/columns',
+            type: 'GET',
+            data: { catalog: catalog, schema: schema, table: table },
             success: function(response) {
-                displayTableDetails(response, catalog, schema, table);
+                displayTableDetails({
+                    columns: ['Column', 'Type', 'Extra', 'Comment'],
+                    rows: response.columns.map(column => [column.name, column.type, column.extra, column.comment])
+                }, catalog, schema, table);
             },
             error: function() {
                 tableDetails.html('<div class="alert alert-danger">Error loading table details</div>');
@@ -451,7 +519,7 @@ $(document).ready(function() {
     }
 
     // Function to display query results
-    function displayQueryResults(response) {
+    function displayQueryResults(response, jobId, queryId, routedTo) {
         const resultsArea = $('#results-area');
         resultsArea.empty();
         
@@ -486,18 +554,213 @@ $(document).ready(function() {
         
         // Add results summary
         const summary = $('<div class="mb-3">');
-        summary.append(`<span class="badge bg-success">${response.rowCount} rows returned</span>`);
+        const rowsBadge = $('<span class="badge bg-success">');
+        summary.append(rowsBadge);
         
         resultsArea.append(summary);
         resultsArea.append(table);
         
         // Initialize DataTables
-        $('#results-table').DataTable({
+        const dataTable = $('#results-table').DataTable({
             pageLength: 10,
             lengthMenu: [[10, 25, 50, 100, -1], [10, 25, 50, 100, "All"]],
             scrollX: true,
             dom: '<"d-flex justify-content-between"<"d-flex"l<"ms-3"f>>t<"d-flex justify-content-between"<"d-flex"i<"ms-3"p>>>'
         });
+
+        updateResultsSummary(rowsBadge, summary, response, response.rowCount);
+        if (routedTo) {
+            summary.append($('<span class="badge bg-info text-dark ms-2">').text(`Answered from rollup ${routedTo}`));
+        }
+
+        // Page through the job's results (or the server-side cursor) on demand
+        let loadedRows = response.rowCount;
+        let nextToken = response.next_token;
+        let nextOffset = response.next_offset;
+        const loadMoreBtn = $('<button class="btn btn-sm btn-outline-primary ms-2">Load more rows</button>');
+        loadMoreBtn.toggle(hasMoreRows(response));
+        summary.append(loadMoreBtn);
+
+        // Stage timings and Iceberg pruning of the finished query, from Trino's query info
+        if (queryId) {
+            const profileBtn = $('<button class="btn btn-sm btn-outline-secondary ms-2">Profile</button>');
+            const profileArea = $('<div class="mt-3">');
+            summary.append(profileBtn);
+            resultsArea.append(profileArea);
+            profileBtn.click(function() {
+                profileBtn.prop('disabled', true).text('Profiling...');
+                $.ajax({
+                    url: `/query_profile/${encodeURIComponent(queryId)}`,
+                    type: 'GET',
+                    success: function(profile) {
+                        profileBtn.remove();
+                        displayQueryProfile(profileArea, profile);
+                    },
+                    error: function(xhr) {
+                        profileBtn.prop('disabled', false).text('Profile');
+                        showQueryError('Failed to load the query profile: ' + xhr.responseText);
+                    }
+                });
+            });
+        }
+
+        function addPage(page) {
+            dataTable.rows.add(page.rows.map(row => row.map(cell => cell === null ? 'NULL' : cell))).draw(false);
+            loadedRows += page.rowCount;
+            nextToken = page.next_token;
+            nextOffset = page.next_offset;
+            updateResultsSummary(rowsBadge, summary, page, loadedRows);
+            loadMoreBtn.prop('disabled', false).text('Load more rows').toggle(hasMoreRows(page));
+        }
+
+        function loadFailed(xhr) {
+            loadMoreBtn.remove();
+            showQueryError('Failed to load more rows: ' + xhr.responseText);
+        }
+
+        loadMoreBtn.click(function() {
+            loadMoreBtn.prop('disabled', true).text('Loading...');
+            if (jobId) {
+                loadJobResults(jobId, nextOffset, addPage, loadFailed);
+                return;
+            }
+            $.ajax({
+                url: '/execute_query',
+                type: 'POST',
+                contentType: 'application/json',
+                data: JSON.stringify({ next_token: nextToken, page_size: QUERY_PAGE_SIZE }),
+                success: addPage,
+                error: loadFailed
+            });
+        });
+    }
+
+    // Function to render a query profile: totals, per-stage stats and table scans
+    function displayQueryProfile(container, profile) {
+        const summary = profile.summary;
+        container.empty();
+        container.append($('<h6>').text(`Profile of ${profile.query_id} (${profile.state}${profile.final ? '' : ', still updating'})`));
+        container.append($('<p class="small text-muted">').text(
+            `${formatMillis(summary.elapsed_ms)} elapsed (${formatMillis(summary.queued_ms)} queued, ` +
+            `${formatMillis(summary.planning_ms)} planning), ${formatMillis(summary.cpu_ms)} CPU, ` +
+            `${summary.processed_rows.toLocaleString()} rows / ${formatBytes(summary.processed_bytes)} processed, ` +
+            `peak memory ${formatBytes(summary.peak_memory_bytes)}, spilled ${formatBytes(summary.spilled_bytes)}`
+        ));
+
+        container.append(profileTable(
+            ['Stage', 'Tasks', 'Splits', 'Wall', 'CPU', 'Input rows', 'Input', 'Output rows', 'Spilled', 'Skew', 'Busiest operator'],
+            profile.stages.map(stage => [
+                stage.stage_id,
+                stage.tasks,
+                stage.splits,
+                formatMillis(stage.wall_ms),
+                formatMillis(stage.cpu_ms),
+                stage.input_rows.toLocaleString(),
+                formatBytes(stage.input_bytes),
+                stage.output_rows.toLocaleString(),
+                formatBytes(stage.spilled_bytes),
+                stage.task_input_rows.skew === null ? '-' : `${stage.task_input_rows.skew}x`,
+                stage.operators.length ? `${stage.operators[0].operator} (${formatMillis(stage.operators[0].wall_ms)})` : '-'
+            ])
+        ));
+
+        if (profile.scans.length) {
+            container.append(profileTable(
+                ['Table', 'Splits', 'Files scanned', 'Files pruned', 'Partitions', 'Rows read', 'Read', 'Pruning'],
+                profile.scans.map(scan => [
+                    scan.table,
+                    scan.splits,
+                    scan.iceberg ? `${scan.files_scanned} / ${scan.files_total}` : '-',
+                    scan.iceberg ? scan.files_pruned : '-',
+                    scan.iceberg ? `${scan.partitions_scanned === null ? '?' : scan.partitions_scanned} / ${scan.partitions_total}` : '-',
+                    scan.iceberg ? `${scan.rows_read.toLocaleString()} / ${scan.rows_total.toLocaleString()}` : scan.rows_read.toLocaleString(),
+                    scan.iceberg ? `${formatBytes(scan.bytes_read)} / ${formatBytes(scan.bytes_total)}` : formatBytes(scan.bytes_read),
+                    scan.full_scan ? 'No partition pruning' : (scan.iceberg ? 'OK' : '-')
+                ])
+            ));
+        }
+    }
+
+    // Function to load and show the slow query history
+    function showSlowQueries() {
+        $.ajax({
+            url: '/slow_queries',
+            type: 'GET',
+            success: function(history) {
+                const resultsArea = $('#results-area');
+                resultsArea.empty();
+                resultsArea.append($('<h6>').text(`Slowest recent queries (over ${formatMillis(history.threshold_ms)})`));
+                resultsArea.append(profileTable(
+                    ['Elapsed', 'Slowdown', 'Source', 'Rows', 'Fingerprint', 'Query', 'Pruning'],
+                    history.slowest.map(entry => [
+                        formatMillis(entry.elapsed_ms),
+                        entry.slowdown === null ? '-' : `${entry.slowdown}x`,
+                        entry.source,
+                        entry.processed_rows.toLocaleString(),
+                        entry.fingerprint_id,
+                        entry.query,
+                        entry.scans === null ? 'Not profiled' :
+                            (entry.scans.filter(scan => scan.full_scan).map(scan => `Full scan of ${scan.table}`).join(', ') || 'OK')
+                    ])
+                ));
+                resultsArea.append($('<h6 class="mt-3">').text('Time spent by query fingerprint'));
+                resultsArea.append(profileTable(
+                    ['Fingerprint', 'Runs', 'Total', 'Mean', 'Max', 'Last', 'SQL'],
+                    history.fingerprints.map(entry => [
+                        entry.fingerprint_id,
+                        entry.count,
+                        formatMillis(entry.total_ms),
+                        formatMillis(entry.mean_ms),
+                        formatMillis(entry.max_ms),
+                        formatMillis(entry.last_ms),
+                        entry.fingerprint
+                    ])
+                ));
+            },
+            error: showQueryFailure
+        });
+    }
+
+    // Function to build a small table of text cells
+    function profileTable(headers, rows) {
+        const table = $('<table class="table table-sm table-bordered small">');
+        const headerRow = $('<tr>');
+        headers.forEach(header => headerRow.append($('<th>').text(header)));
+        table.append($('<thead>').append(headerRow));
+        const tbody = $('<tbody>');
+        rows.forEach(row => {
+            const dataRow = $('<tr>');
+            row.forEach(cell => dataRow.append($('<td>').text(cell)));
+            tbody.append(dataRow);
+        });
+        return $('<div class="table-responsive">').append(table.append(tbody));
+    }
+
+    function formatMillis(ms) {
+        return ms >= 1000 ? `${(ms / 1000).toFixed(2)} s` : `${Math.round(ms)} ms`;
+    }
+
+    function formatBytes(bytes) {
+        const units = ['B', 'KB', 'MB', 'GB', 'TB'];
+        let unit = 0;
+        while (bytes >= 1024 && unit < units.length - 1) {
+            bytes /= 1024;
+            unit++;
+        }
+        return `${unit ? bytes.toFixed(1) : bytes} ${units[unit]}`;
+    }
+
+    // Function to tell whether more result rows can be fetched
+    function hasMoreRows(response) {
+        return !!response.next_token || (response.next_offset !== undefined && response.next_offset !== null);
+    }
+
+    // Function to update the row count badge and truncation notice
+    function updateResultsSummary(rowsBadge, summary, response, loadedRows) {
+        rowsBadge.text(`${loadedRows} rows ${hasMoreRows(response) ? 'loaded so far' : 'returned'}`);
+        if (response.truncated && !summary.find('.badge.bg-warning').length) {
+            summary.append('<span class="badge bg-warning text-dark ms-2">Result truncated at the server row/byte limit</span>');
+        }
     }
 
     // Function to show query error
@@ -142,8 +142,108 @@ $(document).ready(function() {
     $('#cartOffcanvas').on('show.bs.offcanvas', function () {
         updateOffcanvasCart();
     });
+
+    // Handle load test button click
+    $('#run-load-test-btn').click(function() {
+        const totalEvents = parseInt($('#load-test-events').val()) || 1000;
+        const batchSize = parseInt($('#load-test-batch-size').val()) || 500;
+        runLoadTest(totalEvents, batchSize);
+    });
 });
 
+// Function to generate a synthetic order event for load testing
+function generateLoadTestEvent(sequence) {
+    const product = products[sequence % products.length];
+    const quantity = 1 + (sequence % 3);
+    return {
+        id: 'loadtest_' + Date.now() + '_' + sequence,
+        type: 'order',
+        timestamp: new Date().toISOString(),
+        items: [{
+            product_id: product.id,
+            product_name: product.name,
+            price: product.price,
+            quantity: quantity,
+            subtotal: product.price * quantity
+        }],
+        total: product.price * quantity,
+        status: "PENDING"
+    };
+}
+
+// Function to push events through the bulk endpoint and report throughput
+function runLoadTest(totalEvents, batchSize) {
+    const maxInFlight = 4;
+    const results = $('#load-test-results');
+    const button = $('#run-load-test-btn');
+    let sent = 0;
+    let queued = 0;
+    let inFlight = 0;
+    let failed = false;
+    const startTime = performance.now();
+
+    button.prop('disabled', true);
+    results.html('<div class="text-muted">Sending events...</div>');
+
+    function sendNextBatch() {
+        if (failed) {
+            return;
+        }
+        if (sent >= totalEvents) {
+            if (inFlight === 0) {
+                finish();
+            }
+            return;
+        }
+        const count = Math.min(batchSize, totalEvents - sent);
+        const lines = [];
+        for (let i = 0; i < count; i++) {
+            lines.push(JSON.stringify(generateLoadTestEvent(sent + i)));
+        }
+        sent += count;
+        inFlight += 1;
+
+        $.ajax({
+            url: '/send_events',
+            type: 'POST',
+            contentType: 'application/x-ndjson',
+            data: lines.join('\n'),
+            success: function(response) {
+                queued += response.queued;
+                inFlight -= 1;
+                sendNextBatch();
+            },
+            error: function(xhr) {
+                failed = true;
+                button.prop('disabled', false);
+                results.html('<div class="alert alert-danger">Load test failed: ' + xhr.responseText + '</div>');
+            }
+        });
+    }
+
+    function finish() {
+        const seconds = (performance.now() - startTime) / 1000;
+        $.get('/producer_stats', function(stats) {
+            results.html(`
+                <ul class="list-unstyled mb-0">
+                    <li><strong>Events queued:</strong> ${queued} in ${seconds.toFixed(2)}s
+                        (${Math.round(queued / seconds)} events/s)</li>
+                    <li><strong>Delivered / failed / pending:</strong>
+                        ${stats.events_delivered} / ${stats.events_failed} / ${stats.events_pending}</li>
+                    <li><strong>Avg request latency:</strong> ${stats.avg_request_ms} ms
+                        (max ${stats.max_request_ms} ms)</li>
+                    <li><strong>Avg delivery latency:</strong> ${stats.avg_delivery_ms} ms</li>
+                </ul>
+            `);
+            button.prop('disabled', false);
+        });
+    }
+
+    for (let i = 0; i < maxInFlight; i++) {
+        sendNextBatch();
+    }
+}
+
 // Function to render products
 function renderProducts() {
     const productsContainer = $('#products-container');
@@ -443,7 +543,7 @@ function sendOrderToKafka() {
         contentType: 'application/json',
         data: JSON.stringify({ 
             event_data: orderEvent,
-            use_docker_method: true
+            use_docker_method: false
         }),
         success: function(response) {
             // Show success message with more details and animation
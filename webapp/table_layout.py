@@ -0,0 +1,132 @@
+import json
+import logging
+import time
+
+from iceberg_maintenance import metadata_table, table_file_stats
+from offset_store import sql_literal
+
+logger = logging.getLogger('kafka_to_iceberg')
+
+# Table property written for each layout setting. sorted_by and parquet_bloom_filter_columns
+# are only understood by newer Trino releases than the 395 in docker-compose.yml.
+LAYOUT_PROPERTIES = {
+    'partitioning': 'partitioning',
+    'sorted_by': 'sorted_by',
+    'bloom_filter_columns': 'parquet_bloom_filter_columns',
+}
+
+# Iceberg table property that marks a Parquet bloom filter column
+BLOOM_FILTER_PROPERTY = 'write.parquet.bloom-filter-enabled.column.'
+
+
+class TableLayout:
+    """Partition transforms, sort order and Parquet bloom filters of an Iceberg table
+
+    ``partitioning`` holds Iceberg transforms such as ``hour(timestamp)`` or
+    ``bucket(id, 16)``; ``sorted_by`` the columns each data file is sorted on
+    (e.g. partition_id, offset); ``bloom_filter_columns`` the columns that get
+    Parquet bloom filters. Empty lists leave the setting out.
+    """
+
+    def __init__(self, partitioning=(), sorted_by=(), bloom_filter_columns=()):
+        self.partitioning = list(partitioning)
+        self.sorted_by = list(sorted_by)
+        self.bloom_filter_columns = list(bloom_filter_columns)
+
+    def properties(self):
+        """{table property: SQL value} for the settings in use"""
+        properties = {}
+        for setting, name in LAYOUT_PROPERTIES.items():
+            values = getattr(self, setting)
+            if values:
+                properties[name] = array_literal(values)
+        return properties
+
+    def with_clause(self):
+        """WITH (...) clause for CREATE TABLE, or an empty string"""
+        properties = self.properties()
+        if not properties:
+            return ""
+        return "WITH (" + ", ".join(f"{name} = {value}" for name, value in properties.items()) + ")"
+
+    def describe(self):
+        return {setting: getattr(self, setting) for setting in LAYOUT_PROPERTIES}
+
+
+def event_time_column(columns):
+    """Name of the first timestamp column of a message column mapping, or None"""
+    for column in columns:
+        if column['type'].upper().startswith('TIMESTAMP'):
+            return column['name']
+    return None
+
+
+def array_literal(values):
+    return "ARRAY[" + ", ".join(sql_literal(value) for value in values) + "]"
+
+
+def current_table_properties(cursor, table):
+    """Iceberg properties of a table from its $properties metadata table, as {key: value}"""
+    cursor.execute(f"SELECT key, value FROM {metadata_table(table, 'properties')}")
+    return dict(cursor.fetchall())
+
+
+def current_layout(cursor, table):
+    """The layout settings that can be read back from the table's properties
+
+    Only bloom filter columns are Iceberg table properties. The partition spec
+    and sort order are not, so they are left out and always set on migration.
+    """
+    properties = current_table_properties(cursor, table)
+    return {'bloom_filter_columns': sorted(
+        key[len(BLOOM_FILTER_PROPERTY):] for key, value in properties.items()
+        if key.startswith(BLOOM_FILTER_PROPERTY) and value == 'true'
+    )}
+
+
+def migrate_table_layout(cursor, table, layout, rewrite=True, rewrite_threshold_mb=1024):
+    """Move an existing table to ``layout`` while ingestion keeps running
+
+    Changing the properties is a metadata-only commit: files written from then on
+    use the new partition spec, sort order and bloom filters. With ``rewrite`` the
+    existing files are then rewritten by optimize (each file under
+    ``rewrite_threshold_mb``), so older data prunes as well. Iceberg commits the
+    rewrite alongside concurrent appends, so the ingestion job need not stop.
+    Returns a report of the properties changed and the file counts.
+    """
+    start_time = time.monotonic()
+    before = table_file_stats(cursor, table)
+    current = current_layout(cursor, table)
+    properties = layout.properties()
+    changed = {}
+    for setting, name in LAYOUT_PROPERTIES.items():
+        if name not in properties:
+            continue
+        value = properties[name]
+        if setting in current:
+            if sorted(getattr(layout, setting)) == current[setting]:
+                continue
+            logger.info(f"Setting {name} = {value} on {table} (was {current[setting]})")
+        else:
+            logger.info(f"Setting {name} = {value} on {table}")
+        cursor.execute(f"ALTER TABLE {table} SET PROPERTIES {name} = {value}")
+        cursor.fetchall()
+        changed[name] = value
+
+    if rewrite:
+        logger.info(f"Rewriting the data files of {table} with the new layout")
+        cursor.execute(f"ALTER TABLE {table} EXECUTE optimize(file_size_threshold => '{int(rewrite_threshold_mb)}MB')")
+        cursor.fetchall()
+
+    after = table_file_stats(cursor, table)
+    report = {
+        'table': table,
+        'layout': layout.describe(),
+        'properties_changed': changed,
+        'rewritten': rewrite,
+        'files_before': before['files'],
+        'files_after': after['files'],
+        'duration_ms': round((time.monotonic() - start_time) * 1000, 1),
+    }
+    logger.info("layout_migration_report " + json.dumps(report, sort_keys=True))
+    return report
@@ -0,0 +1,137 @@
+import os
+import re
+import sys
+import time
+
+import pytest
+
+# The webapp modules are flat (run from webapp/), so tests import them the same way
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_SNAPSHOT_LOOKUP = re.compile(
+    r'SELECT (\d+), max_by\(snapshot_id, made_current_at\) FROM (.+?)\."?(\w+)\$history"? WHERE is_current_ancestor')
+
+
+class TrinoError(Exception):
+    """Stands in for trino.exceptions.TrinoUserError"""
+
+    def __init__(self, error_name, message=''):
+        super().__init__(message or error_name)
+        self.error_name = error_name
+
+
+class FakeTrino:
+    """Scripted Trino: ``results`` maps SQL to (columns, rows), ``snapshots`` table names to snapshot ids
+
+    ``default`` (if set) answers any other query; without it they fail. A
+    snapshot lookup of a table missing from ``snapshots`` raises TABLE_NOT_FOUND,
+    and ``lookup_error`` (if set) is raised by every snapshot lookup.
+    """
+
+    def __init__(self):
+        self.results = {}
+        self.default = None
+        self.snapshots = {}
+        self.lookup_error = None
+        self.lookups = 0
+        self.executed = []
+
+    def connect(self, config=None):
+        return FakeConnection(self)
+
+
+class FakeConnection:
+    def __init__(self, trino):
+        self.trino = trino
+
+    def cursor(self):
+        return FakeCursor(self.trino)
+
+    def close(self):
+        pass
+
+
+class FakeCursor:
+    def __init__(self, trino):
+        self.trino = trino
+        self.description = None
+        self.stats = {}
+        self._rows = []
+
+    def execute(self, sql):
+        if '$history' in sql:
+            self.trino.lookups += 1
+            if self.trino.lookup_error:
+                raise self.trino.lookup_error
+            rows = []
+            for index, _, table in _SNAPSHOT_LOOKUP.findall(sql):
+                if table not in self.trino.snapshots:
+                    raise TrinoError('TABLE_NOT_FOUND', f"Table '{table}$history' does not exist")
+                rows.append([int(index), self.trino.snapshots[table]])
+            self.description, self._rows = [('index',), ('snapshot_id',)], rows
+            return
+        self.trino.executed.append(sql)
+        if sql in self.trino.results:
+            columns, rows = self.trino.results[sql]
+        elif self.trino.default is not None:
+            columns, rows = self.trino.default
+        else:
+            raise Exception(f"Unexpected query: {sql}")
+        self.description = [(column,) for column in columns]
+        self._rows = [list(row) for row in rows]
+        self.stats = {'queryId': f"query_{len(self.trino.executed)}", 'state': 'FINISHED', 'elapsedTimeMillis': 5}
+
+    def fetchmany(self, size=1):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def cancel(self):
+        pass
+
+
+@pytest.fixture
+def trino():
+    return FakeTrino()
+
+
+@pytest.fixture
+def make_client(trino, monkeypatch):
+    """Test client factory; keyword arguments override app.py settings before the app is built"""
+    import app as webapp
+    apps = []
+
+    def make(**settings):
+        monkeypatch.setattr(webapp, 'get_trino_connection', trino.connect)
+        for name, value in settings.items():
+            monkeypatch.setattr(webapp, name, value)
+        application = webapp.create_app()
+        apps.append(application)
+        return application.test_client()
+
+    yield make
+    for application in apps:
+        webapp.shutdown_app(application, timeout=0)
+
+
+@pytest.fixture
+def client(make_client):
+    return make_client()
+
+
+def run_job(client, query, **fields):
+    """Submit a query the way the SQL editor does and return (status, first results page)"""
+    job = client.post('/jobs', json=dict(fields, query=query)).get_json()
+    deadline = time.monotonic() + 5
+    while True:
+        status = client.get(f"/jobs/{job['job_id']}").get_json()
+        if status['state'] not in ('QUEUED', 'RUNNING') or time.monotonic() > deadline:
+            break
+        time.sleep(0.01)
+    return status, client.get(f"/jobs/{job['job_id']}/results").get_json()
@@ -0,0 +1,78 @@
+from types import SimpleNamespace
+
+from iceberg_maintenance import partition_predicate, run_maintenance
+from kafka_to_iceberg import maintain_tables
+
+COLUMN_TYPES = {'id': 'integer', 'name': 'varchar', 'timestamp': 'timestamp(6)',
+                'created': 'timestamp(6) with time zone', 'day': 'date'}
+
+
+def test_temporal_partitions_become_literal_ranges():
+    assert partition_predicate({'timestamp_day': '2026-10-17'}, COLUMN_TYPES) == (
+        "\"timestamp\" >= TIMESTAMP '2026-10-17 00:00:00' AND \"timestamp\" < TIMESTAMP '2026-10-18 00:00:00'"
+    )
+    # 495,000 hours after the epoch is 2026-06-21 00:00
+    assert partition_predicate({'created_hour': 495000, 'id_bucket': 3}, COLUMN_TYPES) == (
+        "\"created\" >= TIMESTAMP '2026-06-21 00:00:00 UTC' AND \"created\" < TIMESTAMP '2026-06-21 01:00:00 UTC'"
+    )
+    assert partition_predicate({'day_day': '2026-12-31'}, COLUMN_TYPES) == (
+        "\"day\" >= DATE '2026-12-31' AND \"day\" < DATE '2027-01-01'"
+    )
+    assert partition_predicate({'name': "o'k"}, COLUMN_TYPES) == "\"name\" = CAST('o''k' AS varchar)"
+    assert partition_predicate({'timestamp_month': 681}, COLUMN_TYPES) is None
+
+
+class MaintenanceCursor:
+    """Serves the metadata queries of run_maintenance; ``fail`` makes matching statements raise"""
+
+    def __init__(self, fail=None):
+        self.fail = fail
+        self.statements = []
+        self._rows = []
+
+    def execute(self, sql):
+        sql = ' '.join(sql.split())
+        self.statements.append(sql)
+        if self.fail and self.fail in sql:
+            raise Exception("Unexpected FilterNode found in plan; probably connector was not able to handle "
+                            "provided WHERE expression")
+        if sql.startswith('SHOW COLUMNS'):
+            self._rows = [('timestamp', 'timestamp(6)'), ('id', 'integer')]
+        elif '$partitions' in sql and 'LIMIT 0' in sql:
+            self._rows = []
+            self.description = [('partition',), ('file_count',)]
+        elif '$partitions' in sql:
+            self._rows = [('{"timestamp_day":"2026-10-17"}', 80, 1000), ('{"timestamp_day":"2026-10-16"}', 60, 900)]
+        elif '$files' in sql:
+            self._rows = [(140, 1900, 13)]
+        else:
+            self._rows = []
+
+    def fetchone(self):
+        return self._rows[0]
+
+    def fetchall(self):
+        return self._rows
+
+
+def test_optimize_falls_back_to_the_whole_table():
+    cursor = MaintenanceCursor(fail='WHERE "timestamp"')
+    report = run_maintenance(cursor, 'iceberg.default.events')
+
+    optimizes = [sql for sql in cursor.statements if 'optimize' in sql]
+    assert optimizes == [
+        "ALTER TABLE iceberg.default.events EXECUTE optimize(file_size_threshold => '128MB') "
+        "WHERE \"timestamp\" >= TIMESTAMP '2026-10-17 00:00:00' AND \"timestamp\" < TIMESTAMP '2026-10-18 00:00:00'",
+        "ALTER TABLE iceberg.default.events EXECUTE optimize(file_size_threshold => '128MB')",
+    ]
+    assert report['partitions_optimized'] == 2
+    assert any('expire_snapshots' in sql for sql in cursor.statements)
+
+
+def test_maintenance_errors_are_not_raised():
+    args = SimpleNamespace(optimize_min_files=50, optimize_target_file_mb=128, snapshot_retention='7d',
+                           orphan_retention='7d')
+    cursor = MaintenanceCursor(fail='expire_snapshots')
+    assert maintain_tables(cursor, args, ['iceberg.default.a', 'iceberg.default.b']) == 2
+    # The second table was still maintained after the first failed
+    assert any('iceberg.default.b EXECUTE optimize' in sql for sql in cursor.statements)
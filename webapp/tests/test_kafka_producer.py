@@ -0,0 +1,59 @@
+import threading
+import time
+
+import kafka_producer
+from kafka_producer import EventProducer, MockProducer
+
+
+class RecordingProducer(MockProducer):
+    """Counts messages queued after the producer was flushed for close"""
+
+    def __init__(self):
+        self.produced = 0
+        self.closed = False
+        self.after_close = 0
+
+    def produce(self, topic, key=None, value=None, on_delivery=None):
+        # Widen the window in which close() could flush this producer mid-send
+        time.sleep(0.001)
+        self.produced += 1
+        if self.closed:
+            self.after_close += 1
+
+    def poll(self, timeout=None):
+        time.sleep(0.001)
+        return 0
+
+    def flush(self, timeout=None):
+        self.closed = True
+        return 0
+
+
+def test_no_message_is_queued_into_a_closed_producer(monkeypatch):
+    producers = []
+
+    def create(self):
+        producers.append(RecordingProducer())
+        return producers[-1]
+
+    monkeypatch.setattr(kafka_producer.EventProducer, '_create_producer', create)
+    producer = EventProducer('kafka:9092')
+    stop = threading.Event()
+
+    def send():
+        while not stop.is_set():
+            producer.send('events', b'k', b'v')
+
+    senders = [threading.Thread(target=send) for _ in range(4)]
+    for thread in senders:
+        thread.start()
+    for i in range(50):
+        producer.reconfigure(f'kafka-{i}:9092')
+    stop.set()
+    for thread in senders:
+        thread.join()
+    producer.close()
+
+    assert len(producers) > 1
+    assert sum(p.produced for p in producers) > 0
+    assert sum(p.after_close for p in producers) == 0
@@ -0,0 +1,24 @@
+import pytest
+
+from message_columns import EVENT_COLUMNS, message_fields_sql, parsed_message_sql
+
+COLUMNS = EVENT_COLUMNS + [{'name': 'user', 'mapping': 'user', 'type': 'VARCHAR'}]
+
+
+def test_bad_messages_parse_to_a_null_row():
+    # A scalar (42) or malformed message can't be cast to a ROW: TRY makes the whole row NULL
+    sql = parsed_message_sql('_message', COLUMNS)
+    assert sql == ('TRY(CAST(json_parse(CAST(_message AS VARCHAR)) '
+                   'AS ROW("id" JSON, "name" JSON, "timestamp" JSON, "user" JSON)))')
+
+
+def test_nested_object_fields_read_as_null():
+    # {"user": {"id": 1}} keeps the other fields; only the object field is NULL, as with json_extract_scalar
+    fields = message_fields_sql(COLUMNS).split(',\n        ')
+    assert fields[0] == 'CAST(TRY(CAST(event."id" AS VARCHAR)) AS INTEGER) AS "id"'
+    assert fields[3] == 'CAST(TRY(CAST(event."user" AS VARCHAR)) AS VARCHAR) AS "user"'
+
+
+def test_nested_mappings_are_rejected():
+    with pytest.raises(ValueError):
+        parsed_message_sql('_message', [{'name': 'city', 'mapping': 'address/city', 'type': 'VARCHAR'}])
@@ -0,0 +1,97 @@
+import json
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+pa = pytest.importorskip('pyarrow')
+
+from native_ingest import decode_batch, to_arrow
+
+COLUMNS = [
+    {'name': 'order_id', 'mapping': 'id', 'type': 'BIGINT'},
+    {'name': 'amount', 'mapping': 'amount', 'type': 'DECIMAL(10,2)'},
+    {'name': 'paid', 'mapping': 'paid', 'type': 'BOOLEAN'},
+    {'name': 'customer', 'mapping': 'customer', 'type': 'VARCHAR'},
+    {'name': 'created_at', 'mapping': 'created', 'type': 'TIMESTAMP(6)'},
+]
+
+
+class Message:
+    def __init__(self, value, offset, partition=0):
+        self._value, self._offset, self._partition = value, offset, partition
+
+    def value(self):
+        return self._value
+
+    def offset(self):
+        return self._offset
+
+    def partition(self):
+        return self._partition
+
+
+def messages(*values):
+    return [Message(value if isinstance(value, bytes) else json.dumps(value).encode(), offset)
+            for offset, value in enumerate(values)]
+
+
+def test_decodes_the_topic_description_columns():
+    now = datetime(2026, 10, 17, 12, 0)
+    batch = messages(
+        {'id': 7, 'amount': '12.50', 'paid': True, 'customer': 'c1', 'created': '2026-10-17T11:59:00Z'},
+        {'id': 'x', 'amount': 3, 'paid': 'false', 'customer': {'id': 1}},
+    )
+    values, offsets, invalid = decode_batch(batch, now, COLUMNS)
+
+    table = to_arrow(values, COLUMNS)
+    assert table.schema.field('order_id').type == pa.int64()
+    assert table.schema.field('amount').type == pa.decimal128(10, 2)
+    assert table.schema.field('created_at').type == pa.timestamp('us')
+    assert table.column_names == ['order_id', 'amount', 'paid', 'customer', 'created_at',
+                                  'offset', 'partition_id', 'ingest_time']
+    assert table.to_pylist()[0] == {
+        'order_id': 7, 'amount': Decimal('12.50'), 'paid': True, 'customer': 'c1',
+        'created_at': datetime(2026, 10, 17, 11, 59), 'offset': 0, 'partition_id': 0, 'ingest_time': now,
+    }
+    # Fields that don't convert, including objects, are NULL rather than failing the batch
+    second = table.to_pylist()[1]
+    assert (second['order_id'], second['amount'], second['paid'], second['customer'], second['created_at']) == \
+        (None, Decimal('3.00'), False, None, None)
+    assert offsets == {0: 1} and invalid == 0
+
+
+def test_skips_messages_that_are_not_objects():
+    values, offsets, invalid = decode_batch(messages(42, b'{not json', {'id': 1}), datetime.now(), COLUMNS)
+    assert values['order_id'] == [1]
+    assert values['offset'] == [2]
+    assert offsets == {0: 2} and invalid == 2
+
+
+def test_values_that_do_not_fit_the_column_type_are_null():
+    columns = [
+        {'name': 'id', 'mapping': 'id', 'type': 'INTEGER'},
+        {'name': 'amount', 'mapping': 'amount', 'type': 'DECIMAL(10,2)'},
+    ]
+    batch = messages(
+        {'id': 2 ** 40, 'amount': '12.555'},
+        {'id': -2 ** 31, 'amount': '123456789.5'},
+        {'id': 1e300, 'amount': 'NaN'},
+    )
+    values, _, invalid = decode_batch(batch, datetime.now(), columns)
+
+    # Converting the batch must not raise: out-of-range ints and overflowing decimals are NULL
+    table = to_arrow(values, columns)
+    assert table.column('id').to_pylist() == [None, -2 ** 31, None]
+    # Decimals are rounded to the declared scale, as CAST does
+    assert table.column('amount').to_pylist() == [Decimal('12.56'), None, None]
+    assert invalid == 0
+
+
+def test_skips_tombstones_without_orjson(monkeypatch):
+    import native_ingest
+    monkeypatch.setattr(native_ingest, 'json_loads', json.loads)
+    batch = [Message(None, 0), Message(json.dumps({'id': 5}).encode(), 1)]
+    values, offsets, invalid = decode_batch(batch, datetime.now(), COLUMNS)
+    assert values['order_id'] == [5]
+    assert offsets == {0: 1} and invalid == 0
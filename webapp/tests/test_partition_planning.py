@@ -0,0 +1,49 @@
+from kafka_to_iceberg import new_partitions_predicate, pending_partitions_predicate, plan_partitions
+from offset_store import offset_ranges_predicate
+
+
+class PlanCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.sql = None
+
+    def execute(self, sql):
+        self.sql = ' '.join(sql.split())
+
+    def fetchall(self):
+        return self.rows
+
+
+def test_pending_predicate_has_an_offset_bound():
+    # No NOT IN branch: the connector can push the lowest checkpoint down as a start offset
+    assert pending_partitions_predicate({1: 40, 0: 25}) == (
+        "_partition_offset > 25 AND "
+        "((_partition_id = 0 AND _partition_offset > 25) OR (_partition_id = 1 AND _partition_offset > 40))"
+    )
+    assert new_partitions_predicate({1: 40, 0: 25}) == "_partition_id NOT IN (0, 1)"
+
+
+def test_new_partitions_are_planned_in_their_own_scan():
+    cursor = PlanCursor([(0, 26, 30, 5), (2, 0, 3, 4)])
+    pending = plan_partitions(cursor, 'events_topic', {0: 25, 1: 40})
+    assert cursor.sql == (
+        "SELECT _partition_id, MIN(_partition_offset), MAX(_partition_offset), COUNT(*) FROM ( "
+        "SELECT _partition_id, _partition_offset FROM kafka.default.events_topic WHERE _partition_offset > 25 AND "
+        "((_partition_id = 0 AND _partition_offset > 25) OR (_partition_id = 1 AND _partition_offset > 40)) "
+        "UNION ALL "
+        "SELECT _partition_id, _partition_offset FROM kafka.default.events_topic WHERE _partition_id NOT IN (0, 1) "
+        ") GROUP BY _partition_id"
+    )
+    assert pending == {0: (26, 30, 5), 2: (0, 3, 4)}
+
+
+def test_first_run_reads_every_partition_once():
+    cursor = PlanCursor([])
+    plan_partitions(cursor, 'events_topic', {})
+    assert 'UNION ALL' not in cursor.sql and 'WHERE TRUE' in cursor.sql
+
+
+def test_offset_ranges_lead_with_their_bounds():
+    assert offset_ranges_predicate({0: (10, 20), 1: (5, 8)}, 'p', 'o') == (
+        "o > 5 AND o <= 20 AND ((p = 0 AND o > 10 AND o <= 20) OR (p = 1 AND o > 5 AND o <= 8))"
+    )
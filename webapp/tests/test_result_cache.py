@@ -0,0 +1,85 @@
+from conftest import run_job
+
+QUERY = "SELECT name, COUNT(*) AS events FROM iceberg.default.events GROUP BY name"
+ROWS = [['a', 2], ['b', 1], ['c', 5]]
+
+
+def test_jobs_reuse_cached_results_until_a_new_snapshot(client, trino):
+    trino.results[QUERY] = (['name', 'events'], ROWS)
+    trino.snapshots['events'] = 1
+    # Look the snapshot up on every query
+    client.application.extensions['webapp'].result_cache.snapshot_ttl = 0
+
+    status, page = run_job(client, QUERY)
+    assert status['result_cache'] == 'miss'
+    assert page['rows'] == ROWS
+
+    status, page = run_job(client, QUERY)
+    assert status['state'] == 'FINISHED'
+    assert status['result_cache'] == 'hit'
+    assert page['rows'] == ROWS
+    assert trino.executed.count(QUERY) == 1
+
+    trino.snapshots['events'] = 2
+    status, page = run_job(client, QUERY)
+    assert status['result_cache'] == 'miss'
+    assert trino.executed.count(QUERY) == 2
+
+
+def test_paged_results_start_from_the_cache(client, trino):
+    trino.results[QUERY] = (['name', 'events'], ROWS)
+    trino.snapshots['events'] = 1
+    run_job(client, QUERY)
+
+    response = client.post('/execute_query', json={'query': QUERY, 'page_size': 2})
+    assert response.headers['X-Result-Cache'] == 'hit'
+    first = response.get_json()
+    assert first['rows'] == ROWS[:2]
+
+    second = client.post('/execute_query', json={'next_token': first['next_token'], 'page_size': 2}).get_json()
+    assert second['rows'] == ROWS[2:]
+    assert second['next_token'] is None
+    assert trino.executed.count(QUERY) == 1
+
+
+def test_non_iceberg_queries_bypass_the_cache(client, trino):
+    query = "SELECT * FROM kafka.default.events_topic"
+    trino.results[query] = (['id'], [[1]])
+
+    for _ in range(2):
+        status, _ = run_job(client, query)
+        assert status['result_cache'] == 'bypass'
+    assert trino.executed.count(query) == 2
+
+
+def test_transient_lookup_errors_are_not_remembered():
+    from conftest import FakeTrino, TrinoError
+    from result_cache import ResultCache
+
+    trino = FakeTrino()
+    trino.snapshots['events'] = 7
+    cache = ResultCache(1 << 20, snapshot_ttl=0)
+    cursor = trino.connect().cursor()
+    table = ('iceberg', 'default', 'events')
+
+    trino.lookup_error = TrinoError('EXCEEDED_TIME_LIMIT')
+    assert cache.snapshot_ids(cursor, [table]) is None
+    # The next query looks the table up again instead of treating it as uncacheable
+    trino.lookup_error = None
+    assert cache.snapshot_ids(cursor, [table]) == {table: 7}
+
+
+def test_tables_without_history_are_remembered():
+    from conftest import FakeTrino
+    from result_cache import ResultCache
+
+    trino = FakeTrino()
+    trino.snapshots['events'] = 7
+    cache = ResultCache(1 << 20, snapshot_ttl=0)
+    cursor = trino.connect().cursor()
+    view = ('iceberg', 'default', 'events_view')
+
+    assert cache.snapshot_ids(cursor, [('iceberg', 'default', 'events'), view]) is None
+    lookups = trino.lookups
+    assert cache.snapshot_ids(cursor, [view]) is None
+    assert trino.lookups == lookups
@@ -0,0 +1,45 @@
+import json
+
+from conftest import run_job
+
+ROLLUPS = json.dumps([{'source': 'iceberg.default.events_streaming', 'grains': ['minute', 'hour']}])
+QUERY = ("SELECT date_trunc('hour', \"timestamp\") AS hour, name, COUNT(*) AS events "
+         "FROM iceberg.default.events_streaming GROUP BY 1, 2")
+ROWS = [['2026-10-17 10:00:00', 'a', 3]]
+
+
+def routed_sql(trino):
+    return [sql for sql in trino.executed if 'events_streaming_by_name_hour' in sql]
+
+
+def test_jobs_read_aggregates_from_the_rollup(make_client, trino):
+    client = make_client(QUERY_ROLLUPS=ROLLUPS)
+    trino.default = (['hour', 'name', 'events'], ROWS)
+
+    status, page = run_job(client, QUERY, rollups=True)
+    assert status['state'] == 'FINISHED'
+    assert status['routed_to'] == 'iceberg.default.events_streaming_by_name_hour'
+    assert page['rows'] == ROWS
+    assert len(routed_sql(trino)) == 1
+    assert QUERY not in trino.executed
+
+
+def test_jobs_fall_back_to_the_raw_table(make_client, trino):
+    client = make_client(QUERY_ROLLUPS=ROLLUPS)
+    # Only the raw query is answered, as if the rollup table didn't exist yet
+    trino.results[QUERY] = (['hour', 'name', 'events'], ROWS)
+
+    status, page = run_job(client, QUERY)
+    assert status['state'] == 'FINISHED'
+    assert status['routed_to'] is None
+    assert page['rows'] == ROWS
+    assert len(routed_sql(trino)) == 1
+
+
+def test_jobs_can_opt_out_of_rollups(make_client, trino):
+    client = make_client(QUERY_ROLLUPS=ROLLUPS)
+    trino.results[QUERY] = (['hour', 'name', 'events'], ROWS)
+
+    status, _ = run_job(client, QUERY, rollups=False)
+    assert status['routed_to'] is None
+    assert trino.executed == [QUERY]
@@ -0,0 +1,55 @@
+import json
+
+from ingest_daemon import load_pipeline_config
+from table_layout import TableLayout, migrate_table_layout
+
+
+class LayoutCursor:
+    """Answers the metadata queries of migrate_table_layout and records the statements run"""
+
+    def __init__(self, properties):
+        self.properties = properties
+        self.statements = []
+        self._rows = []
+
+    def execute(self, sql):
+        self.statements.append(sql.strip())
+        if '$properties' in sql:
+            self._rows = list(self.properties.items())
+        elif '$files' in sql:
+            self._rows = [(3, 300, 100)]
+        else:
+            self._rows = []
+
+    def fetchone(self):
+        return self._rows[0]
+
+    def fetchall(self):
+        return self._rows
+
+
+def test_migration_sets_only_what_changed():
+    cursor = LayoutCursor({
+        'write.format.default': 'PARQUET',
+        'write.parquet.bloom-filter-enabled.column.id': 'true',
+    })
+    layout = TableLayout(partitioning=['day(timestamp)'], bloom_filter_columns=['id'])
+
+    report = migrate_table_layout(cursor, 'iceberg.default.events', layout, rewrite=False)
+
+    assert cursor.statements[1] == 'SELECT key, value FROM iceberg.default."events$properties"'
+    alters = [sql for sql in cursor.statements if sql.startswith('ALTER')]
+    # The bloom filter is already in $properties; the partition spec can't be read back from them
+    assert alters == ["ALTER TABLE iceberg.default.events SET PROPERTIES partitioning = ARRAY['day(timestamp)']"]
+    assert report['properties_changed'] == {'partitioning': "ARRAY['day(timestamp)']"}
+
+
+def test_pipelines_are_unpartitioned_by_default(tmp_path):
+    config = tmp_path / 'pipelines.json'
+    config.write_text(json.dumps({'pipelines': [
+        {'topic': 'events_topic', 'target_table': 'iceberg.default.events'},
+        {'topic': 'orders', 'target_table': 'iceberg.default.orders', 'partition_by': ['day(timestamp)']},
+    ]}))
+    events, orders = load_pipeline_config(str(config), {})
+    assert events.layout.with_clause() == ""
+    assert orders.layout.partitioning == ['day(timestamp)']
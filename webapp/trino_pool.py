@@ -0,0 +1,220 @@
+import threading
+import time
+import traceback
+from collections import deque
+
+
+class _PooledConnection:
+    """Book-keeping wrapper around a pooled Trino connection"""
+
+    def __init__(self, conn, generation):
+        self.conn = conn
+        self.generation = generation
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class TrinoConnectionPool:
+    """Bounded, thread-safe pool of reusable Trino connections
+
+    Connections are created lazily through the ``connect`` callable (which may
+    return None on failure), health checked only when they have been idle for
+    longer than ``health_check_after`` seconds, and evicted once they exceed
+    ``max_idle`` or ``max_lifetime``. Calling ``reset()`` retires every
+    connection created with the previous settings. When an ``acquire`` is about
+    to time out, ``reclaim`` (if given) may release a connection held elsewhere,
+    e.g. by an abandoned result cursor, and returns whether it did.
+    """
+
+    def __init__(self, connect, max_size=8, acquire_timeout=10.0,
+                 health_check_after=30.0, max_idle=300.0, max_lifetime=1800.0, reclaim=None):
+        self._connect = connect
+        self._reclaim = reclaim
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.health_check_after = health_check_after
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._in_use = {}
+        self._size = 0
+        self._generation = 0
+
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._created = 0
+        self._evicted = 0
+        self._health_check_failures = 0
+        self._checkout_time_total = 0.0
+        self._checkout_time_max = 0.0
+
+    def acquire(self):
+        """Check out a connection, or return None if none could be obtained"""
+        start = time.monotonic()
+        deadline = start + self.acquire_timeout
+        entry = None
+        stale = []
+        timed_out = False
+        reclaimed = False
+
+        with self._cond:
+            waited = False
+            while True:
+                stale.extend(self._evict_stale_locked())
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    # Reserve a slot; the connection is opened outside the lock
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 and self._reclaim is not None and not reclaimed:
+                    reclaimed = True
+                    # reclaim releases into this pool, so it runs without the lock
+                    self._cond.release()
+                    try:
+                        freed = self._reclaim()
+                    except Exception:
+                        traceback.print_exc()
+                        freed = False
+                    finally:
+                        self._cond.acquire()
+                    if freed:
+                        continue
+                if remaining <= 0:
+                    self._timeouts += 1
+                    timed_out = True
+                    break
+                waited = True
+                self._cond.wait(remaining)
+            if waited:
+                self._waits += 1
+            generation = self._generation
+
+        self._close_all(stale)
+
+        if timed_out:
+            print(f"Timed out waiting {self.acquire_timeout}s for a pooled Trino connection")
+            return None
+
+        if entry is not None and time.monotonic() - entry.last_used > self.health_check_after:
+            if not self._is_healthy(entry.conn):
+                with self._cond:
+                    self._health_check_failures += 1
+                # The broken connection's slot is reused for a fresh one below
+                self._close_all([entry])
+                entry = None
+
+        if entry is None:
+            conn = self._connect()
+            if conn is None:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                return None
+            entry = _PooledConnection(conn, generation)
+            with self._cond:
+                self._created += 1
+
+        elapsed = time.monotonic() - start
+        with self._cond:
+            self._in_use[id(entry.conn)] = entry
+            self._checkouts += 1
+            self._checkout_time_total += elapsed
+            self._checkout_time_max = max(self._checkout_time_max, elapsed)
+        return entry.conn
+
+    def release(self, conn, discard=False):
+        """Return a connection to the pool, closing it if it is broken or outdated"""
+        if conn is None:
+            return
+        with self._cond:
+            entry = self._in_use.pop(id(conn), None)
+            if entry is None:
+                # Not ours (or already released); just make sure it's closed
+                retire = _PooledConnection(conn, -1)
+            elif discard or entry.generation != self._generation:
+                retire = entry
+                self._size -= 1
+            else:
+                entry.last_used = time.monotonic()
+                self._idle.append(entry)
+                retire = None
+            self._cond.notify()
+        if retire is not None:
+            self._close_all([retire])
+
+    def reset(self):
+        """Retire all connections so new ones pick up changed settings"""
+        with self._cond:
+            self._generation += 1
+            retired = list(self._idle)
+            self._idle.clear()
+            self._size -= len(retired)
+            self._evicted += len(retired)
+            self._cond.notify_all()
+        self._close_all(retired)
+        print(f"Trino connection pool reset (generation {self._generation}), closed {len(retired)} idle connections")
+
+    def close(self):
+        """Close all idle connections; checked-out ones are closed on release"""
+        self.reset()
+
+    def stats(self):
+        """Return a snapshot of the pool metrics"""
+        with self._cond:
+            checkouts = self._checkouts
+            return {
+                'max_size': self.max_size,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': len(self._in_use),
+                'generation': self._generation,
+                'checkouts': checkouts,
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+                'created': self._created,
+                'evicted': self._evicted,
+                'health_check_failures': self._health_check_failures,
+                'avg_checkout_ms': round(self._checkout_time_total * 1000 / checkouts, 3) if checkouts else 0.0,
+                'max_checkout_ms': round(self._checkout_time_max * 1000, 3),
+            }
+
+    def _evict_stale_locked(self):
+        """Remove idle connections past their idle/lifetime limits (lock held)"""
+        now = time.monotonic()
+        keep = deque()
+        stale = []
+        for entry in self._idle:
+            if now - entry.last_used > self.max_idle or now - entry.created_at > self.max_lifetime:
+                stale.append(entry)
+            else:
+                keep.append(entry)
+        if stale:
+            self._idle = keep
+            self._size -= len(stale)
+            self._evicted += len(stale)
+        return stale
+
+    @staticmethod
+    def _is_healthy(conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            return True
+        except Exception as e:
+            print(f"Pooled Trino connection failed health check: {str(e)}")
+            return False
+
+    @staticmethod
+    def _close_all(entries):
+        for entry in entries:
+            try:
+                entry.conn.close()
+            except Exception:
+                traceback.print_exc()